@@ -2,19 +2,44 @@
 Refactored journal agent: two reusable helpers, minimal abstraction.
 """
 
+import json
 import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from types import MappingProxyType
 from typing import Literal
 
+from .cassette import Cassette, cassette_from_env
 from .journal_common import MODELS, create_llm, openai_2_langchain, describe_emotion
+from .ledger import Account
+from .message_log import MessageLog, Transcript
+from .output_budget import OUTPUT_BUDGETS
+from .scheduler import LLM_GATE
+from .token_estimate import TOKEN_ESTIMATOR, raw_tokens
+from .tracing import current_span, enabled as tracing_enabled, span, watch_retries
 
 Phase = Literal["cbt", "narrative", "finalize"]
 
+# Rolling CBT summary: reframe() works from a summary kept up to date in the background
+ROLLING_SUMMARY = os.getenv("CAMI_ROLLING_SUMMARY", "") not in ("", "0")
+SUMMARY_RECENT_MESSAGES = 4  # verbatim CBT messages sent alongside the summary
+SUMMARY_WAIT = 15.0  # seconds reframe() waits for an in-flight summary update
+SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cbt-summary")
+# Fused `next`: one structured call returns the reframed journal and the narrative opening
+FUSED_NEXT = os.getenv("CAMI_FUSED_NEXT", "") not in ("", "0")
+NARRATIVE_OPENING = "讓我們更深入地探索這個故事。"  # user turn that opens the narrative conversation
 
+
+@lru_cache(maxsize=None)
 def load_prompts():
     """Load prompts from journal_prompt.txt file."""
     """Format: [SECTION_NAME]
-    Section content"""
+    Section content
+    Read once; every agent shares the same read-only mapping."""
     prompt_file = os.path.join(os.path.dirname(__file__), "journal_prompt.txt")
     with open(prompt_file, "r") as f:
         content = f.read()
@@ -35,11 +60,51 @@ def load_prompts():
     if current_section:
         sections[current_section] = "\n".join(current_content).strip()
 
-    return sections
+    return MappingProxyType(sections)
+
+
+def cbt_system_prompt(valence: float, support_type: float) -> str:
+    """SYSTEM_PROMPT + emotion description; one shared string per emotion bucket."""
+    return sys.intern(load_prompts()["SYSTEM_PROMPT"] + describe_emotion(valence, support_type))
+
+
+SYSTEM_PROMPTS = {
+    "cbt": lambda p, valence, support_type: cbt_system_prompt(valence, support_type),
+    "narrative": lambda p, reframed_journal: f"{p['NARRATIVE_PROMPT']}\n\n### Reframed Journal:\n{reframed_journal}",
+    "feedback": lambda p, **kwargs: p["FEEDBACK_PROMPT"].format(**kwargs),
+}
+
+
+class PromptRef:
+    """A system prompt kept as a shared template key plus the session's own values.
+
+    The template text is never copied into the session; it is rendered when sent.
+    """
+
+    __slots__ = ("key", "params")
+
+    def __init__(self, key: str, **params):
+        self.key = key
+        self.params = params
+
+    def __str__(self) -> str:
+        return SYSTEM_PROMPTS[self.key](load_prompts(), **self.params)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PromptRef):
+            return self.key == other.key and self.params == other.params
+        return str(self) == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"PromptRef({self.key!r})"
 
 
 def build_conversation_text(messages: list[dict], skip: int = 2) -> str:
     """Turn a message list into a readable transcript, skipping the first `skip` messages."""
+    if isinstance(messages, MessageLog):
+        return messages.transcript(skip).text
     lines = []
     for msg in messages[skip:]:
         role = "You" if msg["role"] == "user" else "Agent"
@@ -47,66 +112,279 @@ def build_conversation_text(messages: list[dict], skip: int = 2) -> str:
     return "\n\n".join(lines)
 
 
+def parse_json_object(text: str) -> dict | None:
+    """First {...} object in an LLM reply, or None."""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        value = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def drain(steps):
+    """Run a step generator to completion and return its result (the non-streaming path)."""
+    try:
+        while True:
+            next(steps)
+    except StopIteration as done:
+        return done.value
+
+
+def traced(name: str):
+    """Run a JournalAgent step generator inside a trace span tagged with its session and phase."""
+    def decorate(steps):
+        @wraps(steps)
+        def traced_steps(self, *args, **kwargs):
+            phase = self.phase
+            with span(name, session_id=self.queue_key, phase=phase) as s:
+                result = yield from steps(self, *args, **kwargs)
+                if self.phase != phase:
+                    s.set(phase_after=self.phase)
+                return result
+        return traced_steps
+    return decorate
+
+
+def _chunk_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def make_greeting(valence: float, support_type: float) -> str:
+    """Generate initial greeting based on emotion coordinates."""
+    compassion = support_type < 0
+    if valence < -0.3:
+        if compassion:
+            return "Counselor: 看起來你今天心情不太好，我在這裡陪你，想聊聊嗎？"
+        return "Counselor: 看起來今天遇到了一些困難，想一起來想想辦法嗎？"
+    elif valence > 0.3:
+        if compassion:
+            return "Counselor: 今天感覺還不錯呢！想把這份心情記錄下來嗎？"
+        return "Counselor: 今天似乎有些收穫，想記錄一下嗎？"
+    else:
+        if compassion:
+            return "Counselor: 今天想寫些什麼呢？我在這裡聽你說。"
+        return "Counselor: 今天有什麼想法想整理一下嗎？"
+
+
 class LLMService:
-    """Wraps a LangChain chat model."""
+    """Wraps a LangChain chat model, optionally through a record/replay cassette.
 
-    def __init__(self, llm, model_name: str):
-        self.llm = llm
+    With `llm=None` the model is create_llm(model_name), created on first use.
+    """
+
+    def __init__(self, llm, model_name: str, cassette: Cassette | None = None):
+        self._llm = llm
         self.model_name = model_name
+        self.cassette = cassette or cassette_from_env()
         self.last_metadata: dict | None = None
+        self.queue_key: str | None = None  # fair-queuing key for the upstream gate (the session)
+        self.account: Account | None = None  # quota check and usage ledger (see ledger.py)
 
-    def invoke(self, messages: list[dict]) -> str:
-        """Call LLM with a list of messages."""
-        lc_messages = openai_2_langchain(messages)
-        start = time.time()
-        response = self.llm.invoke(lc_messages)
-        elapsed = time.time() - start
-
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = create_llm(self.model_name)
+            if tracing_enabled():
+                watch_retries(self._llm)
+        return self._llm
+
+    def warm(self) -> None:
+        """Import the LLM libraries and build the HTTP client now instead of on the first call."""
+        getattr(self.llm, "_client", None)
+
+    def _call(self, messages: list[dict], max_tokens: int) -> dict:
+        response = self.llm.invoke(openai_2_langchain(messages), max_tokens=max_tokens)
         usage = response.response_metadata.get("usage", {})
+        return {
+            "response": response.content,
+            "usage": {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)},
+            "stop_reason": response.response_metadata.get("stop_reason"),
+        }
+
+    def _set_metadata(self, usage: dict, elapsed: float, kind: str | None, max_tokens: int,
+                      stop_reason: str | None) -> None:
+        truncated = stop_reason == "max_tokens"
         self.last_metadata = {
             "input_tokens": usage.get("input_tokens", 0),
             "output_tokens": usage.get("output_tokens", 0),
             "elapsed_time": elapsed,
             "model": self.model_name,
+            "max_tokens": max_tokens,
+            "truncated": truncated,
         }
-        return response.content
+        OUTPUT_BUDGETS.record(kind, usage.get("output_tokens", 0), max_tokens, truncated, self.queue_key)
+        current_span().set(max_tokens=max_tokens)
+        if truncated:
+            current_span().set(truncated=True)
+        if self.account is not None:
+            self.account.record(self.model_name, usage)
+
+    def _preflight(self, messages: list[dict]) -> tuple[float, int]:
+        """Raw and calibrated input token estimates (see token_estimate.py); checks the quota."""
+        raw = raw_tokens(messages)
+        estimated = round(raw * TOKEN_ESTIMATOR.factor(self.model_name))
+        current_span().set(estimated_input_tokens=estimated)
+        if self.account is not None:
+            self.account.check(estimated)
+        return raw, estimated
+
+    @contextmanager
+    def _slot(self, estimated_tokens: int, priority: str):
+        """An upstream gate slot; the time spent waiting for it goes on the current span."""
+        queued = time.perf_counter()
+        with LLM_GATE.slot(priority, self.queue_key, estimated_tokens):
+            current_span().set(queue_wait=round(time.perf_counter() - queued, 6))
+            yield
+
+    def _cassette_request(self, messages) -> dict:
+        """Cassette key material: plain messages with system prompts rendered (not a MessageLog repr)."""
+        return {"model": self.model_name,
+                "messages": [{"role": m["role"], "content": str(m["content"])} for m in messages]}
+
+    def _gated_call(self, messages: list[dict], priority: str, max_tokens: int, estimated_tokens: int) -> dict:
+        with self._slot(estimated_tokens, priority):
+            return self._call(messages, max_tokens)
+
+    def invoke(self, messages: list[dict], priority: str = "interactive", kind: str | None = None) -> str:
+        """Call LLM with a list of messages. `priority` is the scheduler class (see scheduler.py),
+        `kind` labels the call for its output budget (see output_budget.py)."""
+        with span("llm.invoke", model=self.model_name, priority=priority, kind=kind) as s:
+            raw, estimated = self._preflight(messages)
+            max_tokens = OUTPUT_BUDGETS.max_tokens(kind)
+            start = time.time()
+            if self.cassette:
+                result = self.cassette.through(self._cassette_request(messages),
+                                               lambda: self._gated_call(messages, priority, max_tokens, estimated))
+            else:
+                result = self._gated_call(messages, priority, max_tokens, estimated)
+            self._set_metadata(result["usage"], time.time() - start, kind, max_tokens, result.get("stop_reason"))
+            TOKEN_ESTIMATOR.calibrate(self.model_name, raw, result["usage"]["input_tokens"])
+            s.set(**result["usage"])
+            return result["response"]
+
+    def stream(self, messages: list[dict], priority: str = "interactive", kind: str | None = None):
+        """Yield text chunks as they arrive; the generator returns the full text.
+
+        Closing the generator early closes the upstream stream; last_metadata is only
+        updated (and a cassette only records) when the stream completes.
+        """
+        if self.cassette and self.cassette.mode == "replay":
+            text = self.invoke(messages, priority, kind)
+            yield text
+            return text
+
+        with span("llm.stream", model=self.model_name, priority=priority, kind=kind) as s:
+            raw, estimated = self._preflight(messages)
+            max_tokens = OUTPUT_BUDGETS.max_tokens(kind)
+            start = time.time()
+            parts, aggregate = [], None
+            # The slot is held until the upstream stream is done or closed
+            with self._slot(estimated, priority):
+                chunks = self.llm.stream(openai_2_langchain(messages), max_tokens=max_tokens)
+                try:
+                    for chunk in chunks:
+                        aggregate = chunk if aggregate is None else aggregate + chunk
+                        text = _chunk_text(chunk.content)
+                        if text:
+                            if not parts:
+                                s.set(first_chunk=round(time.time() - start, 6))
+                            parts.append(text)
+                            yield text
+                finally:
+                    chunks.close()
+
+            text = "".join(parts)
+            usage = dict((aggregate.usage_metadata if aggregate is not None else None) or {})
+            usage = {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+            stop_reason = aggregate.response_metadata.get("stop_reason") if aggregate is not None else None
+            elapsed = time.time() - start
+            self._set_metadata(usage, elapsed, kind, max_tokens, stop_reason)
+            TOKEN_ESTIMATOR.calibrate(self.model_name, raw, usage["input_tokens"])
+            s.set(**usage)
+            if self.cassette:
+                self.cassette.add(self._cassette_request(messages),
+                                  {"response": text, "usage": usage, "stop_reason": stop_reason,
+                                   "latency": round(elapsed, 4)})
+            return text
+
+    def call(self, messages: list[dict], stream: bool = False, priority: str = "interactive",
+             kind: str | None = None):
+        """Step generator: streams chunks when `stream`, otherwise a single blocking invoke."""
+        if stream:
+            return (yield from self.stream(messages, priority, kind))
+        return self.invoke(messages, priority, kind)
 
 
 class OneShotPhase:
     """Call LLM once with a formatted prompt, return the result."""
 
-    def __init__(self, llm: LLMService, prompt_template: str):
+    def __init__(self, llm: LLMService, prompt_template: str, priority: str = "one_shot", kind: str | None = None):
         self.llm = llm
         self.prompt_template = prompt_template
+        self.priority = priority
+        self.kind = kind  # output budget label (see output_budget.py)
 
     def execute(self, **kwargs) -> str:
         """Call LLM with a formatted prompt."""
         """ kwargs are passed to the prompt template """
-        prompt = self.prompt_template.format(**kwargs)
-        return self.llm.invoke([{"role": "user", "content": prompt}])
+        return self.llm.invoke(self.request(**kwargs), self.priority, self.kind)
+
+    def _execute(self, stream: bool, **kwargs):
+        return (yield from self.llm.call(self.request(**kwargs), stream, self.priority, self.kind))
+
+    def request(self, **kwargs) -> list[dict]:
+        """The messages execute() would send."""
+        return [{"role": "user", "content": self.prompt_template.format(**kwargs)}]
 
 
 class ConversationPhase:
     """Maintain a multi-turn conversation with system prompt."""
 
-    def __init__(self, llm: LLMService):
+    def __init__(self, llm: LLMService, kind: str | None = None):
         self.llm = llm
-        self.messages: list[dict] = []
+        self.kind = kind  # output budget label (see output_budget.py)
+        self.messages = []
+
+    @property
+    def messages(self) -> MessageLog:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages) -> None:
+        self._messages = messages if isinstance(messages, MessageLog) else MessageLog(messages)
+
+    @property
+    def transcript(self) -> Transcript:
+        """Transcript used by the reframe/summarize prompts (skips system + opening message)."""
+        return self._messages.transcript()
 
     def start(self, system_content: str, first_user_msg: str) -> str:
-        self.messages = [
+        return drain(self._start(system_content, first_user_msg, stream=False))
+
+    def _start(self, system_content, first_user_msg: str, stream: bool):
+        # The new conversation replaces the old one only once the reply is complete
+        messages = MessageLog([
             {"role": "system", "content": system_content},
             {"role": "user", "content": first_user_msg},
-        ]
-        response = self.llm.invoke(self.messages)
-        self.messages.append({"role": "assistant", "content": response})
+        ])
+        response = yield from self.llm.call(messages, stream, "phase_start", self.kind)
+        messages.append({"role": "assistant", "content": response})
+        self.messages = messages
         return response
 
     def receive(self, user_input: str) -> None:
         self.messages.append({"role": "user", "content": user_input})
 
     def reply(self) -> str:
-        response = self.llm.invoke(self.messages)
+        return drain(self._reply(stream=False))
+
+    def _reply(self, stream: bool):
+        response = yield from self.llm.call(self.messages, stream, "interactive", self.kind)
         self.messages.append({"role": "assistant", "content": response})
         return response
 
@@ -117,9 +395,20 @@ class JournalAgent:
         "narrative": {"summarize": "summarize", "finalize": "finalize"},
         "finalize":  {"end": "_end"},
     }
+    DEFERRABLE = ("reframe", "summarize")  # commands that can run later through a batch
+    # Serialized conversation name -> (phase attribute, system prompt key)
+    CONVERSATIONS = {
+        "cbt":       ("cbt_phase", "cbt"),
+        "narrative": ("narrative_phase", "narrative"),
+        "finalize":  ("finalize_phase", "feedback"),
+    }
+    STATE_FIELDS = ("init_journal", "reframed_journal", "origin_reframed_journal", "final_summary", "journal_title",
+                    "one_shot_digests", "rolling_summary", "fused_next", "cbt_summary", "cbt_summary_upto", "cbt_summary_stats",
+                    "user_id")
 
-    def __init__(self, model="opus", valence: float = 0.0, support_type: float = 0.0):
-        llm = LLMService(create_llm(model), model)
+    def __init__(self, model="opus", valence: float = 0.0, support_type: float = 0.0,
+                 rolling_summary: bool = ROLLING_SUMMARY, fused_next: bool = FUSED_NEXT):
+        llm = LLMService(None, model)
         prompts = load_prompts()
         self.llm = llm
         self.prompts = prompts
@@ -131,35 +420,80 @@ class JournalAgent:
         self.reframed_journal: str | None = None
         self.final_summary: str | None = None
         self.phase: Phase = "cbt"
+        self.user_id: str | None = None  # who usage is billed to (see ledger.py); None = the session
+        # Transcript digest each one-shot result was built from ("reframe", "summarize")
+        self.one_shot_digests: dict[str, str] = {}
 
         # Phase objects
-        self.cbt_phase = ConversationPhase(llm)
+        self.cbt_phase = ConversationPhase(llm, "cbt")
         self.cbt_phase.messages = [
-            {"role": "system", "content": prompts["SYSTEM_PROMPT"] + describe_emotion(valence, support_type)},
+            {"role": "system", "content": self._system_prompt("cbt")},
             {"role": "assistant", "content": self._make_greeting()},
         ]
 
         # One-shot phases
-        self.reframe_phase = OneShotPhase(llm, prompts["REFRAME_PROMPT"])
-        self.summarize_phase = OneShotPhase(llm, prompts["SUMMARIZE_PROMPT"])
-        self.narrative_phase = ConversationPhase(llm)
-        self.finalize_phase = ConversationPhase(llm)
+        self.reframe_phase = OneShotPhase(llm, prompts["REFRAME_PROMPT"], kind="reframe")
+        self.summarize_phase = OneShotPhase(llm, prompts["SUMMARIZE_PROMPT"], kind="summarize")
+        self.narrative_phase = ConversationPhase(llm, "narrative")
+        self.finalize_phase = ConversationPhase(llm, "feedback")
+        self.fused_next = fused_next
+        self._fused_next_phase = OneShotPhase(llm, prompts["REFRAME_AND_NARRATIVE_PROMPT"], "phase_start", "fused_next")
+
+        # Rolling CBT summary (own LLMService so background calls don't touch last_metadata)
+        self.rolling_summary = rolling_summary
+        self.cbt_summary: dict | None = None
+        self.cbt_summary_upto = 0  # cbt messages[:cbt_summary_upto] are folded into cbt_summary
+        self.cbt_summary_stats = {"updates": 0, "input_tokens": 0, "output_tokens": 0, "reframe_tokens_saved": 0}
+        self._summary_llm = LLMService(None, model, cassette=llm.cassette)
+        self._summary_phase = OneShotPhase(self._summary_llm, prompts["CBT_SUMMARY_PROMPT"], "background",
+                                           "cbt_summary")
+        self._reframe_from_summary_phase = OneShotPhase(llm, prompts["REFRAME_FROM_SUMMARY_PROMPT"], kind="reframe")
+        self._summary_lock = threading.Lock()
+        self._summary_future = None
+
+        # Called as on_event(type, data) after every committed state change (see apply_event)
+        self.on_event = None
+        self._held_events: list | None = None  # events of a command not finished yet (see _run_command)
+        self.queue_key = f"agent-{id(self):x}"
+
+    def _system_prompt(self, key: str, **pending):
+        """System prompt for a phase, built from shared prompt text and this session's state.
+
+        `pending` overrides state a phase change has not committed yet (reframed_journal, title).
+        """
+        if key == "cbt":
+            return cbt_system_prompt(self.valence, self.support_type)
+        if key == "narrative":
+            reframed_journal = pending.get("reframed_journal") or self.origin_reframed_journal
+            return PromptRef(key, reframed_journal=reframed_journal)
+        return PromptRef(
+            key,
+            title=pending.get("title") or self.journal_title,
+            origin_story=getattr(self, "origin_reframed_journal", self.reframed_journal) or "",
+            summary=self.final_summary,
+        )
 
     def _make_greeting(self) -> str:
         """Generate initial greeting based on emotion coordinates."""
-        compassion = self.support_type < 0
-        if self.valence < -0.3:
-            if compassion:
-                return "Counselor: 看起來你今天心情不太好，我在這裡陪你，想聊聊嗎？"
-            return "Counselor: 看起來今天遇到了一些困難，想一起來想想辦法嗎？"
-        elif self.valence > 0.3:
-            if compassion:
-                return "Counselor: 今天感覺還不錯呢！想把這份心情記錄下來嗎？"
-            return "Counselor: 今天似乎有些收穫，想記錄一下嗎？"
-        else:
-            if compassion:
-                return "Counselor: 今天想寫些什麼呢？我在這裡聽你說。"
-            return "Counselor: 今天有什麼想法想整理一下嗎？"
+        return make_greeting(self.valence, self.support_type)
+
+    @property
+    def queue_key(self) -> str | None:
+        """Key this agent's LLM calls are fair-queued under (the API sets it to the session id)."""
+        return self.llm.queue_key
+
+    @queue_key.setter
+    def queue_key(self, key: str | None) -> None:
+        self.llm.queue_key = self._summary_llm.queue_key = key
+
+    @property
+    def account(self) -> Account | None:
+        """Ledger account this agent's LLM calls are quota-checked against and billed to."""
+        return self.llm.account
+
+    @account.setter
+    def account(self, account: Account | None) -> None:
+        self.llm.account = self._summary_llm.account = account
 
     @property
     def last_metadata(self):
@@ -182,56 +516,259 @@ class JournalAgent:
         if self.phase == "cbt" and self.init_journal is None: # init_journal is None when in CBT phase, user_input is the initial journal
             self.init_journal = user_input
         self._active_conversation.receive(user_input)
+        self._emit("receive", content=user_input)
+
+    def check_quota(self, user_input: str | None = None) -> None:
+        """Raise QuotaExceeded if the next reply (to `user_input`) is estimated to go over quota.
+
+        Called before receive(), so a rejected turn is never stored.
+        """
+        if self.account is None:
+            return
+        messages = self._active_conversation.messages
+        if user_input is not None:
+            messages = [*messages, {"role": "user", "content": user_input}]
+        self.account.check(TOKEN_ESTIMATOR.estimate(messages, self.llm.model_name))
+
+    def unreceive(self) -> None:
+        """Take back an unanswered user turn whose reply failed, so the next turn doesn't follow it."""
+        messages = self._active_conversation.messages
+        if not messages or messages[-1]["role"] != "user":
+            return
+        messages.pop()
+        if self.phase == "cbt" and not any(m["role"] == "user" for m in messages):
+            self.init_journal = None  # it was the initial journal
+        self._emit("unreceive")
 
     def reply(self) -> str:
-        return self._active_conversation.reply()
+        return drain(self._reply_steps(stream=False))
+
+    def reply_stream(self):
+        """reply() as a generator: text chunks, then a final record (see command_stream)."""
+        return self._streamed(self._reply_steps(stream=True))
+
+    @traced("agent.reply")
+    def _reply_steps(self, stream: bool):
+        response = yield from self._active_conversation._reply(stream)
+        self._emit("reply", content=response)
+        if self.rolling_summary and self.phase == "cbt":
+            self._summary_future = SUMMARY_EXECUTOR.submit(self._update_cbt_summary)
+        return response
+
+    def _update_cbt_summary(self) -> None:
+        """Fold CBT messages not yet in cbt_summary into it (runs in the background)."""
+        with self._summary_lock:
+            messages = self.cbt_phase.messages
+            start, end = max(2, self.cbt_summary_upto), len(messages)
+            if end <= start or not self.init_journal:
+                return
+            raw = self._summary_phase.execute(
+                init_journal=self.init_journal,
+                summary=json.dumps(self.cbt_summary, ensure_ascii=False) if self.cbt_summary else "（尚無）",
+                conversation=build_conversation_text(messages[start:end], skip=0),
+            )
+            meta = self._summary_llm.last_metadata or {}
+            self.cbt_summary_stats["input_tokens"] += meta.get("input_tokens", 0)
+            self.cbt_summary_stats["output_tokens"] += meta.get("output_tokens", 0)
+            summary = parse_json_object(raw)
+            if summary is None:
+                return  # keep cbt_summary_upto so the next update retries these turns
+            self.cbt_summary = summary
+            self.cbt_summary_upto = end
+            self.cbt_summary_stats["updates"] += 1
+            # Not _emit: a command waiting for this update holds its events, and may still be abandoned
+            self._publish("cbt_summary", {"summary": summary, "upto": end, "stats": dict(self.cbt_summary_stats)})
+
+    def _ready_cbt_summary(self) -> dict | None:
+        """The rolling summary once any in-flight update has finished, else None."""
+        future = self._summary_future
+        if future is not None:
+            try:
+                future.result(timeout=SUMMARY_WAIT)
+            except Exception:
+                return None
+        return self.cbt_summary
 
     def reframe(self) -> str:
+        return drain(self._reframe_steps(stream=False))
+
+    @traced("agent.reframe")
+    def _reframe_steps(self, stream: bool):
         if not self.init_journal:
             return "沒有初始日記可以整理。"
 
-        conversation = build_conversation_text(self.cbt_phase.messages)
-        self.reframed_journal = self.reframe_phase.execute(
-            init_journal=self.init_journal,
-            conversation=conversation,
-        )
-        return self.reframed_journal
+        transcript = self.cbt_phase.transcript
+        digest = transcript.digest
+        summary = self._ready_cbt_summary() if self.rolling_summary else None
+        if summary:
+            messages = self.cbt_phase.messages
+            recent_start = max(2, min(self.cbt_summary_upto, len(messages) - SUMMARY_RECENT_MESSAGES))
+            summary_text = json.dumps(summary, ensure_ascii=False)
+            recent = build_conversation_text(messages[recent_start:], skip=0)
+            reframed = yield from self._reframe_from_summary_phase._execute(
+                stream,
+                init_journal=self.init_journal,
+                summary=summary_text,
+                conversation=recent,
+            )
+            self._report_reframe_savings(transcript.text, summary_text + recent)
+        else:
+            reframed = yield from self.reframe_phase._execute(
+                stream,
+                init_journal=self.init_journal,
+                conversation=transcript.text,
+            )
+        self._commit_reframe(reframed, digest)
+        return reframed
+
+    def _commit_reframe(self, reframed: str, digest: str) -> None:
+        self.reframed_journal = reframed
+        self.one_shot_digests["reframe"] = digest
+        self._emit("reframe", reframed_journal=reframed, digest=digest)
+
+    def _report_reframe_savings(self, full_text: str, used_text: str) -> None:
+        """Estimate input tokens saved vs. embedding the whole transcript; added to last_metadata."""
+        meta = self.llm.last_metadata
+        if not meta:
+            return
+        estimate = TOKEN_ESTIMATOR.estimate_text
+        saved = max(0, estimate(full_text, self.llm.model_name) - estimate(used_text, self.llm.model_name))
+        meta["tokens_saved"] = saved
+        self.cbt_summary_stats["reframe_tokens_saved"] += saved
 
     def start_narrative(self, reframed_journal: str | None = None) -> str:
-        if reframed_journal:
-            self.reframed_journal = reframed_journal
-        if not self.reframed_journal:
+        return drain(self._start_narrative_steps(reframed_journal, stream=False))
+
+    @traced("agent.start_narrative")
+    def _start_narrative_steps(self, reframed_journal: str | None = None, stream: bool = False):
+        reframed_journal = reframed_journal or self.reframed_journal
+        if not reframed_journal:
             return "沒有可用的整理日記。請先完成整理步驟或提供一份日記。"
 
+        system = self._system_prompt("narrative", reframed_journal=reframed_journal)
+        response = yield from self.narrative_phase._start(system, NARRATIVE_OPENING, stream)
+        self._enter_narrative(reframed_journal)
+        return response
+
+    @traced("agent.fused_next")
+    def _fused_next_steps(self):
+        """Reframe + narrative opening in one structured call. Returns None (nothing
+        committed) if the reply isn't usable, so the caller can take the two-call path."""
+        transcript = self.cbt_phase.transcript
+        digest = transcript.digest
+        raw = yield from self._fused_next_phase._execute(
+            False,  # JSON isn't worth streaming; the opening is sent in one piece
+            narrative_prompt=self.prompts["NARRATIVE_PROMPT"],
+            init_journal=self.init_journal,
+            conversation=transcript.text,
+        )
+        fused = parse_json_object(raw) or {}
+        reframed, opening = fused.get("reframed_journal"), fused.get("opening")
+        if not (isinstance(reframed, str) and reframed.strip() and isinstance(opening, str) and opening.strip()):
+            return None
+
+        self.narrative_phase.messages = [
+            {"role": "system", "content": self._system_prompt("narrative", reframed_journal=reframed)},
+            {"role": "user", "content": NARRATIVE_OPENING},
+            {"role": "assistant", "content": opening},
+        ]
+        self.one_shot_digests["reframe"] = digest
+        self._enter_narrative(reframed)
+        self._emit("reframe", reframed_journal=reframed, digest=digest)
+        return opening
+
+    def _enter_narrative(self, reframed_journal: str) -> None:
+        self.reframed_journal = reframed_journal
         self.phase = "narrative"
-        self.origin_reframed_journal = self.reframed_journal
-        system = f"{self.prompts['NARRATIVE_PROMPT']}\n\n### Reframed Journal:\n{self.reframed_journal}"
-        return self.narrative_phase.start(system, "讓我們更深入地探索這個故事。")
+        self.origin_reframed_journal = reframed_journal
+        self.cbt_phase.messages.drop_views()
+        self._emit("phase", phase="narrative", reframed_journal=reframed_journal,
+                   messages=self.narrative_phase.messages[1:])
 
     def summarize(self) -> str:
+        return drain(self._summarize_steps(stream=False))
+
+    @traced("agent.summarize")
+    def _summarize_steps(self, stream: bool):
         if not self.reframed_journal:
             return "沒有可用的整理日記。"
 
-        conversation = build_conversation_text(self.narrative_phase.messages)
-        self.final_summary = self.summarize_phase.execute(
+        transcript = self.narrative_phase.transcript
+        digest = transcript.digest
+        summary = yield from self.summarize_phase._execute(
+            stream,
             reframed_journal=self.reframed_journal,
-            conversation=conversation,
+            conversation=transcript.text,
         )
-        return self.final_summary
+        self._commit_summary(summary, digest)
+        return summary
+
+    def _commit_summary(self, summary: str, digest: str) -> None:
+        self.final_summary = summary
+        self.one_shot_digests["summarize"] = digest
+        self._emit("summarize", final_summary=summary, digest=digest)
 
     def finalize(self, title: str) -> str:
+        return drain(self._finalize_steps(title, stream=False))
+
+    @traced("agent.finalize")
+    def _finalize_steps(self, title: str, stream: bool = False):
         if not self.final_summary:
             return "沒有可用的摘要來完成。"
 
+        system = self._system_prompt("feedback", title=title)
+        response = yield from self.finalize_phase._start(system, f"我把日記取名為「{title}」。", stream)
         self.journal_title = title
         self.phase = "finalize"
-        origin_story = getattr(self, "origin_reframed_journal", self.reframed_journal) or ""
-        system = self.prompts["FEEDBACK_PROMPT"].format(
-            title=title,
-            origin_story=origin_story,
-            summary=self.final_summary,
-        )
-        return self.finalize_phase.start(system, f"我把日記取名為「{title}」。")
+        self.narrative_phase.messages.drop_views()
+        self._emit("phase", phase="finalize", title=title, messages=self.finalize_phase.messages[1:])
+        return response
+
+    def transcript_changed_since(self, one_shot: str) -> bool:
+        """Whether the conversation moved on since `one_shot` ("reframe"/"summarize") last ran."""
+        phase = self.cbt_phase if one_shot == "reframe" else self.narrative_phase
+        digest = self.one_shot_digests.get(one_shot)
+        return digest is not None and digest != phase.transcript.digest
+
+    # --- Deferred one-shots (run later through a batch, see batch.py) ---
+
+    def deferred_request(self, cmd: str) -> dict:
+        """The call `cmd` ("reframe" or "summarize") would make now, to be run later.
+
+        Returns {"model", "messages", "digest"}; raises ValueError if `cmd` can't run now.
+        Reframing always embeds the whole transcript here (no rolling summary).
+        """
+        if cmd not in self.DEFERRABLE or cmd not in self.PHASE_COMMANDS.get(self.phase, {}):
+            raise ValueError(f"'{cmd}' can't be deferred in '{self.phase}' phase")
+        if cmd == "reframe":
+            if not self.init_journal:
+                raise ValueError("沒有初始日記可以整理。")
+            transcript = self.cbt_phase.transcript
+            messages = self.reframe_phase.request(init_journal=self.init_journal, conversation=transcript.text)
+        else:
+            if not self.reframed_journal:
+                raise ValueError("沒有可用的整理日記。")
+            transcript = self.narrative_phase.transcript
+            messages = self.summarize_phase.request(reframed_journal=self.reframed_journal,
+                                                    conversation=transcript.text)
+        return {"model": self.llm.model_name, "messages": messages, "digest": transcript.digest}
+
+    def apply_deferred(self, cmd: str, text: str, digest: str) -> bool:
+        """Commit a deferred result built from the transcript with `digest`.
+
+        Skipped (False) once the session has left the command's phase, or if the current
+        result is already built from the latest transcript and this one isn't.
+        """
+        if cmd not in self.PHASE_COMMANDS.get(self.phase, {}):
+            return False
+        phase = self.cbt_phase if cmd == "reframe" else self.narrative_phase
+        if self.one_shot_digests.get(cmd) == phase.transcript.digest != digest:
+            return False
+        if cmd == "reframe":
+            self._commit_reframe(text, digest)
+        else:
+            self._commit_summary(text, digest)
+        return True
 
     @property
     def commands(self) -> list[str]:
@@ -240,16 +777,162 @@ class JournalAgent:
 
     def command(self, cmd: str, **kwargs) -> str:
         """Execute a phase command. Raises ValueError if invalid."""
+        return drain(self._command_steps(cmd, kwargs, stream=False))
+
+    def command_stream(self, cmd: str, **kwargs):
+        """command() as a generator: yields text chunks, then a final
+        {"content", "phase", "commands", "metadata"} record.
+
+        Invalid commands raise ValueError here, before anything streams. State only
+        changes once the call completes; closing the generator early leaves the agent
+        as it was (no message committed, no phase change).
+        """
+        return self._streamed(self._command_steps(cmd, kwargs, stream=True))
+
+    def _command_steps(self, cmd: str, kwargs: dict, stream: bool):
         phase_cmds = self.PHASE_COMMANDS.get(self.phase, {})
         if cmd not in phase_cmds:
             raise ValueError(f"'{cmd}' not available in '{self.phase}' phase. Valid: {list(phase_cmds.keys())}")
-
-        if cmd == "next" and not self.reframed_journal:
-            self.reframe()
         if cmd == "finalize" and not kwargs.get("title"):
             raise ValueError("'title' is required for finalize command")
+        steps = getattr(self, f"_{phase_cmds[cmd].lstrip('_')}_steps")
+        return self._run_command(cmd, steps, kwargs, stream)
+
+    @traced("agent.command")
+    def _run_command(self, cmd: str, steps, kwargs: dict, stream: bool):
+        current_span().set(command=cmd)
+        saved = (self.reframed_journal, dict(self.one_shot_digests))
+        # Events are held until the command is done, so an abandoned `next` leaves no reframe in the log
+        held = self._held_events = []
+        try:
+            response = yield from self._command_body(cmd, steps, kwargs, stream)
+        except GeneratorExit:
+            self.reframed_journal, self.one_shot_digests = saved
+            held.clear()
+            raise
+        finally:
+            self._held_events = None
+            for kind, data in held:
+                self._publish(kind, data)
+        return response
 
-        return getattr(self, phase_cmds[cmd])(**kwargs)
+    def _command_body(self, cmd: str, steps, kwargs: dict, stream: bool):
+        # An explicit reframed_journal is used as given; otherwise `next` reframes the current transcript first
+        if cmd == "next" and not kwargs.get("reframed_journal") and (
+                not self.reframed_journal or self.transcript_changed_since("reframe")):
+            if self.fused_next and self.init_journal:
+                response = yield from self._fused_next_steps()
+                if response is not None:
+                    return response
+            yield from self._reframe_steps(stream=False)  # not streamed: only the narrative opening is shown
+        return (yield from steps(stream=stream, **kwargs))
+
+    def _streamed(self, steps):
+        """Yield the chunks of a step generator, then its final record."""
+        chunked = False
+        try:
+            while True:
+                try:
+                    chunk = next(steps)
+                except StopIteration as done:
+                    content = done.value
+                    break
+                chunked = True
+                yield chunk
+        finally:
+            steps.close()
+        if not chunked and content:
+            yield content  # canned replies ("nothing to reframe") come back as a single chunk
+        yield {"content": content, "phase": self.phase, "commands": self.commands, "metadata": self.last_metadata}
 
     def _end(self, **kwargs) -> str:
-        return getattr(self, "journal_title", "")
\ No newline at end of file
+        return getattr(self, "journal_title", "")
+
+    def _end_steps(self, stream: bool = False, **kwargs):
+        return self._end(**kwargs)
+        yield  # a step generator that never calls the LLM
+
+    # --- Event log ---
+
+    def _emit(self, kind: str, **data) -> None:
+        if self._held_events is not None:
+            self._held_events.append((kind, data))
+        else:
+            self._publish(kind, data)
+
+    def _publish(self, kind: str, data: dict) -> None:
+        """Report an event now; background work uses this directly, as it isn't part of a held command."""
+        if self.on_event is not None:
+            with span("agent.emit", event=kind):
+                self.on_event(kind, data)
+
+    def apply_event(self, event: dict) -> None:
+        """Replay one on_event record ({"type": ..., **data}) without calling the LLM."""
+        kind = event["type"]
+        if kind == "receive":
+            self.receive(event["content"])
+        elif kind == "unreceive":
+            self.unreceive()
+        elif kind == "reply":
+            self._active_conversation.messages.append({"role": "assistant", "content": event["content"]})
+        elif kind == "reframe":
+            self.reframed_journal = event["reframed_journal"]
+            self.one_shot_digests["reframe"] = event["digest"]
+        elif kind == "summarize":
+            self.final_summary = event["final_summary"]
+            self.one_shot_digests["summarize"] = event["digest"]
+        elif kind == "cbt_summary":
+            self.cbt_summary = event["summary"]
+            self.cbt_summary_upto = event["upto"]
+            self.cbt_summary_stats = dict(event["stats"])
+        elif kind == "phase":
+            previous = self._active_conversation
+            if event["phase"] == "narrative":
+                self.reframed_journal = self.origin_reframed_journal = event["reframed_journal"]
+            elif event["phase"] == "finalize":
+                self.journal_title = event["title"]
+            else:
+                raise ValueError(f"Unknown phase in event: {event['phase']}")
+            self.phase = event["phase"]
+            attr, prompt_key = self.CONVERSATIONS[self.phase]
+            getattr(self, attr).messages = [{"role": "system", "content": self._system_prompt(prompt_key)},
+                                            *event["messages"]]
+            previous.messages.drop_views()
+        else:
+            raise ValueError(f"Unknown event type: {kind}")
+
+    # --- Serialization ---
+
+    def to_state(self) -> dict:
+        """JSON-ready snapshot of the session. System prompts are stored by key only."""
+        state = {
+            "model": self.llm.model_name,
+            "valence": self.valence,
+            "support_type": self.support_type,
+            "phase": self.phase,
+            "conversations": {},
+        }
+        for name in self.STATE_FIELDS:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        for name, (attr, prompt_key) in self.CONVERSATIONS.items():
+            state["conversations"][name] = [
+                {"role": "system", "prompt": prompt_key} if msg["role"] == "system" else dict(msg)
+                for msg in getattr(self, attr).messages
+            ]
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> "JournalAgent":
+        """Rebuild an agent from to_state() output."""
+        agent = cls(model=state["model"], valence=state["valence"], support_type=state["support_type"])
+        agent.phase = state["phase"]
+        for name in cls.STATE_FIELDS:
+            if name in state:
+                setattr(agent, name, state[name])
+        for name, (attr, _) in cls.CONVERSATIONS.items():
+            getattr(agent, attr).messages = [
+                {"role": "system", "content": agent._system_prompt(msg["prompt"])} if "prompt" in msg else dict(msg)
+                for msg in state["conversations"].get(name, [])
+            ]
+        return agent
@@ -0,0 +1,116 @@
+"""Pre-warmed JournalAgent pool, keyed by emotion bucket.
+
+A fresh agent's system prompt and greeting only depend on which bucket the
+valence/support_type coordinates fall in (describe_emotion + make_greeting), so
+agents can be built and warmed ahead of time and handed out on claim with the
+exact coordinates filled in. A background thread tops buckets back up.
+"""
+
+import threading
+from collections import deque
+
+from .agent_journal_pin import JournalAgent, make_greeting
+from .journal_common import describe_emotion
+
+# One representative point per bucket: valence edges -0.5/-0.3/0/0.3/0.5, support edges -0.5/0/0.5
+BUCKET_VALENCES = (-0.75, -0.4, -0.15, 0.15, 0.4, 0.75)
+BUCKET_SUPPORT_TYPES = (-0.75, -0.25, 0.25, 0.75)
+
+
+def emotion_bucket(valence: float, support_type: float) -> tuple[str, str]:
+    """Agents in the same bucket start with identical system prompt and greeting."""
+    return describe_emotion(valence, support_type), make_greeting(valence, support_type)
+
+
+class AgentPool:
+    """Hands out pre-built agents per (model, emotion bucket), refilling in the background."""
+
+    def __init__(self, models: tuple[str, ...] = ("sonnet",), size: int = 2):
+        self.models = models
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0  # builds that raised; their slots stay empty (claims build inline)
+        self._pool: dict[tuple, deque] = {}
+        self._points: dict[tuple, tuple[float, float]] = {}
+        for valence in BUCKET_VALENCES:
+            for support_type in BUCKET_SUPPORT_TYPES:
+                self._points.setdefault(emotion_bucket(valence, support_type), (valence, support_type))
+        self._lock = threading.Lock()
+        self._refill = threading.Condition(self._lock)
+        self._pending: deque = deque()
+        self._building = 0
+        self._thread: threading.Thread | None = None
+
+    @staticmethod
+    def _build(model: str, valence: float, support_type: float) -> JournalAgent:
+        agent = JournalAgent(model=model, valence=valence, support_type=support_type)
+        agent.llm.warm()
+        return agent
+
+    def start(self) -> None:
+        """Fill every bucket and keep refilling claimed slots in a daemon thread."""
+        if self.size <= 0 or self._thread:
+            return
+        with self._lock:
+            for model in self.models:
+                for bucket in self._points:
+                    self._pending.extend([(model, bucket)] * self.size)
+            self._refill.notify()
+        self._thread = threading.Thread(target=self._run, name="agent-pool", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._refill:
+                while not self._pending:
+                    self._refill.wait()
+                model, bucket = self._pending.popleft()
+                self._building += 1
+            agent = None
+            try:
+                agent = self._build(model, *self._points[bucket])
+            except Exception as e:
+                print(f"Agent pool: building a {model} agent failed, slot dropped: {e!r}")
+            finally:
+                with self._lock:
+                    if agent is not None:
+                        self._pool.setdefault((model, bucket), deque()).append(agent)
+                    else:
+                        self.failures += 1
+                    self._building -= 1
+                    if not self._pending:
+                        self._refill.notify_all()  # wake wait_filled()
+
+    def wait_filled(self, timeout: float | None = None) -> bool:
+        """Block until no builds are queued or running; False if `timeout` ran out first."""
+        with self._refill:
+            return self._refill.wait_for(lambda: not self._pending and not self._building, timeout)
+
+    def claim(self, model: str, valence: float, support_type: float) -> JournalAgent:
+        """A ready agent for these coordinates; built on the spot if the bucket is empty."""
+        key = (model, emotion_bucket(valence, support_type))
+        with self._lock:
+            ready = self._pool.get(key)
+            agent = ready.popleft() if ready else None
+            if agent is not None:
+                self.hits += 1
+                self._pending.append(key)
+                self._refill.notify()
+            else:
+                self.misses += 1
+        if agent is None:
+            return JournalAgent(model=model, valence=valence, support_type=support_type)
+        agent.valence = valence
+        agent.support_type = support_type
+        return agent
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": sum(len(q) for q in self._pool.values()),
+                "pending": len(self._pending),
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+            }
@@ -0,0 +1,280 @@
+"""Deferred one-shot calls (summarize, reframe) submitted together through a batch API.
+
+Batched requests are billed at half price and don't count against the interactive rate
+limits, in exchange for latency: minutes, up to 24 hours. DeferredQueue collects jobs
+for CAMI_BATCH_WINDOW seconds (or until BATCH_MAX_REQUESTS are waiting), submits them
+as one batch, polls it every CAMI_BATCH_POLL_INTERVAL seconds and hands each finished
+job to its callback, from the queue's thread.
+
+Backends (CAMI_BATCH_BACKEND): "anthropic" is the Message Batches API; "local" is a
+stand-in that runs each request as an ordinary call at background priority when the
+batch is polled (tests, api/mock_anthropic.py). Jobs waiting or in flight are not
+persisted; they are lost on restart.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from .agent_journal_pin import LLMService
+from .journal_common import MODELS, TEMPERATURE
+from .ledger import Account
+from .output_budget import OUTPUT_BUDGETS
+
+BATCH_BACKEND = os.getenv("CAMI_BATCH_BACKEND", "anthropic")
+BATCH_WINDOW = float(os.getenv("CAMI_BATCH_WINDOW", "60"))  # seconds jobs are collected before submitting
+BATCH_POLL_INTERVAL = float(os.getenv("CAMI_BATCH_POLL_INTERVAL", "30"))
+BATCH_MAX_REQUESTS = 10000
+KEEP_FINISHED = 10000  # finished jobs kept for status queries
+
+
+class DeferredJob:
+    """One deferred call. `status`: queued, submitted, then done or failed, or what on_done returns
+    (the API's: applied, stale, undelivered, expired)."""
+
+    __slots__ = ("id", "session_id", "command", "model", "messages", "digest", "account", "on_done",
+                 "status", "batch_id", "result", "error", "created", "finished")
+
+    def __init__(self, session_id: str, command: str, model: str, messages: list[dict], digest: str,
+                 account: Account | None, on_done):
+        self.id = uuid.uuid4().hex[:16]
+        self.session_id = session_id
+        self.command = command
+        self.model = model
+        self.messages = messages
+        self.digest = digest
+        self.account = account
+        self.on_done = on_done
+        self.status = "queued"
+        self.batch_id: str | None = None
+        self.result: dict | None = None  # {"text", "usage"}
+        self.error: str | None = None
+        self.created = time.time()
+        self.finished: float | None = None
+
+    def public(self) -> dict:
+        return {"job_id": self.id, "session_id": self.session_id, "command": self.command, "status": self.status,
+                "batch_id": self.batch_id, "error": self.error, "created": self.created, "finished": self.finished,
+                "content": self.result["text"] if self.result else None,
+                "usage": self.result["usage"] if self.result else None}
+
+
+def _split_system(messages: list[dict]) -> tuple[str | None, list[dict]]:
+    system = "\n\n".join(str(m["content"]) for m in messages if m["role"] == "system")
+    return system or None, [{"role": m["role"], "content": m["content"]} for m in messages if m["role"] != "system"]
+
+
+class AnthropicBatches:
+    """The Message Batches API (same endpoint and key as create_llm)."""
+
+    def __init__(self, base_url: str | None = None):
+        self.base_url = base_url
+        self._client = None
+        self._budgets: dict[str, dict[str, tuple]] = {}  # batch id -> {custom_id: (kind, max_tokens)}
+
+    @property
+    def client(self):
+        if self._client is None:
+            import anthropic
+
+            base_url = self.base_url or os.getenv("ANTHROPIC_BASE_URL")
+            self._client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY") or ("mock" if base_url else None),
+                                               base_url=base_url)
+        return self._client
+
+    def submit(self, requests: list[dict]) -> str:
+        entries, budgets = [], {}
+        for r in requests:
+            system, messages = _split_system(r["messages"])
+            budgets[r["custom_id"]] = (r.get("kind"), OUTPUT_BUDGETS.max_tokens(r.get("kind")))
+            params = {"model": MODELS.get(r["model"], MODELS["opus"]), "max_tokens": budgets[r["custom_id"]][1],
+                      "temperature": TEMPERATURE, "messages": messages}
+            if system:
+                params["system"] = system
+            entries.append({"custom_id": r["custom_id"], "params": params})
+        batch_id = self.client.messages.batches.create(requests=entries).id
+        self._budgets[batch_id] = budgets
+        return batch_id
+
+    def results(self, batch_id: str) -> dict[str, dict] | None:
+        """{custom_id: {"text", "usage"} or {"error"}} once the batch has ended, else None."""
+        if self.client.messages.batches.retrieve(batch_id).processing_status != "ended":
+            return None
+        results, budgets = {}, self._budgets.pop(batch_id, {})
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                message = entry.result.message
+                kind, max_tokens = budgets.get(entry.custom_id, (None, 0))
+                OUTPUT_BUDGETS.record(kind, message.usage.output_tokens, max_tokens,
+                                      message.stop_reason == "max_tokens")
+                results[entry.custom_id] = {
+                    "text": "".join(block.text for block in message.content if block.type == "text"),
+                    "usage": {"input_tokens": message.usage.input_tokens,
+                              "output_tokens": message.usage.output_tokens},
+                }
+            else:
+                results[entry.custom_id] = {"error": entry.result.type}
+        return results
+
+
+def _invoke(model: str, messages: list[dict], kind: str | None = None) -> dict:
+    llm = LLMService(None, model)
+    text = llm.invoke(messages, "background", kind)
+    return {"text": text, "usage": {k: llm.last_metadata[k] for k in ("input_tokens", "output_tokens")}}
+
+
+class LocalBatches:
+    """Stand-in backend: each request is an ordinary call, made when the batch is first polled."""
+
+    def __init__(self, respond=_invoke):
+        self.respond = respond  # (model, messages, kind) -> {"text", "usage"}
+        self._batches: dict[str, list[dict]] = {}
+
+    def submit(self, requests: list[dict]) -> str:
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        self._batches[batch_id] = requests
+        return batch_id
+
+    def results(self, batch_id: str) -> dict[str, dict] | None:
+        results = {}
+        for r in self._batches.pop(batch_id):
+            try:
+                results[r["custom_id"]] = self.respond(r["model"], r["messages"], r.get("kind"))
+            except Exception as e:
+                results[r["custom_id"]] = {"error": f"{type(e).__name__}: {e}"}
+        return results
+
+
+def batch_backend(name: str = BATCH_BACKEND):
+    if name == "local":
+        return LocalBatches()
+    if name == "anthropic":
+        return AnthropicBatches()
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+class DeferredQueue:
+    """Collects deferred jobs, submits them in batches and delivers results to each job's on_done."""
+
+    def __init__(self, backend=None, window: float = BATCH_WINDOW, poll_interval: float = BATCH_POLL_INTERVAL,
+                 max_requests: int = BATCH_MAX_REQUESTS):
+        self.backend = backend
+        self.window = window
+        self.poll_interval = poll_interval
+        self.max_requests = max_requests
+        self.jobs: dict[str, DeferredJob] = {}
+        self.batches_submitted = 0
+        self._waiting: list[DeferredJob] = []
+        self._batches: dict[str, list[DeferredJob]] = {}
+        self._finished: deque[str] = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread: threading.Thread | None = None
+
+    def put(self, session_id: str, command: str, model: str, messages: list[dict], digest: str,
+            account: Account | None = None, on_done=None) -> DeferredJob:
+        job = DeferredJob(session_id, command, model, messages, digest, account, on_done)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Deferred queue is closed")
+            if self.backend is None:
+                self.backend = batch_backend()
+            self.jobs[job.id] = job
+            self._waiting.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deferred-batches", daemon=True)
+                self._thread.start()
+        if len(self._waiting) >= self.max_requests:
+            self._wake.set()
+        return job
+
+    def _run(self) -> None:
+        last_poll = time.monotonic()
+        while not self._closed:
+            self._wake.wait(min(self.window, self.poll_interval))
+            self._wake.clear()
+            waiting = self._waiting
+            if waiting and (len(waiting) >= self.max_requests or time.time() - waiting[0].created >= self.window):
+                self.flush()
+            if self._batches and time.monotonic() - last_poll >= self.poll_interval:
+                last_poll = time.monotonic()
+                self.poll()
+
+    def flush(self) -> None:
+        """Submit the waiting jobs as one batch now."""
+        with self._lock:
+            jobs, self._waiting = self._waiting, []
+        if not jobs:
+            return
+        try:
+            batch_id = self.backend.submit([{"custom_id": job.id, "model": job.model, "messages": job.messages,
+                                             "kind": job.command} for job in jobs])
+        except Exception as e:
+            for job in jobs:
+                self._finish(job, None, f"Batch submission failed: {type(e).__name__}: {e}")
+            return
+        for job in jobs:
+            job.status, job.batch_id = "submitted", batch_id
+        with self._lock:
+            self._batches[batch_id] = jobs
+            self.batches_submitted += 1
+
+    def poll(self) -> None:
+        """Deliver the jobs of every batch that has ended."""
+        for batch_id, jobs in list(self._batches.items()):
+            try:
+                results = self.backend.results(batch_id)
+            except Exception as e:
+                print(f"Polling batch {batch_id} failed: {e!r}")
+                continue
+            if results is None:
+                continue
+            with self._lock:
+                del self._batches[batch_id]
+            for job in jobs:
+                result = results.get(job.id) or {"error": "missing from batch results"}
+                self._finish(job, result if "error" not in result else None, result.get("error"))
+
+    def _finish(self, job: DeferredJob, result: dict | None, error: str | None) -> None:
+        """Bill and deliver a job; its final status and `finished` are only set once on_done returned."""
+        job.result, job.error = result, error
+        status = "done" if result else "failed"
+        if result and job.account is not None:
+            job.account.record(job.model, result["usage"], batch=True)
+        if job.on_done is not None:
+            try:
+                status = job.on_done(job) or status
+            except Exception as e:
+                print(f"Delivering deferred job {job.id} failed: {e!r}")
+        job.status, job.finished = status, time.time()
+        with self._lock:
+            self._finished.append(job.id)
+            while len(self._finished) > KEEP_FINISHED:
+                self.jobs.pop(self._finished.popleft(), None)
+
+    def session_jobs(self, session_id: str) -> list[DeferredJob]:
+        with self._lock:
+            return [job for job in self.jobs.values() if job.session_id == session_id]
+
+    def forget_session(self, session_id: str) -> None:
+        """Drop a finished session's finished jobs (pending ones are still delivered and billed)."""
+        with self._lock:
+            for job in [j for j in self.jobs.values() if j.session_id == session_id and j.finished is not None]:
+                del self.jobs[job.id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"waiting": len(self._waiting), "in_flight": sum(len(jobs) for jobs in self._batches.values()),
+                    "batches_submitted": self.batches_submitted,
+                    "finished": len(self._finished)}
+
+    def close(self) -> int:
+        """Stop the queue; returns how many jobs were still waiting or in flight (they are dropped)."""
+        with self._lock:
+            self._closed = True
+            pending = len(self._waiting) + sum(len(jobs) for jobs in self._batches.values())
+        self._wake.set()
+        return pending
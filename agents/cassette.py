@@ -0,0 +1,173 @@
+"""Record/replay cassettes for LLM calls — repeatable runs without paying for tokens.
+
+A cassette maps a hash of each request to what came back: the response, token usage
+and latency. In record mode calls go through and are captured; in replay mode they
+are served from the file (optionally sleeping for the recorded latency).
+
+    CAMI_CASSETTE=cassettes/api.jsonl.gz CAMI_CASSETTE_MODE=record python test_api.py
+    CAMI_CASSETTE=cassettes/api.jsonl.gz CAMI_CASSETTE_MODE=replay python test_api.py
+    CAMI_CASSETTE_REALTIME=1 ...   # replay with recorded latencies
+
+The file is JSONL (gzip'd when the path ends in .gz), one compact record per call.
+Identical requests made several times replay their recorded responses in order.
+"""
+
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+CASSETTE_MODES = ("record", "replay")
+
+
+class CassetteMiss(KeyError):
+    """Replay mode got a request that was never recorded."""
+
+
+def request_key(request: dict) -> str:
+    """Stable hash of a request (model, messages, params)."""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """A file of recorded LLM calls, shared by every caller that uses the same path."""
+
+    def __init__(self, path: str, mode: str = "replay", realtime: bool = False):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}'. Valid: {list(CASSETTE_MODES)}")
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self.records: dict[str, list[dict]] = {}
+        self._cursor: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if os.path.exists(path):
+            self.load()
+        elif mode == "replay":
+            raise FileNotFoundError(f"Cassette '{path}' does not exist; record it first")
+        if mode == "record":
+            atexit.register(self.save)
+
+    def load(self) -> None:
+        with _open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records.setdefault(record.pop("key"), []).append(record)
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with _open(self.path, "w") as f:
+                for key, records in self.records.items():
+                    for record in records:
+                        f.write(json.dumps({"key": key, **record}, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._dirty = False
+
+    def through(self, request: dict, call) -> dict:
+        """Serve `request` from the cassette, or run `call()` and record it.
+
+        `call` returns {"response": ..., "usage": {...}}; the result adds "latency".
+        """
+        key = request_key(request)
+        if self.mode == "replay":
+            with self._lock:
+                records = self.records.get(key)
+                if not records:
+                    raise CassetteMiss(f"No recorded response for request {key[:12]}")
+                i = self._cursor.get(key, 0)
+                self._cursor[key] = i + 1
+                record = records[min(i, len(records) - 1)]
+            if self.realtime:
+                time.sleep(record.get("latency", 0.0))
+            return record
+
+        start = time.time()
+        record = dict(call())
+        record["latency"] = round(time.time() - start, 4)
+        self.add(request, record)
+        return record
+
+    def add(self, request: dict, record: dict) -> None:
+        """Record a call made outside through() (e.g. a completed stream)."""
+        key = request_key(request)
+        with self._lock:
+            # Re-recording a request replaces what the file had for it
+            if self._cursor.get(key) is None:
+                self.records[key] = []
+                self._cursor[key] = 0
+            self.records[key].append(record)
+            self._dirty = True
+
+
+_cassettes: dict[str, Cassette] = {}
+
+
+def cassette_from_env() -> Cassette | None:
+    """The cassette configured by CAMI_CASSETTE / CAMI_CASSETTE_MODE, if any."""
+    path = os.getenv("CAMI_CASSETTE")
+    if not path:
+        return None
+    if path not in _cassettes:
+        _cassettes[path] = Cassette(
+            path,
+            mode=os.getenv("CAMI_CASSETTE_MODE", "replay"),
+            realtime=os.getenv("CAMI_CASSETTE_REALTIME", "") not in ("", "0"),
+        )
+    return _cassettes[path]
+
+
+class _RecordedCompletions:
+    def __init__(self, completions, cassette: Cassette):
+        self._completions = completions
+        self._cassette = cassette
+
+    def create(self, **kwargs):
+        from openai.types.chat import ChatCompletion
+
+        def call():
+            r = self._completions.create(**kwargs)
+            usage = {"input_tokens": r.usage.prompt_tokens, "output_tokens": r.usage.completion_tokens} if r.usage else {}
+            return {"response": r.model_dump(mode="json"), "usage": usage}
+
+        record = self._cassette.through({"api": "openai.chat.completions", **kwargs}, call)
+        return ChatCompletion.model_validate(record["response"])
+
+
+class _RecordedChat:
+    def __init__(self, chat, cassette: Cassette):
+        self.completions = _RecordedCompletions(chat.completions, cassette)
+
+
+class _RecordedOpenAI:
+    def __init__(self, client, cassette: Cassette):
+        self._client = client
+        self.chat = _RecordedChat(client.chat, cassette)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def record_openai(client, cassette: Cassette | None = None):
+    """Route an OpenAI client's chat.completions.create through the cassette.
+
+    Used by the get_chatbot_response / get_precise_response / get_json_response helpers.
+    Returns the client unchanged when no cassette is configured.
+    """
+    cassette = cassette or cassette_from_env()
+    if cassette is None:
+        return client
+    return _RecordedOpenAI(client, cassette)
@@ -1,31 +1,52 @@
-"""Shared helpers for journal agents (JournalAgent and PinAgent)."""
+"""Shared helpers for journal agents (JournalAgent and PinAgent).
+
+LangChain and the Anthropic SDK take over a second to import, so they are imported on
+first use (the first LLM client or message conversion), not with this module.
+"""
 
 import os
-from langchain_anthropic import ChatAnthropic
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+import sys
+from functools import lru_cache
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
 MODELS = {
     "opus": "claude-opus-4-5-20251101",
     "sonnet": "claude-sonnet-4-20250514",
 }
+TEMPERATURE = 0.7
+MAX_TOKENS = 1024
+
 
+def create_llm(model_name="opus", base_url: str | None = None):
+    """The ChatAnthropic LLM for the specified model (one shared instance per model and endpoint).
 
-def create_llm(model_name="opus"):
-    """Create a ChatAnthropic LLM with the specified model."""
+    `base_url` (or ANTHROPIC_BASE_URL, e.g. api/mock_anthropic.py) redirects calls.
+    ANTHROPIC_API_KEY and ANTHROPIC_BASE_URL are read at call time, not import time.
+    """
     model_id = MODELS.get(model_name.lower(), MODELS["opus"])
+    base_url = base_url or os.getenv("ANTHROPIC_BASE_URL")
+    return _chat_anthropic(model_id, base_url, os.getenv("ANTHROPIC_API_KEY") or ("mock" if base_url else None))
+
+
+@lru_cache(maxsize=None)
+def _chat_anthropic(model_id: str, base_url: str | None, api_key: str | None):
+    from langchain_anthropic import ChatAnthropic
+
     return ChatAnthropic(
         model=model_id,
-        temperature=0.7,
-        max_tokens=1024,
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
         max_retries=5,
-        api_key=ANTHROPIC_API_KEY
+        api_key=api_key,
+        base_url=base_url,
     )
 
 
 def describe_emotion(valence: float, support_type: float) -> str:
-    """Map valence/support_type floats to natural-language description for the system prompt."""
+    """Map valence/support_type floats to natural-language description for the system prompt.
+
+    There are only 16 possible descriptions; they are interned so every session shares them.
+    """
     if valence < -0.5:
         feeling = "The user is feeling quite distressed or upset."
     elif valence < 0:
@@ -44,17 +65,30 @@ def describe_emotion(valence: float, support_type: float) -> str:
     else:
         approach = "They are looking for concrete advice, practical strategies, and actionable guidance."
 
-    return f"\n\n{feeling} {approach}"
+    return sys.intern(f"\n\n{feeling} {approach}")
+
+
+def _to_langchain(role: str, content):
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    if role == "system":
+        return SystemMessage(content=str(content))
+    if role == "user":
+        return HumanMessage(content=content)
+    if role == "assistant":
+        return AIMessage(content=content)
+    return None
 
 
 def openai_2_langchain(messages):
-    """Convert OpenAI message format to LangChain format."""
+    """Convert OpenAI message format to LangChain format.
+
+    Built per call, not cached on the log: the converted messages would double a
+    session's memory, and converting a conversation takes microseconds next to the call.
+    """
     lc_messages = []
     for msg in messages:
-        if msg["role"] == "system":
-            lc_messages.append(SystemMessage(content=msg["content"]))
-        elif msg["role"] == "user":
-            lc_messages.append(HumanMessage(content=msg["content"]))
-        elif msg["role"] == "assistant":
-            lc_messages.append(AIMessage(content=msg["content"]))
+        lc_message = _to_langchain(msg["role"], msg["content"])
+        if lc_message is not None:
+            lc_messages.append(lc_message)
     return lc_messages
@@ -0,0 +1,210 @@
+"""Token ledger: usage and estimated cost per session, user and model, with daily quotas.
+
+Every completed LLM call is recorded against an Account (session id + optional user
+id). Totals are kept in memory; the raw rows are written to SQLite in batches by a
+background thread (CAMI_LEDGER_DB; without it the ledger is memory-only). Before a
+call, Account.check() raises QuotaExceeded once the user — or, for anonymous
+sessions, the session — has used CAMI_DAILY_TOKEN_QUOTA tokens today (UTC).
+Today's usage is reloaded from the database on startup, so restarts don't reset quotas.
+"""
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+LEDGER_DB = os.getenv("CAMI_LEDGER_DB")
+DAILY_TOKEN_QUOTA = int(os.getenv("CAMI_DAILY_TOKEN_QUOTA", "0"))  # input + output tokens; 0 = no quota
+FLUSH_INTERVAL = float(os.getenv("CAMI_LEDGER_FLUSH_INTERVAL", "5"))
+
+# USD per million (input, output) tokens, by JournalAgent model name
+PRICES = {
+    "opus": (5.0, 25.0),
+    "sonnet": (3.0, 15.0),
+}
+BATCH_DISCOUNT = 0.5  # Message Batches are billed at half the price
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    ts REAL, day TEXT, session_id TEXT, user_id TEXT, model TEXT,
+    input_tokens INTEGER, output_tokens INTEGER, cost REAL
+);
+CREATE INDEX IF NOT EXISTS usage_day ON usage (day, user_id, session_id);
+"""
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int, batch: bool = False) -> float:
+    price_in, price_out = PRICES.get(model, PRICES["opus"])
+    cost = (input_tokens * price_in + output_tokens * price_out) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+def utc_day(ts: float | None = None) -> str:
+    return datetime.datetime.fromtimestamp(ts or time.time(), datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def seconds_until_utc_midnight() -> int:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    tomorrow = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((tomorrow - now).total_seconds()) + 1
+
+
+def quota_key(session_id: str, user_id: str | None) -> str:
+    return f"user:{user_id}" if user_id else f"session:{session_id}"
+
+
+class QuotaExceeded(RuntimeError):
+    """The daily token quota is used up; retry after `retry_after` seconds."""
+
+    def __init__(self, key: str, used: int, quota: int):
+        super().__init__(f"Daily token quota exceeded for {key} ({used}/{quota})")
+        self.key = key
+        self.used = used
+        self.quota = quota
+        self.retry_after = seconds_until_utc_midnight()
+
+
+def _totals() -> dict:
+    return {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+
+
+def _add(totals: dict, input_tokens: int, output_tokens: int, cost: float) -> None:
+    totals["calls"] += 1
+    totals["input_tokens"] += input_tokens
+    totals["output_tokens"] += output_tokens
+    totals["cost"] += cost
+
+
+class TokenLedger:
+    """In-memory usage totals, batch-persisted to SQLite, with a per-day quota check."""
+
+    def __init__(self, path: str | None = LEDGER_DB, daily_quota: int = DAILY_TOKEN_QUOTA,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.daily_quota = daily_quota
+        self.flush_interval = flush_interval
+        self.sessions: dict[str, dict] = {}
+        self.users: dict[str, dict] = {}
+        self.models: dict[str, dict] = {}
+        self._day = utc_day()
+        self._today: dict[str, int] = {}  # quota key -> tokens used today
+        self._pending: list[tuple] = []
+        self._lock = threading.Lock()
+        self._db = None
+        self._closed = threading.Event()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+            rows = self._db.execute(
+                "SELECT user_id, session_id, SUM(input_tokens + output_tokens) FROM usage WHERE day = ? "
+                "GROUP BY user_id, session_id", (self._day,))
+            for user_id, session_id, tokens in rows:
+                key = quota_key(session_id, user_id)
+                self._today[key] = self._today.get(key, 0) + tokens
+            threading.Thread(target=self._flush_loop, name="ledger-flush", daemon=True).start()
+
+    def _roll_day(self) -> None:
+        """Start a new quota day at UTC midnight. Caller holds _lock."""
+        day = utc_day()
+        if day != self._day:
+            self._day = day
+            self._today = {}
+
+    def used_today(self, key: str) -> int:
+        with self._lock:
+            self._roll_day()
+            return self._today.get(key, 0)
+
+    def check(self, key: str, tokens: int = 0) -> None:
+        """Raise QuotaExceeded if `key` has no quota left today, or not the `tokens` a call is estimated to take."""
+        if self.daily_quota <= 0:
+            return
+        used = self.used_today(key)
+        if used >= self.daily_quota or used + tokens > self.daily_quota:
+            raise QuotaExceeded(key, used, self.daily_quota)
+
+    def record(self, session_id: str, user_id: str | None, model: str, input_tokens: int, output_tokens: int,
+               batch: bool = False) -> None:
+        cost = estimate_cost(model, input_tokens, output_tokens, batch)
+        now = time.time()
+        with self._lock:
+            self._roll_day()
+            key = quota_key(session_id, user_id)
+            self._today[key] = self._today.get(key, 0) + input_tokens + output_tokens
+            _add(self.sessions.setdefault(session_id, _totals()), input_tokens, output_tokens, cost)
+            if user_id:
+                _add(self.users.setdefault(user_id, _totals()), input_tokens, output_tokens, cost)
+            _add(self.models.setdefault(model, _totals()), input_tokens, output_tokens, cost)
+            if self._db is not None:
+                self._pending.append((now, self._day, session_id, user_id, model, input_tokens, output_tokens, cost))
+
+    def forget_session(self, session_id: str) -> None:
+        """Drop a finished session's in-memory totals (its rows stay in the database)."""
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def flush(self) -> None:
+        """Write pending rows; on a database error they are put back for the next flush."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if rows and self._db is not None:
+            try:
+                with self._db:
+                    self._db.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error:
+                with self._lock:
+                    self._pending[:0] = rows
+                raise
+
+    def _flush_loop(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            self._try_flush()
+
+    def _try_flush(self) -> None:
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            print(f"Ledger flush failed ({len(self._pending)} rows pending): {e!r}")
+
+    def close(self) -> None:
+        self._closed.set()
+        self._try_flush()
+
+    def usage(self, session_id: str | None = None, user_id: str | None = None) -> dict:
+        """Totals for a session and/or user, plus today's quota use."""
+        with self._lock:
+            self._roll_day()
+            result = {}
+            if session_id:
+                result["session"] = dict(self.sessions.get(session_id) or _totals())
+            if user_id:
+                result["user"] = dict(self.users.get(user_id) or _totals())
+            if session_id or user_id:
+                used = self._today.get(quota_key(session_id, user_id), 0)
+                result["today"] = {"tokens": used, "quota": self.daily_quota or None,
+                                   "remaining": max(0, self.daily_quota - used) if self.daily_quota else None}
+            return result
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"models": {name: dict(t) for name, t in self.models.items()},
+                    "users": len(self.users), "sessions": len(self.sessions), "pending_rows": len(self._pending)}
+
+
+class Account:
+    """Who an agent's LLM calls are checked against and billed to."""
+
+    __slots__ = ("ledger", "session_id", "user_id")
+
+    def __init__(self, ledger: TokenLedger, session_id: str, user_id: str | None = None):
+        self.ledger = ledger
+        self.session_id = session_id
+        self.user_id = user_id
+
+    def check(self, tokens: int = 0) -> None:
+        self.ledger.check(quota_key(self.session_id, self.user_id), tokens)
+
+    def record(self, model: str, usage: dict, batch: bool = False) -> None:
+        self.ledger.record(self.session_id, self.user_id, model,
+                           usage.get("input_tokens", 0), usage.get("output_tokens", 0), batch)
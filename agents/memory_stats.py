@@ -0,0 +1,93 @@
+"""What live sessions cost in RAM: message counts, stored text and deep object size.
+
+deep_size() walks gc.get_referents() from a JournalAgent and sums sys.getsizeof() of
+everything reachable that belongs to the session. It skips what sessions share: prompt
+templates and the interned CBT system prompts, the LangChain/Anthropic clients, locks
+and executors, and the ledger and log handles. The result is an estimate for comparing sessions and setting eviction
+thresholds, not an exact accounting. The walk takes ~0.15 ms per session, so the
+aggregate report can skip it.
+"""
+
+import gc
+import sys
+import time
+from functools import partial
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+from .agent_journal_pin import JournalAgent, cbt_system_prompt, load_prompts
+from .cassette import Cassette
+from .ledger import Account
+
+SKIP_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType, partial, Account, Cassette)
+SHARED_MODULES = ("langchain", "anthropic", "httpx", "pydantic", "threading", "_thread", "concurrent.")
+TOP_SESSIONS = 10
+EMOTION_BUCKETS = (-1.0, -0.25, 0.25, 1.0)  # one valence / support_type value per describe_emotion bucket
+
+
+def _shared(obj) -> bool:
+    return isinstance(obj, SKIP_TYPES) or type(obj).__module__.startswith(SHARED_MODULES)
+
+
+def _shared_prompts() -> list:
+    """The prompt texts every session shares: the templates and the 16 interned CBT system prompts."""
+    prompts = load_prompts()
+    return [prompts, *prompts.values(),
+            *(cbt_system_prompt(v, s) for v in EMOTION_BUCKETS for s in EMOTION_BUCKETS)]
+
+
+def deep_size(obj, skip_ids: set[int] | None = None) -> int:
+    """Bytes reachable from `obj`, not counting shared objects or ids in `skip_ids`."""
+    shared = _shared_prompts()  # held for the walk, so their ids stay theirs
+    seen = {*map(id, shared), *(skip_ids or ())}
+    size, stack = 0, [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or _shared(o):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return size
+
+
+def _text_bytes(value) -> int:
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(_text_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_text_bytes(v) for v in value)
+    return 0
+
+
+def session_memory(agent: JournalAgent, deep: bool = True) -> dict:
+    """Message counts per conversation, UTF-8 bytes of stored text and (if `deep`) deep size."""
+    messages, text = {}, 0
+    for name, (attr, _) in JournalAgent.CONVERSATIONS.items():
+        log = getattr(agent, attr).messages
+        messages[name] = sum(1 for msg in log if msg["role"] != "system")
+        text += sum(_text_bytes(msg["content"]) for msg in log if msg["role"] != "system")
+    text += sum(_text_bytes(getattr(agent, name, None)) for name in JournalAgent.STATE_FIELDS)
+    report = {"phase": agent.phase, "messages": messages, "text_bytes": text}
+    if deep:
+        report["deep_bytes"] = deep_size(agent)
+    return report
+
+
+def memory_report(sessions: dict[str, JournalAgent], top: int = TOP_SESSIONS, deep: bool = True) -> dict:
+    """Totals over all sessions plus the `top` largest (by deep size, else by stored text)."""
+    start = time.perf_counter()
+    per_session = {sid: session_memory(agent, deep) for sid, agent in list(sessions.items())}
+    messages: dict[str, int] = {}
+    for report in per_session.values():
+        for name, n in report["messages"].items():
+            messages[name] = messages.get(name, 0) + n
+    size_key = "deep_bytes" if deep else "text_bytes"
+    largest = sorted(per_session.items(), key=lambda item: item[1][size_key], reverse=True)[:top]
+    total = {"sessions": len(per_session), "messages": messages,
+             "text_bytes": sum(r["text_bytes"] for r in per_session.values())}
+    if deep:
+        total["deep_bytes"] = sum(r["deep_bytes"] for r in per_session.values())
+        total["deep_bytes_avg"] = round(total["deep_bytes"] / len(per_session)) if per_session else 0
+    return {**total, "largest": [{"session_id": sid, **report} for sid, report in largest],
+            "seconds": round(time.perf_counter() - start, 4)}
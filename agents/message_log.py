@@ -0,0 +1,144 @@
+"""Compact append-only message history for ConversationPhase.
+
+Roles are one byte each in an array and contents are plain references, instead of a
+{"role", "content"} dict per message. Indexing and iteration still yield those dicts
+(fresh ones — edits to them don't write back), so existing callers keep working.
+
+Derived views (the API's public view, per-message token estimates) are cached per log
+and only convert the messages appended since they were last read. The "You:/Agent:" transcript
+used by reframe/summarize is kept up to date on every append, with a running hash.
+"""
+
+import hashlib
+from array import array
+from collections.abc import Sequence
+from typing import Callable, Iterable
+
+ROLES = ("system", "user", "assistant")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+
+class Transcript:
+    """The "You: ..." / "Agent: ..." text of a log from message `skip` on.
+
+    Extended by one append per message. `digest` hashes the current text, so callers
+    can tell in O(1) whether the transcript changed since they last used it.
+    """
+
+    __slots__ = ("skip", "_parts", "_lines", "_seen", "_hash")
+
+    def __init__(self, skip: int = 2):
+        self.skip = skip
+        self._parts: list[str] = []  # joined back into a single part whenever text is read
+        self._lines = 0
+        self._seen = 0
+        self._hash = hashlib.sha1()
+
+    def add(self, role: str, content) -> None:
+        self._seen += 1
+        if self._seen <= self.skip:
+            return
+        line = f"{'You' if role == 'user' else 'Agent'}: {content}"
+        self._hash.update((b"\n\n" if self._lines else b"") + line.encode("utf-8"))
+        self._parts.append(line)
+        self._lines += 1
+
+    @property
+    def text(self) -> str:
+        if len(self._parts) != 1:
+            self._parts = ["\n\n".join(self._parts)]
+        return self._parts[0]
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+    def __len__(self) -> int:
+        return self._lines
+
+
+class MessageLog(Sequence):
+    """Sequence of {"role", "content"} dicts stored as role codes + content references."""
+
+    __slots__ = ("_roles", "_contents", "_views", "_transcript")
+
+    def __init__(self, messages: Iterable[dict] = ()):
+        self._roles = array("B")
+        self._contents: list = []
+        self._views: dict[str, list] | None = None
+        self._transcript: Transcript | None = None
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, message: dict) -> None:
+        self._roles.append(ROLE_CODES[message["role"]])
+        self._contents.append(message["content"])
+        if self._transcript is not None:
+            self._transcript.add(message["role"], message["content"])
+
+    def pop(self) -> dict:
+        """Remove and return the last message. Rare (a turn taken back), so the views are rebuilt."""
+        message = self[-1]
+        del self._roles[-1], self._contents[-1]
+        self.drop_views()
+        return message
+
+    def transcript(self, skip: int = 2) -> Transcript:
+        """The incrementally maintained transcript (built from the log on first use)."""
+        if self._transcript is None or self._transcript.skip != skip:
+            self._transcript = Transcript(skip)
+            for code, content in zip(self._roles, self._contents):
+                self._transcript.add(ROLES[code], content)
+        return self._transcript
+
+    def role(self, i: int) -> str:
+        return ROLES[self._roles[i]]
+
+    def content(self, i: int):
+        return self._contents[i]
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return {"role": ROLES[self._roles[i]], "content": self._contents[i]}
+
+    def __iter__(self):
+        for code, content in zip(self._roles, self._contents):
+            yield {"role": ROLES[code], "content": content}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (MessageLog, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"MessageLog({list(self)!r})"
+
+    def view(self, name: str, convert: Callable[[str, object], object]) -> list:
+        """Cached list of convert(role, content) over the log, skipping None results.
+
+        Each name must always be used with the same converter. The returned list is the
+        cache itself; copy it before handing it to code that might mutate it.
+        """
+        if self._views is None:
+            self._views = {}
+        cached = self._views.get(name)
+        if cached is None:
+            cached = self._views[name] = [0, []]
+        done, items = cached
+        for i in range(done, len(self._contents)):
+            item = convert(ROLES[self._roles[i]], self._contents[i])
+            if item is not None:
+                items.append(item)
+        cached[0] = len(self._contents)
+        return items
+
+    def drop_views(self) -> None:
+        """Free cached views, e.g. once the conversation is no longer active."""
+        self._views = None
+        self._transcript = None
@@ -0,0 +1,104 @@
+"""Output token budgets (max_tokens) per kind of LLM call, learned from observed output.
+
+Every call is labelled with a kind: the conversation it continues ("cbt", "narrative",
+"feedback") or its one-shot prompt ("reframe", "summarize", "fused_next", ...). A kind's
+budget is MAX_TOKENS until MIN_SAMPLES calls have completed, then the p99 of its recent
+output tokens times CAMI_OUTPUT_BUDGET_MARGIN, between MIN_BUDGET and MAX_TOKENS.
+CAMI_OUTPUT_BUDGETS ("summarize=300,cbt=400") pins budgets instead of learning them.
+
+A call that stops on max_tokens is a truncation: it is counted, the last KEEP_TRUNCATIONS
+are listed in /metrics (not printed: a mis-set budget would flood the log under load),
+and the kind's budget never again drops below twice the budget that cut it off. With
+CAMI_ADAPTIVE_MAX_TOKENS=0 every call gets MAX_TOKENS, but output is still recorded, so
+/metrics shows what the learned budgets would be before they are turned on.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from .journal_common import MAX_TOKENS
+from .scheduler import percentile
+
+ADAPTIVE_MAX_TOKENS = os.getenv("CAMI_ADAPTIVE_MAX_TOKENS", "1") not in ("", "0")
+BUDGET_MARGIN = float(os.getenv("CAMI_OUTPUT_BUDGET_MARGIN", "1.5"))
+MIN_SAMPLES = 50  # completed calls of a kind before its budget is learned
+OUTPUT_SAMPLES = 1000  # recent output token counts kept per kind
+MIN_BUDGET = 256
+BUDGET_PERCENTILE = 0.99
+KEEP_TRUNCATIONS = 50  # recent truncation events kept for /metrics
+
+
+def parse_budgets(spec: str) -> dict[str, int]:
+    """"kind=tokens,..." -> {kind: tokens}."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, tokens = item.partition("=")
+        budgets[kind.strip()] = int(tokens)
+    return budgets
+
+
+class OutputBudgets:
+    """Learned max_tokens per call kind, plus truncation counts."""
+
+    def __init__(self, adaptive: bool = ADAPTIVE_MAX_TOKENS, margin: float = BUDGET_MARGIN,
+                 fixed: dict[str, int] | None = None, ceiling: int = MAX_TOKENS, min_samples: int = MIN_SAMPLES):
+        self.adaptive = adaptive
+        self.margin = margin
+        self.fixed = dict(fixed or {})
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+        self.truncations: deque[dict] = deque(maxlen=KEEP_TRUNCATIONS)
+        self._outputs: dict[str, deque[int]] = {}
+        self._budgets: dict[str, int] = {}  # learned budget per kind
+        self._floors: dict[str, int] = {}  # raised by truncations
+        self._counts: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _learned(self, kind: str) -> int:
+        """Budget from the recent outputs of `kind`. Caller holds _lock."""
+        outputs = self._outputs.get(kind)
+        if not outputs or len(outputs) < self.min_samples:
+            return self.ceiling
+        budget = math.ceil(percentile(list(outputs), BUDGET_PERCENTILE) * self.margin)
+        return max(MIN_BUDGET, self._floors.get(kind, 0), min(self.ceiling, budget))
+
+    def max_tokens(self, kind: str | None) -> int:
+        """max_tokens for the next call of `kind` (MAX_TOKENS for unlabelled calls)."""
+        if kind in self.fixed:
+            return self.fixed[kind]
+        if not self.adaptive or kind is None:
+            return self.ceiling
+        return self._budgets.get(kind, self.ceiling)
+
+    def record(self, kind: str | None, output_tokens: int, max_tokens: int, truncated: bool,
+               queue_key: str | None = None) -> None:
+        if kind is None:
+            return
+        with self._lock:
+            counts = self._counts.setdefault(kind, {"calls": 0, "truncated": 0})
+            counts["calls"] += 1
+            self._outputs.setdefault(kind, deque(maxlen=OUTPUT_SAMPLES)).append(output_tokens)
+            if truncated:
+                counts["truncated"] += 1
+                self._floors[kind] = min(self.ceiling, max(self._floors.get(kind, 0), 2 * max_tokens))
+                self.truncations.append({"kind": kind, "max_tokens": max_tokens, "session_id": queue_key,
+                                         "time": time.time()})
+            self._budgets[kind] = self._learned(kind)
+
+    def stats(self) -> dict:
+        with self._lock:
+            kinds = {}
+            for kind, outputs in self._outputs.items():
+                values = list(outputs)
+                kinds[kind] = {**self._counts[kind], "max_tokens": self.max_tokens(kind),
+                               "learned_max_tokens": self._budgets[kind],
+                               "output_p50": percentile(values, 0.5), "output_p99": percentile(values, 0.99),
+                               "output_max": max(values)}
+            return {"adaptive": self.adaptive, "margin": self.margin, "kinds": kinds,
+                    "recent_truncations": list(self.truncations)}
+
+
+OUTPUT_BUDGETS = OutputBudgets(fixed=parse_budgets(os.getenv("CAMI_OUTPUT_BUDGETS", "")))
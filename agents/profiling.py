@@ -0,0 +1,150 @@
+"""Opt-in profiling of single API requests: a stack sampler plus a tracemalloc diff.
+
+A profiled request is sampled every CAMI_PROFILE_INTERVAL seconds. The sampler reads
+every thread's stack and keeps the ones running this repo's code, so idle workers and
+the event loop drop out. Other requests running at the same moment do show up; profile
+on a quiet worker when that matters. Stacks are kept in folded format ("a;b;c count"),
+which flamegraph.pl and speedscope read directly. Allocations are the top tracemalloc
+differences between the start and the end of the request.
+
+Snapshots, their comparison and the writes to CAMI_PROFILE_DIR run in a worker thread,
+so a profiled request doesn't stall the event loop for the other requests.
+
+One request is profiled at a time; others run normally in the meantime. The last
+KEEP_PROFILES results are kept in memory and, with CAMI_PROFILE_DIR set, also written
+there as <id>.json and <id>.folded.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+
+PROFILE_SAMPLE_RATE = float(os.getenv("CAMI_PROFILE_SAMPLE_RATE", "0"))  # fraction of requests profiled
+PROFILE_INTERVAL = float(os.getenv("CAMI_PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("CAMI_PROFILE_DIR")
+KEEP_PROFILES = 20
+TOP_ALLOCATIONS = 25
+TOP_STACKS = 10
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _folded(frame) -> str | None:
+    """Root-to-leaf "file:function" stack, or None if no frame is this repo's code."""
+    names, ours = [], False
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.startswith(ROOT) and code.co_filename != __file__:
+            ours = True
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names)) if ours else None
+
+
+class StackSampler:
+    """Background thread counting the folded stacks of the other threads."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    stack = _folded(frame)
+                    if stack:
+                        self.stacks[stack] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class RequestProfiler:
+    """Profiles one request at a time and keeps the recent results."""
+
+    def __init__(self, directory: str | None = PROFILE_DIR, interval: float = PROFILE_INTERVAL,
+                 keep: int = KEEP_PROFILES):
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.profiles: OrderedDict[str, dict] = OrderedDict()
+        self._busy = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @asynccontextmanager
+    async def profile(self, profile_id: str, **meta):
+        """Profile the block; yields False (and profiles nothing) if another profile is running."""
+        if not self._busy.acquire(blocking=False):
+            yield False
+            return
+        try:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = await asyncio.to_thread(tracemalloc.take_snapshot)
+            sampler = StackSampler(self.interval)
+            start = time.time()
+            sampler.start()
+            try:
+                yield True
+            finally:
+                await asyncio.to_thread(sampler.stop)
+                duration = time.time() - start
+                after = await asyncio.to_thread(tracemalloc.take_snapshot)
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+                allocations = await asyncio.to_thread(_allocation_diff, before, after)
+                await asyncio.to_thread(self._store, profile_id, {
+                    "id": profile_id, **meta, "started": start, "duration": round(duration, 6),
+                    "interval": self.interval, "samples": sampler.samples, "peak_traced_bytes": peak,
+                    "top_stacks": [{"stack": s, "samples": n} for s, n in sampler.stacks.most_common(TOP_STACKS)],
+                    "allocations": allocations,
+                }, sampler.stacks)
+        finally:
+            self._busy.release()
+
+    def _store(self, profile_id: str, result: dict, stacks: Counter) -> None:
+        folded = "".join(f"{stack} {n}\n" for stack, n in stacks.items())
+        self.profiles[profile_id] = {**result, "folded": folded}
+        while len(self.profiles) > self.keep:
+            self.profiles.popitem(last=False)
+        if self.directory:
+            with open(os.path.join(self.directory, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=1)
+            with open(os.path.join(self.directory, f"{profile_id}.folded"), "w", encoding="utf-8") as f:
+                f.write(folded)
+
+    def get(self, profile_id: str) -> dict | None:
+        return self.profiles.get(profile_id)
+
+    def summaries(self) -> list[dict]:
+        return [{k: p.get(k) for k in ("id", "method", "path", "started", "duration", "samples")}
+                for p in reversed(self.profiles.values())]
+
+
+def _allocation_diff(before, after) -> list[dict]:
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+               tracemalloc.Filter(False, "<frozen *>"), tracemalloc.Filter(False, "")]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    return [{"where": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+             "size_diff": s.size_diff, "count_diff": s.count_diff}
+            for s in stats[:TOP_ALLOCATIONS] if s.size_diff]
@@ -0,0 +1,196 @@
+"""Priority gate for upstream LLM calls.
+
+At most CAMI_LLM_CONCURRENCY calls run at once (0 disables the gate). When a slot
+frees up it goes to the waiting call of the best class:
+
+    interactive (a conversational reply) > phase_start (opening a new phase)
+        > one_shot (reframe/summarize) > background (rolling summary, speculative work)
+
+Waiting raises a call one class every CAMI_LLM_AGING seconds, so heavy or background
+work is delayed under load but never starved. Per-class wait times are kept for /metrics.
+
+Within a class, calls are ordered by start-time fair queuing on a key (the session id):
+each key's calls get virtual start tags that advance by cost / weight, so a session
+sending requests back to back, or sending huge prompts, falls behind the others
+instead of taking every slot. Cost is the request's estimated input tokens (token_estimate.py).
+
+Bulk work can run under lowered_priority(), which caps every call it makes at a class
+(e.g. "background"), whatever the agent asks for.
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+PRIORITIES = ("interactive", "phase_start", "one_shot", "background")
+LLM_CONCURRENCY = int(os.getenv("CAMI_LLM_CONCURRENCY", "0"))
+AGING_SECONDS = float(os.getenv("CAMI_LLM_AGING", "2.0"))
+WAIT_SAMPLES = 1000  # recent waits kept per class for percentiles
+TRACKED_KEYS = 10_000  # most recently active keys kept in per-key metrics
+
+_priority_floor: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority_floor", default=0)
+
+
+@contextmanager
+def lowered_priority(priority: str):
+    """Run LLM calls made in this context at `priority` or below."""
+    token = _priority_floor.set(PRIORITIES.index(priority))
+    try:
+        yield
+    finally:
+        _priority_floor.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("rank", "since", "granted", "key", "start")
+
+    def __init__(self, rank: int, key: str | None, start: float):
+        self.rank = rank
+        self.since = time.monotonic()
+        self.granted = threading.Event()
+        self.key = key
+        self.start = start
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile (`p` in 0..1) of `values`; 0.0 when there are none."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, math.ceil(p * len(values)) - 1))]
+
+
+class LLMGate:
+    """Concurrency limit whose free slots go to the highest (aged) priority first."""
+
+    def __init__(self, limit: int = LLM_CONCURRENCY, aging: float = AGING_SECONDS):
+        self.limit = limit
+        self.aging = aging
+        self.active = 0
+        self._waiting: list[_Waiter] = []
+        self._lock = threading.Lock()
+        self._waits = {name: deque(maxlen=WAIT_SAMPLES) for name in PRIORITIES}
+        self._counts = {name: 0 for name in PRIORITIES}
+        self._virtual = 0.0  # start tag of the last call granted
+        self._finish: dict[str, float] = {}  # key -> finish tag of its latest call
+        self.weights: dict[str, float] = {}  # key -> share weight (default 1)
+        self._keys: OrderedDict[str, dict] = OrderedDict()  # per-key metrics
+
+    def _effective_rank(self, waiter: _Waiter, now: float) -> int:
+        if self.aging <= 0:
+            return waiter.rank
+        return waiter.rank - int((now - waiter.since) / self.aging)
+
+    def _order(self, now: float):
+        return lambda w: (self._effective_rank(w, now), w.start, w.since)
+
+    def _grant_next(self) -> None:
+        """Hand free slots to the best waiters. Caller holds _lock."""
+        while self._waiting and self.active < self.limit:
+            best = min(self._waiting, key=self._order(time.monotonic()))
+            self._waiting.remove(best)
+            self._virtual = max(self._virtual, best.start)
+            self.active += 1
+            best.granted.set()
+
+    def _start_tag(self, key: str | None, cost: float) -> float:
+        """Virtual start of a new call for `key`; advances the key's finish tag. Caller holds _lock."""
+        if key is None:
+            return self._virtual
+        start = max(self._virtual, self._finish.get(key, 0.0))
+        self._finish[key] = start + max(cost, 1.0) / self.weights.get(key, 1.0)
+        if len(self._finish) > TRACKED_KEYS:  # keys at or behind virtual time carry no state
+            self._finish = {k: f for k, f in self._finish.items() if f > self._virtual}
+        return start
+
+    def _record_key(self, key: str, wait: float) -> None:
+        stats = self._keys.pop(key, None) or {"calls": 0, "wait_total": 0.0, "wait_max": 0.0}
+        stats["calls"] += 1
+        stats["wait_total"] += wait
+        stats["wait_last"] = wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        self._keys[key] = stats
+        if len(self._keys) > TRACKED_KEYS:
+            self._keys.popitem(last=False)
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", key: str | None = None, cost: float = 1.0):
+        """Hold one upstream slot for the duration of the block.
+
+        `key` groups calls for fair sharing (None opts out); `cost` is the call's size.
+        """
+        if self.limit <= 0:
+            yield
+            return
+        priority = PRIORITIES[max(PRIORITIES.index(priority), _priority_floor.get())]
+        with self._lock:
+            waiter = _Waiter(PRIORITIES.index(priority), key, self._start_tag(key, cost))
+            self._waiting.append(waiter)
+            self._grant_next()
+        waiter.granted.wait()
+        with self._lock:
+            wait = time.monotonic() - waiter.since
+            self._counts[priority] += 1
+            self._waits[priority].append(wait)
+            if key is not None:
+                self._record_key(key, wait)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self._grant_next()
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            waiting = {name: 0 for name in PRIORITIES}
+            for waiter in self._waiting:
+                waiting[PRIORITIES[waiter.rank]] += 1
+            classes = {}
+            for name in PRIORITIES:
+                waits = list(self._waits[name])
+                classes[name] = {
+                    "calls": self._counts[name],
+                    "waiting": waiting[name],
+                    "wait_p50": round(percentile(waits, 0.5), 4),
+                    "wait_p95": round(percentile(waits, 0.95), 4),
+                    "wait_max": round(max(waits, default=0.0), 4),
+                }
+            oldest = min((w.since for w in self._waiting), default=now)
+            return {"limit": self.limit, "active": self.active, "oldest_wait": round(now - oldest, 4),
+                    "keys_waiting": len({w.key for w in self._waiting if w.key is not None}),
+                    "classes": classes}
+
+    def key_stats(self, keys=None) -> dict[str, dict]:
+        """Per-key queue position (1 = next to be granted; None if not waiting) and waits."""
+        with self._lock:
+            now = time.monotonic()
+            position: dict[str, int] = {}
+            for i, waiter in enumerate(sorted(self._waiting, key=self._order(now)), 1):
+                if waiter.key is not None:
+                    position.setdefault(waiter.key, i)
+            result = {}
+            if keys is None:
+                keys = [*self._keys, *(k for k in position if k not in self._keys)]
+            for key in keys:
+                stats = self._keys.get(key)
+                if stats is None and key not in position:
+                    continue
+                stats = stats or {"calls": 0, "wait_total": 0.0, "wait_max": 0.0, "wait_last": 0.0}
+                result[key] = {
+                    "position": position.get(key),
+                    "calls": stats["calls"],
+                    "wait_avg": round(stats["wait_total"] / stats["calls"], 4) if stats["calls"] else 0.0,
+                    "wait_last": round(stats["wait_last"], 4),
+                    "wait_max": round(stats["wait_max"], 4),
+                    "weight": self.weights.get(key, 1.0),
+                }
+            return result
+
+
+LLM_GATE = LLMGate()
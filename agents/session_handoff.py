@@ -0,0 +1,112 @@
+"""Moving live sessions between API workers/hosts.
+
+A session travels as a versioned envelope around JournalAgent.to_state():
+
+    {"version": 1, "session_id": ..., "last_access": ..., "state": {...}}
+
+It is either POSTed to a peer's /admin/session/import, or parked in a shared handoff
+directory (CAMI_HANDOFF_DIR) for whichever worker first sees a request for it. Claiming
+a parked session is an atomic rename, so exactly one worker gets it. Parked envelopes
+are gzipped JSON (about a third of the plain size).
+"""
+
+import gzip
+import json
+import os
+import urllib.error
+import urllib.request
+
+from .agent_journal_pin import JournalAgent
+
+HANDOFF_VERSION = 1
+HANDOFF_DIR = os.getenv("CAMI_HANDOFF_DIR")
+PEER_TIMEOUT = 10.0
+
+
+class HandoffError(RuntimeError):
+    """A session could not be handed to a peer."""
+
+
+def export_session(session_id: str, agent: JournalAgent, last_access: float, busy: bool = False) -> dict:
+    """Envelope for a session. `busy`: a request may be mid-turn, so drop an unanswered user turn."""
+    state = agent.to_state()
+    if busy:
+        drop_unanswered_turn(state)
+    return {"version": HANDOFF_VERSION, "session_id": session_id, "last_access": last_access, "state": state}
+
+
+def drop_unanswered_turn(state: dict) -> None:
+    """Remove a trailing user message that has no reply yet from a to_state() snapshot.
+
+    receive() stores the user turn before the LLM call, so a session exported mid-turn
+    would otherwise resume with two user messages in a row. The client never got a
+    reply to that turn and has to send it again.
+    """
+    messages = state["conversations"].get(state["phase"]) or []
+    if messages and messages[-1]["role"] == "user":
+        messages.pop()
+        if state["phase"] == "cbt" and not any(m["role"] == "user" for m in messages):
+            state["init_journal"] = None  # the dropped turn was the initial journal
+
+
+def import_session(payload: dict) -> tuple[JournalAgent, float]:
+    """The agent and last access time from an export_session() envelope."""
+    if payload.get("version") != HANDOFF_VERSION:
+        raise ValueError(f"Unsupported handoff version: {payload.get('version')}")
+    return JournalAgent.from_state(payload["state"]), payload["last_access"]
+
+
+def send_to_peer(peer: str, payload: dict, admin_token: str) -> None:
+    """POST a session to another API instance; raises HandoffError unless it accepted it."""
+    post_to_peer(peer, "/admin/session/import", payload, admin_token)
+
+
+def post_to_peer(peer: str, path: str, payload: dict, admin_token: str) -> dict:
+    """POST JSON to a peer's admin endpoint and return its JSON reply; raises HandoffError on failure."""
+    request = urllib.request.Request(
+        f"{peer.rstrip('/')}{path}",
+        data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json", "X-Admin-Token": admin_token},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=PEER_TIMEOUT) as response:
+            return json.loads(response.read() or b"{}")
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise HandoffError(f"{peer} refused {path} for session {payload.get('session_id')}: {e}") from e
+
+
+class HandoffStore:
+    """Directory of parked session envelopes shared by the workers of a deployment."""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.json.gz")
+
+    def put(self, payload: dict) -> None:
+        path = self._path(payload["session_id"])
+        data = gzip.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def claim(self, session_id: str) -> dict | None:
+        """Take a parked session, or None if it isn't here (or another worker won)."""
+        path = self._path(session_id)
+        claimed = f"{path}.claimed-{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        with gzip.open(claimed, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        os.remove(claimed)
+        return payload
+
+    def __len__(self) -> int:
+        return sum(1 for name in os.listdir(self.directory) if name.endswith(".json.gz"))
@@ -0,0 +1,180 @@
+"""Write-ahead event log per session, so the API can rebuild live sessions after a crash.
+
+Each session is one JSONL file: a snapshot line ({"type": "snapshot", "state": to_state()})
+followed by the transitions JournalAgent reports through on_event (receive, unreceive,
+reply, reframe, summarize, phase, cbt_summary). Appends are fsync'd in batches by a
+background thread every FSYNC_INTERVAL seconds (0 = fsync every event), so a crash loses
+at most that window — in practice the in-flight turn. Every COMPACT_EVERY events the file is
+rewritten as a single fresh snapshot (write to a temp file, fsync, rename).
+
+    CAMI_SESSION_LOG_DIR=sessions uvicorn main:app
+"""
+
+import json
+import os
+import threading
+import time
+from functools import partial
+
+from .agent_journal_pin import JournalAgent
+
+SESSION_LOG_DIR = os.getenv("CAMI_SESSION_LOG_DIR")
+FSYNC_INTERVAL = float(os.getenv("CAMI_SESSION_LOG_FSYNC_INTERVAL", "0.05"))
+COMPACT_EVERY = int(os.getenv("CAMI_SESSION_LOG_COMPACT_EVERY", "50"))
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class _SessionFile:
+    __slots__ = ("path", "agent", "file", "events", "lock")
+
+    def __init__(self, path: str, agent: JournalAgent):
+        self.path = path
+        self.agent = agent
+        self.file = None
+        self.events = 0
+        self.lock = threading.Lock()
+
+
+class SessionLog:
+    """Event logs for the live sessions of one API process, one file per session id."""
+
+    def __init__(self, directory: str, fsync_interval: float = FSYNC_INTERVAL, compact_every: int = COMPACT_EVERY):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.recovery: dict = {}
+        self.stats = {"events": 0, "fsyncs": 0, "compactions": 0}
+        self._sessions: dict[str, _SessionFile] = {}
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if fsync_interval > 0:
+            threading.Thread(target=self._flush_loop, name="session-log-fsync", daemon=True).start()
+
+    def path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.jsonl")
+
+    def attach(self, session_id: str, agent: JournalAgent) -> None:
+        """Start logging `agent` under `session_id`, beginning with a snapshot of its state."""
+        entry = _SessionFile(self.path(session_id), agent)
+        with self._lock:
+            self._sessions[session_id] = entry
+        with entry.lock:
+            self._write_snapshot(entry)
+        agent.on_event = partial(self._append, session_id)
+
+    def detach(self, session_id: str, delete: bool = True) -> None:
+        """Stop logging a session (e.g. expired); its file is deleted unless delete=False."""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            self._dirty.discard(session_id)
+        if entry is None:
+            return
+        entry.agent.on_event = None
+        with entry.lock:
+            entry.file.close()
+            if delete:
+                os.remove(entry.path)
+
+    def _append(self, session_id: str, kind: str, data: dict) -> None:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return
+        with entry.lock:
+            if entry.file.closed:
+                return
+            entry.file.write(_line({"type": kind, "t": round(time.time(), 3), **data}))
+            entry.events += 1
+            self.stats["events"] += 1
+            if entry.events >= self.compact_every:
+                self._write_snapshot(entry)
+                self.stats["compactions"] += 1
+                return
+            if self.fsync_interval <= 0:
+                self._fsync(entry)
+                return
+        with self._lock:
+            self._dirty.add(session_id)
+
+    def _write_snapshot(self, entry: _SessionFile) -> None:
+        """Replace the session file with one snapshot line. Caller holds entry.lock."""
+        if entry.file is not None:
+            entry.file.close()
+        tmp = entry.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(_line({"type": "snapshot", "t": round(time.time(), 3), "state": entry.agent.to_state()}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, entry.path)
+        entry.file = open(entry.path, "a", encoding="utf-8")
+        entry.events = 0
+
+    def _fsync(self, entry: _SessionFile) -> None:
+        entry.file.flush()
+        os.fsync(entry.file.fileno())
+        self.stats["fsyncs"] += 1
+
+    def flush(self) -> None:
+        """fsync every session with unsynced events."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            entries = [self._sessions[sid] for sid in dirty if sid in self._sessions]
+        for entry in entries:
+            with entry.lock:
+                if not entry.file.closed:
+                    self._fsync(entry)
+
+    def _flush_loop(self) -> None:
+        while not self._closed.wait(self.fsync_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._closed.set()
+        self.flush()
+        with self._lock:
+            entries = list(self._sessions.values())
+        for entry in entries:
+            with entry.lock:
+                entry.file.close()
+
+    def recover(self) -> dict[str, tuple[JournalAgent, float]]:
+        """Rebuild every logged session: {session_id: (agent, last_activity_time)}.
+
+        A torn last line (crash mid-write) is dropped. Recovered sessions are compacted
+        and logged again from here on. Timing is kept in self.recovery.
+        """
+        start = time.perf_counter()
+        recovered, events, dropped = {}, 0, 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".jsonl"):
+                continue
+            session_id = name[:-len(".jsonl")]
+            agent, last_seen = None, 0.0
+            with open(os.path.join(self.directory, name), "rb") as f:  # a torn line may end mid-character
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # JSONDecodeError, UnicodeDecodeError
+                        dropped += 1
+                        break
+                    last_seen = record.get("t", last_seen)
+                    if record["type"] == "snapshot":
+                        agent = JournalAgent.from_state(record["state"])
+                    elif agent is not None:
+                        agent.apply_event(record)
+                        events += 1
+            if agent is None:
+                continue
+            self.attach(session_id, agent)
+            recovered[session_id] = (agent, last_seen)
+        self.recovery = {
+            "sessions": len(recovered),
+            "events": events,
+            "torn_lines": dropped,
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+        return recovered
@@ -0,0 +1,99 @@
+"""Local estimate of a request's input tokens, calibrated against the API's usage.
+
+Rate limiting, quotas and context budgeting need a token count before a request is
+sent. Counting characters is badly off for mixed Traditional Chinese / English text,
+so text is split by script: each CJK character or punctuation mark counts as
+CJK_TOKENS_PER_CHAR, each ASCII word as one token per ASCII_CHARS_PER_TOKEN characters
+(rounded up), and any other non-space character as one token. Every message adds
+MESSAGE_OVERHEAD for its role framing.
+
+That raw count is scaled by a correction factor per model, learned online: after each
+call the ratio of usage.input_tokens to the raw count of the same request moves the
+factor by CALIBRATION_ALPHA. Per-message raw counts are cached on a MessageLog (a
+view), so estimating a growing conversation only counts the new messages.
+"""
+
+import re
+import threading
+
+from .message_log import MessageLog
+
+CJK_TOKENS_PER_CHAR = 1.0
+ASCII_CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD = 4
+CALIBRATION_ALPHA = 0.05
+RATIO_BOUNDS = (0.25, 4.0)  # observed ratios outside these are treated as outliers and clamped
+
+# CJK radicals, punctuation, kana, ideographs and full-width forms
+CJK = re.compile(r"[\u2e80-\u2fff\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+ASCII_WORD = re.compile(r"[A-Za-z0-9]+")
+SPACE = re.compile(r"\s")
+
+
+def _text(content) -> str:
+    if isinstance(content, list):  # content blocks
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return str(content)
+
+
+def raw_text_tokens(text: str) -> float:
+    """Uncalibrated token count of `text`."""
+    cjk = len(CJK.findall(text))
+    words = ASCII_WORD.findall(text)
+    word_chars = sum(map(len, words))
+    other = len(text) - cjk - word_chars - len(SPACE.findall(text))
+    return cjk * CJK_TOKENS_PER_CHAR + sum((len(w) + ASCII_CHARS_PER_TOKEN - 1) // ASCII_CHARS_PER_TOKEN
+                                           for w in words) + other
+
+
+def _message_tokens(role: str, content) -> float:
+    return raw_text_tokens(_text(content)) + MESSAGE_OVERHEAD
+
+
+def raw_tokens(messages) -> float:
+    """Uncalibrated token count of a message list; incremental for a MessageLog."""
+    if isinstance(messages, MessageLog):
+        return sum(messages.view("token_estimate", _message_tokens))
+    return sum(_message_tokens(msg["role"], msg["content"]) for msg in messages)
+
+
+class TokenEstimator:
+    """Raw token counts scaled by a per-model factor learned from actual input_tokens."""
+
+    def __init__(self, alpha: float = CALIBRATION_ALPHA):
+        self.alpha = alpha
+        self.factors: dict[str, float] = {}
+        self._errors: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def factor(self, model: str) -> float:
+        return self.factors.get(model, 1.0)
+
+    def estimate(self, messages, model: str) -> int:
+        """Estimated input tokens of `messages` sent to `model`."""
+        return round(raw_tokens(messages) * self.factor(model))
+
+    def estimate_text(self, text: str, model: str) -> int:
+        return round(raw_text_tokens(text) * self.factor(model))
+
+    def calibrate(self, model: str, raw: float, input_tokens: int) -> None:
+        """Move `model`'s factor toward input_tokens / raw (the raw count of the same request)."""
+        if raw <= 0 or input_tokens <= 0:
+            return
+        with self._lock:
+            factor = self.factors.get(model)
+            errors = self._errors.setdefault(model, {"calls": 0, "abs_error": 0.0})
+            errors["calls"] += 1
+            errors["abs_error"] += abs(raw * (factor or 1.0) - input_tokens) / input_tokens
+            ratio = min(max(input_tokens / raw, RATIO_BOUNDS[0]), RATIO_BOUNDS[1])
+            self.factors[model] = ratio if factor is None else factor + self.alpha * (ratio - factor)
+
+    def stats(self) -> dict:
+        """Factor per model and the mean relative error of the estimates made before each call."""
+        with self._lock:
+            return {model: {"factor": round(self.factors[model], 4), "calls": e["calls"],
+                            "mean_abs_error": round(e["abs_error"] / e["calls"], 4)}
+                    for model, e in self._errors.items()}
+
+
+TOKEN_ESTIMATOR = TokenEstimator()
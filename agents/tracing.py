@@ -0,0 +1,165 @@
+"""Nested trace spans for the request path: API → JournalAgent → LLMService.
+
+    with span("agent.reframe", session_id=sid) as s:
+        ...
+        s.set(input_tokens=120)
+
+The current span lives in a contextvar, so spans opened further down the call stack
+become its children. Finished spans go to the exporter: set CAMI_TRACE_FILE for the
+JSONL exporter (one span per line), or install any object with export(record) and
+close() through set_exporter(). With no exporter, span() is a no-op.
+
+A streamed response is resumed from different worker threads, each with a fresh copy
+of the request context; wrap it in bound() so every resume sees the same spans.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv("CAMI_TRACE_FILE")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "attrs", "_t0")
+
+    def __init__(self, name: str, parent: "Span | None", attrs: dict):
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.start = time.time()
+        self.attrs = attrs
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def add(self, name: str, amount: float = 1) -> None:
+        self.attrs[name] = self.attrs.get(name, 0) + amount
+
+    def record(self, duration: float) -> dict:
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "name": self.name, "start": round(self.start, 6), "duration": round(duration, 6),
+                "attrs": self.attrs}
+
+
+class _NoSpan:
+    """Stands in for a span when tracing is off (or outside any span)."""
+
+    trace_id = span_id = None
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def add(self, name: str, amount: float = 1) -> None:
+        pass
+
+
+NO_SPAN = _NoSpan()
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("cami_span", default=None)
+
+
+class JsonlExporter:
+    """Appends one JSON line per finished span; flushed whenever a trace's root span ends."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            if record["parent_id"] is None:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_exporter = JsonlExporter(TRACE_FILE) if TRACE_FILE else None
+
+
+def set_exporter(exporter) -> None:
+    """Send finished spans to `exporter` (None turns tracing off); closes the previous one."""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    if previous is not None and previous is not exporter:
+        previous.close()
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def current_span():
+    return _current.get() or NO_SPAN
+
+
+@contextmanager
+def _no_span():
+    yield NO_SPAN
+
+
+@contextmanager
+def _span(name: str, attrs: dict):
+    parent = _current.get()
+    s = Span(name, parent, attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            s.set(error=f"{type(e).__name__}: {e}")
+        else:
+            s.set(cancelled=True)
+        raise
+    finally:
+        _current.reset(token)
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(s.record(time.perf_counter() - s._t0))
+
+
+def span(name: str, **attrs):
+    """Context manager timing a block as a child of the current span."""
+    if _exporter is None:
+        return _no_span()
+    return _span(name, attrs)
+
+
+def bound(iterator):
+    """Iterate `iterator` with every step run in one context, captured on the first step."""
+    context = contextvars.copy_context()
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            context.run(close)
+
+
+def _count_retry(request) -> None:
+    """httpx request hook: the Anthropic SDK numbers its retries in a header."""
+    retries = int(request.headers.get("x-stainless-retry-count", "0") or 0)
+    if retries:
+        current_span().set(retries=retries)
+
+
+def watch_retries(llm) -> None:
+    """Record SDK retries of a ChatAnthropic model's HTTP calls on the current span."""
+    http = getattr(getattr(llm, "_client", None), "_client", None)
+    hooks = getattr(http, "event_hooks", None)
+    if hooks is not None and _count_retry not in hooks.get("request", []):
+        http.event_hooks = {**hooks, "request": [*hooks.get("request", []), _count_retry]}
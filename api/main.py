@@ -1,34 +1,63 @@
 """CAMI Journal API — FastAPI backend wrapping JournalAgent."""
 
+import asyncio
+import contextvars
+import hmac
+import json
 import os
+import queue
+import random
+import re
 import sys
+import threading
 import time
+import urllib.error
+import urllib.request
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Optional
 
 from dotenv import load_dotenv
 
-# Load .env from project root (parent of api/) — MUST run before importing agent_journal
-# because it reads ANTHROPIC_API_KEY at module scope
+# Load .env from project root (parent of api/) before any LLM client reads ANTHROPIC_API_KEY
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
 # Add project root to sys.path so `agents` package is importable
 # (uvicorn runs from api/, so the parent dir isn't on sys.path by default)
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-from agents.agent_journal_pin import JournalAgent
-
-from fastapi import FastAPI, HTTPException
+from agents.agent_journal_pin import JournalAgent, LLMService
+from agents.agent_pool import AgentPool
+from agents.batch import DeferredQueue
+from agents.ledger import Account, QuotaExceeded, TokenLedger
+from agents.memory_stats import memory_report, session_memory
+from agents.output_budget import OUTPUT_BUDGETS
+from agents.profiling import PROFILE_SAMPLE_RATE, RequestProfiler
+from agents.scheduler import LLM_GATE, lowered_priority
+from agents.session_handoff import (HANDOFF_DIR, HandoffError, HandoffStore, export_session, import_session,
+                                    post_to_peer, send_to_peer)
+from agents.session_log import SESSION_LOG_DIR, SessionLog
+from agents.token_estimate import TOKEN_ESTIMATOR
+from agents.tracing import bound, current_span, enabled as tracing_enabled, set_exporter, span
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
 # --- Pydantic models ---
 
+BULK_MAX_ITEMS = int(os.getenv("CAMI_BULK_MAX_ITEMS", "10000"))
+BULK_CONCURRENCY = int(os.getenv("CAMI_BULK_CONCURRENCY", "8"))
+BULK_MAX_CONCURRENCY = 64
+
 
 class CreateSessionRequest(BaseModel):
     valence: float = Field(..., ge=-1.0, le=1.0)
     support_type: float = Field(..., ge=-1.0, le=1.0)
     model: Optional[str] = Field("sonnet")
+    user_id: Optional[str] = Field(None, min_length=1, max_length=128)  # usage and quotas are per user
 
 
 class SendMessageRequest(BaseModel):
@@ -69,39 +98,411 @@ class CommandResponse(BaseModel):
     metadata: Optional[dict] = None
 
 
+class BulkSessionsRequest(BaseModel):
+    sessions: list[CreateSessionRequest] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+
+class BulkMessage(BaseModel):
+    session_id: str
+    content: str = Field(..., min_length=1)
+
+
+class BulkMessagesRequest(BaseModel):
+    messages: list[BulkMessage] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+    concurrency: int = Field(BULK_CONCURRENCY, ge=1, le=BULK_MAX_CONCURRENCY)  # sessions worked on at once
+
+
+class DeferredRequest(BaseModel):
+    command: str  # "reframe" or "summarize"
+
+
+class DeferredResult(BaseModel):
+    session_id: str
+    command: str
+    text: str
+    digest: str
+
+
+class DrainRequest(BaseModel):
+    peers: list[str] = []  # defaults to CAMI_PEERS
+
+
 # --- Session store ---
 
 SESSION_TTL = 3600  # 1 hour
 
 sessions: dict[str, tuple] = {}  # {id: (JournalAgent, last_access_time)}
 
+# Write-ahead event log per session; live sessions are replayed from it on startup
+session_log = SessionLog(SESSION_LOG_DIR) if SESSION_LOG_DIR else None
+
+# Token usage and cost per session/user/model, with daily quotas (CAMI_LEDGER_DB, CAMI_DAILY_TOKEN_QUOTA)
+ledger = TokenLedger()
+
+# Opt-in deferred reframe/summarize through a batch API (CAMI_BATCH_BACKEND); results are
+# committed to the session and POSTed to CAMI_BATCH_WEBHOOK when ready
+deferred = DeferredQueue()
+BATCH_WEBHOOK = os.getenv("CAMI_BATCH_WEBHOOK")
+WEBHOOK_TIMEOUT = 10.0
+
+
+# --- Migration between workers/hosts ---
+
+ADMIN_TOKEN = os.getenv("CAMI_ADMIN_TOKEN")  # admin endpoints are disabled without it
+PEERS = [peer for peer in os.getenv("CAMI_PEERS", "").split(",") if peer]
+SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+handoff_store = HandoffStore(HANDOFF_DIR) if HANDOFF_DIR else None
+SHUTDOWN_GRACE = float(os.getenv("CAMI_SHUTDOWN_GRACE", "20"))  # seconds in-flight requests get on shutdown
+moved: dict[str, Optional[str]] = {}  # {id: peer it was handed to, or None if parked in handoff_store}
+draining = False
+session_locks: dict[str, threading.Lock] = {}  # held while a request works on a session
+
+
+class SessionMoved(Exception):
+    def __init__(self, peer: Optional[str]):
+        self.peer = peer
+
+
+def session_lock(session_id: str) -> threading.Lock:
+    return session_locks.setdefault(session_id, threading.Lock())
+
+
+def bind_session(session_id: str, agent) -> None:
+    agent.queue_key = session_id  # upstream LLM slots are shared fairly between sessions
+    agent.account = Account(ledger, session_id, agent.user_id)
+
+
+def register_session(session_id: str, agent, last_access: float) -> None:
+    bind_session(session_id, agent)
+    sessions[session_id] = (agent, last_access)
+    if session_log:
+        session_log.attach(session_id, agent)
+
+
+def forget_session(session_id: str) -> None:
+    del sessions[session_id]
+    session_locks.pop(session_id, None)
+    ledger.forget_session(session_id)
+    deferred.forget_session(session_id)
+    if session_log:
+        session_log.detach(session_id)
+
+
+def adopt_session(session_id: str) -> bool:
+    """Pick up a session another worker parked in the handoff store."""
+    if draining or handoff_store is None or not SESSION_ID.fullmatch(session_id):
+        return False
+    payload = handoff_store.claim(session_id)
+    if payload is None:
+        return False
+    register_session(session_id, *import_session(payload))
+    return True
+
 
 def cleanup_sessions():
     now = time.time()
     expired = [sid for sid, (_, ts) in sessions.items() if now - ts > SESSION_TTL]
     for sid in expired:
-        del sessions[sid]
+        forget_session(sid)
 
 
 def get_session(session_id: str):
     cleanup_sessions()
     if session_id not in sessions:
-        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+        if session_id in moved:
+            raise SessionMoved(moved[session_id])
+        if not adopt_session(session_id):
+            session_locks.pop(session_id, None)
+            raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
     agent, _ = sessions[session_id]
     sessions[session_id] = (agent, time.time())
     return agent
 
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set CAMI_ADMIN_TOKEN)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def hand_off(payload: dict, peers: list[str], start: int) -> Optional[str]:
+    """Give a session to the first peer that takes it (rotating from `start`), else park it.
+
+    Returns the peer, or None when parked; raises HandoffError if there was nowhere to put it.
+    """
+    for i in range(len(peers)):
+        peer = peers[(start + i) % len(peers)]
+        try:
+            send_to_peer(peer, payload, ADMIN_TOKEN)
+            return peer
+        except HandoffError:
+            continue
+    if handoff_store is None:
+        raise HandoffError(f"No peer or handoff store took session {payload['session_id']}")
+    handoff_store.put(payload)
+    return None
+
+
+def drain_sessions(peers: list[str], deadline: Optional[float] = None) -> dict:
+    """Hand every live session to a peer (or park it) once no request is working on it.
+
+    With a `deadline` (time.monotonic()), sessions still busy then are exported anyway
+    ("forced"). The user message of a turn is stored before its LLM call, so a forced
+    export drops a trailing unanswered user message (export_session(busy=True)); the
+    turn in flight is lost and the client has to resend it.
+    """
+    to_peers: dict[str, int] = {}
+    parked, failed, forced = 0, [], []
+    for i, session_id in enumerate(list(sessions)):
+        lock = session_lock(session_id)
+        locked = lock.acquire(timeout=-1 if deadline is None else max(0.0, deadline - time.monotonic()))
+        try:
+            if session_id not in sessions:
+                continue
+            if not locked:
+                forced.append(session_id)
+            agent, last_access = sessions[session_id]
+            try:
+                peer = hand_off(export_session(session_id, agent, last_access, busy=not locked), peers, i)
+            except HandoffError:
+                failed.append(session_id)
+                continue
+            forget_session(session_id)
+            moved[session_id] = peer
+        finally:
+            if locked:
+                lock.release()
+        if peer:
+            to_peers[peer] = to_peers.get(peer, 0) + 1
+        else:
+            parked += 1
+    return {"to_peers": to_peers, "parked": parked, "failed": failed, "forced": forced, "remaining": len(sessions)}
+
+
+def shut_down_sessions() -> None:
+    """Park every live session in the handoff store; the next worker restores each one on first access."""
+    global draining
+    draining = True  # no new sessions, no adopting parked ones
+    if not sessions:
+        return
+    if handoff_store is None:
+        print(f"Shutdown: {len(sessions)} sessions not saved (set CAMI_HANDOFF_DIR)")
+        return
+    start = time.monotonic()
+    result = drain_sessions([], deadline=start + SHUTDOWN_GRACE)
+    print(f"Shutdown: parked {result['parked']} sessions ({len(result['forced'])} still busy after "
+          f"{SHUTDOWN_GRACE:g}s, {len(result['failed'])} failed) in {time.monotonic() - start:.3f}s")
+
+
 def strip_counselor_prefix(text: str) -> str:
     if text.startswith("Counselor: "):
         return text[len("Counselor: "):]
     return text
 
 
+def locked_ndjson_stream(session_id: str, start, rollback=None):
+    """ndjson_stream(start(agent)) holding the session lock for the whole response.
+
+    `rollback(agent)` undoes what start() stored (a received user turn) if the stream
+    doesn't complete.
+    """
+    with session_lock(session_id):
+        try:
+            agent = get_session(session_id)
+            agent.account.check()
+            stream = start(agent)
+        except (SessionMoved, QuotaExceeded, HTTPException, ValueError) as e:
+            yield error_line(e)
+            return
+        yield from ndjson_stream(stream, rollback and (lambda: rollback(agent)))
+
+
+def error_line(e: Exception) -> str:
+    """Last line of a failed stream: {"type": "error", "status", "detail", ...} (see bulk_error)."""
+    return json.dumps({"type": "error", **bulk_error(e)}, ensure_ascii=False) + "\n"
+
+
+def ndjson_stream(stream, rollback=None):
+    """NDJSON lines for an agent stream: {"type": "chunk", "text"} ..., then {"type": "done", ...}.
+
+    The "Counselor: " prefix is held back until it can be told apart from the reply. An
+    error after the response has started (quota, upstream, cassette miss) ends the stream
+    with an error line instead of cutting it off; `rollback()` runs if it doesn't complete.
+    """
+    prefix = "Counselor: "
+    head = ""
+    done = False
+    try:
+        for item in stream:
+            if isinstance(item, dict):
+                if head:
+                    yield json.dumps({"type": "chunk", "text": strip_counselor_prefix(head)}, ensure_ascii=False) + "\n"
+                item["content"] = strip_counselor_prefix(item["content"])
+                done = True
+                yield json.dumps({"type": "done", **item}, ensure_ascii=False) + "\n"
+                return
+            if head is not None:
+                head += item
+                if len(head) < len(prefix) and prefix.startswith(head):
+                    continue
+                item, head = strip_counselor_prefix(head), None
+            if item:
+                yield json.dumps({"type": "chunk", "text": item}, ensure_ascii=False) + "\n"
+    except Exception as e:
+        if rollback is not None:
+            rollback()
+            rollback = None
+        yield error_line(e)
+    finally:
+        stream.close()  # client went away: nothing is committed
+        if rollback is not None and not done:
+            rollback()
+
+
+def public_message(role: str, content) -> dict | None:
+    """How a stored message is shown to clients (cached per conversation via MessageLog.view)."""
+    if role == "system":
+        return None
+    return {"role": role, "content": strip_counselor_prefix(content) if role == "assistant" else content}
+
+
+# Pre-built, warmed agents per emotion bucket so POST /session doesn't build one inline
+AGENT_POOL_SIZE = int(os.getenv("CAMI_AGENT_POOL_SIZE", "2"))  # per model and bucket; 0 disables
+AGENT_POOL_MODELS = tuple(os.getenv("CAMI_AGENT_POOL_MODELS", "sonnet").split(","))
+
+agent_pool = AgentPool(models=AGENT_POOL_MODELS, size=AGENT_POOL_SIZE)
+
+
+# --- Readiness ---
+
+ready = threading.Event()
+warmup_seconds: Optional[float] = None
+
+
+def warm_up() -> None:
+    """Import the LLM libraries, build their HTTP clients and fill the agent pool; then /ready flips."""
+    global warmup_seconds
+    start = time.perf_counter()
+    try:
+        for model in AGENT_POOL_MODELS:
+            LLMService(None, model).warm()
+    except Exception as e:
+        print(f"Warmup failed, not ready: {e!r}")
+        return
+    agent_pool.start()
+    agent_pool.wait_filled()
+    warmup_seconds = round(time.perf_counter() - start, 3)
+    print(f"Warmed up in {warmup_seconds:.3f}s")
+    ready.set()
+
+
 # --- App ---
 
-app = FastAPI(title="CAMI Journal API", version="0.1.0")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if session_log:
+        sessions.update(session_log.recover())
+        for session_id, (agent, _) in sessions.items():
+            bind_session(session_id, agent)
+        r = session_log.recovery
+        print(f"Recovered {r['sessions']} sessions ({r['events']} events replayed) in {r['seconds']:.3f}s")
+    if handoff_store is not None:
+        print(f"{len(handoff_store)} parked sessions in {handoff_store.directory} (restored on first access)")
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    yield
+    await asyncio.to_thread(shut_down_sessions)  # keeps the loop free for responses still streaming
+    if session_log:
+        session_log.close()
+    ledger.close()
+    dropped = deferred.close()
+    if dropped:
+        print(f"Shutdown: {dropped} deferred jobs dropped")
+    set_exporter(None)  # flush and close the trace file
+
+
+app = FastAPI(title="CAMI Journal API", version="0.1.0", lifespan=lifespan)
+
+
+@app.exception_handler(SessionMoved)
+def session_moved(request: Request, exc: SessionMoved):
+    if exc.peer:
+        location = exc.peer.rstrip("/") + request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        return JSONResponse({"detail": "Session moved"}, status_code=307, headers={"Location": location})
+    return JSONResponse({"detail": "Session is being handed off, retry"}, status_code=503,
+                        headers={"Retry-After": "1"})
+
+
+@app.exception_handler(QuotaExceeded)
+def quota_exceeded(request: Request, exc: QuotaExceeded):
+    return JSONResponse({"detail": str(exc), "used": exc.used, "quota": exc.quota}, status_code=429,
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+class TraceMiddleware:
+    """Root trace span of each HTTP request, kept open until a streamed body is done."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing_enabled():
+            return await self.app(scope, receive, send)
+        with span("http", method=scope["method"], path=scope["path"]) as s:
+            async def traced_send(message):
+                if message["type"] == "http.response.start":
+                    s.set(status=message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                route = scope.get("route")
+                s.set(route=getattr(route, "path", None), session_id=scope.get("path_params", {}).get("session_id"))
+
+
+profiler = RequestProfiler()
+
+
+class ProfileMiddleware:
+    """Profile a request when an admin sends X-Profile, or at CAMI_PROFILE_SAMPLE_RATE.
+
+    The result is stored under the id returned in the X-Profile-Id response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wanted(self, scope) -> bool:
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return True
+        if not ADMIN_TOKEN:
+            return False
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-admin-token", b"").decode("latin-1")
+        return b"x-profile" in headers and hmac.compare_digest(token, ADMIN_TOKEN)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            return await self.app(scope, receive, send)
+        profile_id = uuid.uuid4().hex[:16]
+        async with profiler.profile(profile_id, method=scope["method"], path=scope["path"]) as profiling:
+            if not profiling:
+                return await self.app(scope, receive, send)
+            current_span().set(profile_id=profile_id)
+
+            async def tagged_send(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+                await send(message)
+
+            await self.app(scope, receive, tagged_send)
+
+
+app.add_middleware(ProfileMiddleware)
+app.add_middleware(TraceMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -116,7 +517,18 @@ app.add_middleware(
 
 @app.post("/session", response_model=CreateSessionResponse)
 def create_session(request: CreateSessionRequest):
-    agent = JournalAgent(
+    if draining:
+        if not PEERS:
+            raise HTTPException(status_code=503, detail="Draining", headers={"Retry-After": "1"})
+        peer = PEERS[len(moved) % len(PEERS)]
+        return JSONResponse({"detail": "Draining"}, status_code=307, headers={"Location": f"{peer.rstrip('/')}/session"})
+    return new_session(request)
+
+
+def new_session(request: CreateSessionRequest, pooled: bool = True) -> CreateSessionResponse:
+    """Create and register a session; `pooled=False` builds the agent instead of taking a pre-warmed one."""
+    build = agent_pool.claim if pooled else JournalAgent
+    agent = build(
         model=request.model or "sonnet",
         valence=request.valence,
         support_type=request.support_type,
@@ -125,8 +537,9 @@ def create_session(request: CreateSessionRequest):
     # Extract greeting
     greeting = strip_counselor_prefix(agent.messages[1]["content"])
 
+    agent.user_id = request.user_id
     session_id = uuid.uuid4().hex
-    sessions[session_id] = (agent, time.time())
+    register_session(session_id, agent, time.time())
 
     return CreateSessionResponse(
         session_id=session_id,
@@ -140,16 +553,11 @@ def create_session(request: CreateSessionRequest):
 def get_session_info(session_id: str):
     agent = get_session(session_id)
 
-    messages = []
-    for msg in agent._active_conversation.messages:
-        if msg["role"] == "system":
-            continue
-        content = strip_counselor_prefix(msg["content"]) if msg["role"] == "assistant" else msg["content"]
-        messages.append({"role": msg["role"], "content": content})
+    messages = agent._active_conversation.messages.view("public", public_message)
 
     return SessionResponse(
         session_id=session_id,
-        messages=messages,
+        messages=list(messages),
         phase=agent.phase,
         commands=agent.commands,
     )
@@ -157,30 +565,373 @@ def get_session_info(session_id: str):
 
 @app.post("/session/{session_id}/message", response_model=MessageResponse)
 def send_message(session_id: str, request: SendMessageRequest):
-    agent = get_session(session_id)
+    return converse(session_id, request.content)
+
 
-    agent.receive(request.content)
-    response_text = agent.reply()
+def converse(session_id: str, content: str) -> MessageResponse:
+    """One user turn and the agent's reply."""
+    with session_lock(session_id):
+        agent = get_session(session_id)
+        agent.check_quota(content)  # before the user turn is stored
 
-    return MessageResponse(
-        role="assistant",
-        content=strip_counselor_prefix(response_text),
+        agent.receive(content)
+        try:
+            response_text = agent.reply()
+        except Exception:
+            agent.unreceive()  # the client sends it again; don't leave it unanswered
+            raise
+
+        return MessageResponse(
+            role="assistant",
+            content=strip_counselor_prefix(response_text),
+            phase=agent.phase,
+            commands=agent.commands,
+            metadata=agent.last_metadata,
+        )
+
+
+@app.post("/session/{session_id}/message/stream")
+def send_message_stream(session_id: str, request: SendMessageRequest):
+    """Like /message, streamed as NDJSON; the turn (message and reply) is only kept if the stream completes."""
+    get_session(session_id).check_quota(request.content)  # 404 / 307 / 429 before the stream starts
+
+    def start(agent):
+        agent.check_quota(request.content)
+        agent.receive(request.content)
+        return agent.reply_stream()
+
+    return StreamingResponse(bound(locked_ndjson_stream(session_id, start, JournalAgent.unreceive)),
+                             media_type="application/x-ndjson")
+
+
+@app.post("/session/{session_id}/command", response_model=CommandResponse)
+def execute_command(session_id: str, request: CommandRequest):
+    with session_lock(session_id):
+        agent = get_session(session_id)
+        try:
+            result = agent.command(request.command, **request.args)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return CommandResponse(
+        content=strip_counselor_prefix(result),
         phase=agent.phase,
         commands=agent.commands,
         metadata=agent.last_metadata,
     )
 
 
-@app.post("/session/{session_id}/command", response_model=CommandResponse)
-def execute_command(session_id: str, request: CommandRequest):
+@app.post("/session/{session_id}/command/stream")
+def execute_command_stream(session_id: str, request: CommandRequest):
+    """Like /command, streamed as NDJSON; the command only takes effect if the stream completes."""
     agent = get_session(session_id)
+    agent.account.check()
     try:
-        result = agent.command(request.command, **request.args)
+        agent.command_stream(request.command, **request.args).close()  # validate before streaming
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    return CommandResponse(
-        content=strip_counselor_prefix(result),
-        phase=agent.phase,
-        commands=agent.commands,
-        metadata=agent.last_metadata,
+    return StreamingResponse(
+        bound(locked_ndjson_stream(session_id, lambda agent: agent.command_stream(request.command, **request.args))),
+        media_type="application/x-ndjson",
     )
+
+
+# --- Deferred one-shots (batch) ---
+
+
+def deliver_deferred(job) -> Optional[str]:
+    """Commit a finished batch job to its session (restoring it if parked) and notify the app.
+
+    Returns the job's final status.
+    """
+    status = None
+    if job.result is not None:
+        status = apply_deferred_result(DeferredResult(session_id=job.session_id, command=job.command,
+                                                      text=job.result["text"], digest=job.digest))
+    if BATCH_WEBHOOK:
+        notify_webhook(BATCH_WEBHOOK, {"type": "deferred", **job.public(), "finished": time.time(),
+                                       "status": status or ("done" if job.result else "failed")})
+    return status
+
+
+def apply_deferred_result(result: DeferredResult) -> str:
+    """Commit a deferred result wherever its session lives now.
+
+    Live here (or parked and adoptable): applied to the agent. Parked while this worker
+    drains: written into the parked envelope. Handed to a peer: forwarded to it. Returns
+    "applied" or "stale" (see JournalAgent.apply_deferred), the peer's answer, "undelivered"
+    when the session is out of reach (the result stays on the job), or "expired".
+    """
+    session_id = result.session_id
+    with session_lock(session_id):
+        if session_id in sessions or adopt_session(session_id):
+            agent, _ = sessions[session_id]
+            return "applied" if agent.apply_deferred(result.command, result.text, result.digest) else "stale"
+        parked = handoff_store is not None and SESSION_ID.fullmatch(session_id)
+        payload = handoff_store.claim(session_id) if parked else None
+        if payload is not None:
+            agent, last_access = import_session(payload)
+            applied = agent.apply_deferred(result.command, result.text, result.digest)
+            handoff_store.put(export_session(session_id, agent, last_access))
+            return "applied" if applied else "stale"
+        if session_id not in moved:
+            session_locks.pop(session_id, None)
+            return "expired"
+    peer = moved[session_id]
+    if peer and ADMIN_TOKEN:
+        try:
+            return post_to_peer(peer, "/admin/deferred/result", result.model_dump(), ADMIN_TOKEN)["status"]
+        except (HandoffError, KeyError) as e:
+            print(f"Forwarding deferred result for {session_id} failed: {e}")
+    return "undelivered"
+
+
+@app.post("/admin/deferred/result", dependencies=[Depends(require_admin)])
+def deferred_result_endpoint(result: DeferredResult):
+    """A deferred result another worker got back for a session that was handed to this one."""
+    if not SESSION_ID.fullmatch(result.session_id):
+        raise HTTPException(status_code=400, detail="Invalid session_id")
+    return {"status": apply_deferred_result(result)}
+
+
+def notify_webhook(url: str, payload: dict) -> None:
+    request = urllib.request.Request(url, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT) as response:
+            response.read()
+    except (urllib.error.URLError, OSError) as e:
+        print(f"Webhook {url} failed: {e}")
+
+
+@app.post("/session/{session_id}/deferred", status_code=202)
+def defer_command(session_id: str, request: DeferredRequest):
+    """Queue reframe/summarize for the next batch instead of running it now (cheaper, slower).
+
+    The result is committed to the session as if the command had run (unless the session
+    has moved past that phase) and POSTed to CAMI_BATCH_WEBHOOK; poll GET .../deferred otherwise.
+    """
+    with session_lock(session_id):
+        agent = get_session(session_id)
+        agent.account.check()
+        try:
+            call = agent.deferred_request(request.command)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        job = deferred.put(session_id, request.command, call["model"], call["messages"], call["digest"],
+                           agent.account, deliver_deferred)
+    return job.public()
+
+
+@app.get("/session/{session_id}/deferred")
+def deferred_jobs(session_id: str):
+    """This session's deferred jobs, oldest first."""
+    get_session(session_id)
+    return [job.public() for job in deferred.session_jobs(session_id)]
+
+
+# --- Bulk ingestion / load generation ---
+
+
+def bulk_error(e: Exception) -> dict:
+    """Per-item status and detail for an exception, as the single-item endpoint would answer."""
+    if isinstance(e, SessionMoved):
+        return {"status": 307 if e.peer else 503, "detail": "Session moved", "peer": e.peer}
+    if isinstance(e, HTTPException):
+        return {"status": e.status_code, "detail": e.detail}
+    if isinstance(e, QuotaExceeded):
+        return {"status": 429, "detail": str(e), "retry_after": e.retry_after}
+    if isinstance(e, ValueError):
+        return {"status": 400, "detail": str(e)}
+    return {"status": 500, "detail": f"{type(e).__name__}: {e}"}
+
+
+def bulk_ndjson(session_items: dict[str, list[tuple[int, str]]], concurrency: int):
+    """Run each session's messages in order, sessions concurrently; yield a line per item as it finishes.
+
+    LLM calls run at background priority so bulk work never holds up interactive users.
+    """
+    stop = threading.Event()
+    results: queue.Queue = queue.Queue()
+
+    def run_session(session_id: str, items: list[tuple[int, str]]) -> None:
+        for index, content in items:
+            if stop.is_set():
+                return
+            try:
+                result = {"status": 200, **converse(session_id, content).model_dump()}
+            except Exception as e:
+                result = bulk_error(e)
+            results.put({"index": index, "session_id": session_id, **result})
+
+    with lowered_priority("background"):
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk")
+        for session_id, items in session_items.items():
+            executor.submit(contextvars.copy_context().run, run_session, session_id, items)  # one context per task
+    try:
+        for _ in range(sum(len(items) for items in session_items.values())):
+            yield json.dumps(results.get(), ensure_ascii=False) + "\n"
+    finally:
+        stop.set()  # client went away: skip what hasn't started
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@app.post("/admin/sessions/bulk", dependencies=[Depends(require_admin)])
+def bulk_create_sessions(request: BulkSessionsRequest):
+    """Create many sessions; NDJSON line per item: {"index", "status", "session_id", "greeting", ...} or "detail".
+
+    Agents are built per item, leaving the pre-warmed pool to interactive users.
+    """
+    if draining:
+        raise HTTPException(status_code=503, detail="Draining", headers={"Retry-After": "1"})
+
+    def lines():
+        for index, item in enumerate(request.sessions):
+            try:
+                result = {"status": 200, **new_session(item, pooled=False).model_dump()}
+            except Exception as e:
+                result = bulk_error(e)
+            yield json.dumps({"index": index, **result}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/admin/messages/bulk", dependencies=[Depends(require_admin)])
+def bulk_send_messages(request: BulkMessagesRequest):
+    """Send many (session_id, content) messages; NDJSON line per item as each finishes.
+
+    Messages for the same session run in request order, sessions run concurrently.
+    Lines carry the item's "index" and "status" plus the /message response or "detail".
+    """
+    if draining:
+        raise HTTPException(status_code=503, detail="Draining", headers={"Retry-After": "1"})
+    session_items: dict[str, list[tuple[int, str]]] = {}
+    for index, item in enumerate(request.messages):
+        session_items.setdefault(item.session_id, []).append((index, item.content))
+    return StreamingResponse(bound(bulk_ndjson(session_items, request.concurrency)), media_type="application/x-ndjson")
+
+
+@app.get("/ready")
+def readiness():
+    """Readiness probe: 200 once warmup is done, 503 before that and while draining."""
+    if not ready.is_set() or draining:
+        return JSONResponse({"ready": False, "draining": draining}, status_code=503, headers={"Retry-After": "1"})
+    return {"ready": True, "warmup_seconds": warmup_seconds}
+
+
+@app.get("/metrics")
+def metrics():
+    """Aggregate server metrics: upstream LLM queue by priority class, agent pool, session log, token ledger,
+    deferred jobs, output token budgets with recent truncations, and token estimate calibration."""
+    return {
+        "sessions": len(sessions),
+        "llm_gate": LLM_GATE.stats(),
+        "agent_pool": agent_pool.stats(),
+        "session_log": {**session_log.stats, "recovery": session_log.recovery} if session_log else None,
+        "ledger": ledger.summary(),
+        "deferred": deferred.stats(),
+        "output_budgets": OUTPUT_BUDGETS.stats(),
+        "token_estimator": TOKEN_ESTIMATOR.stats(),
+    }
+
+
+@app.get("/session/{session_id}/usage")
+def session_usage(session_id: str):
+    """Tokens and estimated cost of this session, and what is left of today's quota."""
+    agent = get_session(session_id)
+    return ledger.usage(session_id, agent.user_id)
+
+
+@app.get("/admin/usage", dependencies=[Depends(require_admin)])
+def usage(user_id: Optional[str] = None, session_id: Optional[str] = None):
+    """Usage and cost for a user and/or session; without either, totals per model."""
+    if not (user_id or session_id):
+        return ledger.summary()
+    return ledger.usage(session_id, user_id)
+
+
+@app.get("/admin/metrics/sessions", dependencies=[Depends(require_admin)])
+def session_metrics(session_id: Optional[str] = None):
+    """Per-session upstream queue position and waits (admin only: keys are session ids)."""
+    return LLM_GATE.key_stats([session_id] if session_id else None)
+
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+def memory(top: int = 10, deep: bool = True):
+    """Session memory: message counts per phase, stored text and deep size, plus the `top` largest."""
+    return memory_report({sid: agent for sid, (agent, _) in list(sessions.items())}, top=top, deep=deep)
+
+
+@app.get("/admin/memory/{session_id}", dependencies=[Depends(require_admin)])
+def session_memory_endpoint(session_id: str):
+    """Memory of one live session; reading it neither adopts the session nor counts as activity."""
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    with session_lock(session_id):
+        entry = sessions.get(session_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+        return {"session_id": session_id, **session_memory(entry[0])}
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    """Recently profiled requests, newest first (see ProfileMiddleware)."""
+    return profiler.summaries()
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_profile(profile_id: str):
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found")
+    return {k: v for k, v in profile.items() if k != "folded"}
+
+
+@app.get("/admin/profiles/{profile_id}/folded", dependencies=[Depends(require_admin)])
+def get_profile_folded(profile_id: str):
+    """Folded stacks, for flamegraph.pl or speedscope."""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found")
+    return PlainTextResponse(profile["folded"])
+
+
+# --- Admin: session migration ---
+
+
+@app.get("/admin/session/{session_id}/export", dependencies=[Depends(require_admin)])
+def export_session_endpoint(session_id: str):
+    with session_lock(session_id):
+        agent = get_session(session_id)
+        return export_session(session_id, agent, sessions[session_id][1])
+
+
+@app.post("/admin/session/import", dependencies=[Depends(require_admin)])
+def import_session_endpoint(payload: dict):
+    if draining:
+        raise HTTPException(status_code=503, detail="Draining")
+    session_id = payload.get("session_id", "")
+    if not SESSION_ID.fullmatch(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session_id")
+    with session_lock(session_id):
+        if session_id in sessions:
+            raise HTTPException(status_code=409, detail=f"Session '{session_id}' already exists")
+        try:
+            agent, last_access = import_session(payload)
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid session export: {e}")
+        register_session(session_id, agent, last_access)
+        moved.pop(session_id, None)
+    return {"session_id": session_id, "phase": agent.phase}
+
+
+@app.post("/admin/drain", dependencies=[Depends(require_admin)])
+def drain(request: DrainRequest):
+    """Stop taking sessions and hand every live one to a peer (or the handoff store).
+
+    Requests for moved sessions get a 307 to their new peer (503 + Retry-After while
+    parked); new sessions are redirected to CAMI_PEERS.
+    """
+    global draining
+    draining = True
+    return {"draining": True, **drain_sessions(request.peers or PEERS)}
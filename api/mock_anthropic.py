@@ -0,0 +1,266 @@
+"""Local stand-in for the Anthropic Messages API — offline load and end-to-end tests.
+
+Speaks POST /v1/messages (plain JSON and `"stream": true` SSE) closely enough for
+langchain_anthropic / the anthropic SDK. Replies come from a configurable profile:
+canned responses matched on the request text, first-token latency, tokens/sec and
+error injection. Everything is seeded from the request body, so runs are repeatable.
+
+    cd api && uvicorn mock_anthropic:app --port 8090
+    python api/mock_anthropic.py --port 8090 --profile profile.json
+
+Then point the agents at it (any API key is accepted):
+
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8090 ANTHROPIC_API_KEY=mock python talk_to_pin.py --cbt
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Canned replies for the CBT → narrative → finalize flow, matched in order against the
+# request text (system prompt + messages). Match strings come from agents/journal_prompt.txt.
+DEFAULT_RESPONSES = [
+    {"match": "### Reframed Journal + Narrative Opening (JSON):",
+     "text": json.dumps({"reframed_journal": "我的CBT日記\n\n今天媽媽傳來一連串訊息，我感到生氣（8分），覺得自己怎麼做都不夠好，只想逃開。",
+                         "opening": "Counselor: 你能想到一個這種壓力本來想掌控你，但你沒有讓它得逞的時刻嗎？"},
+                        ensure_ascii=False)},
+    {"match": "### Updated Summary (JSON):",
+     "text": '{"emotion": "生氣", "intensity": "8", "thoughts": ["我怎麼做都不夠好"], "behaviours": ["想逃開"]}'},
+    {"match": "使用者已完成書寫並為日記選擇了標題",
+     "text": "Counselor: 這個標題很有意義，它捕捉了你在這段旅程中的轉變。現在這個情緒的強度是幾分呢（1-10分）？"},
+    {"match": "請以 「重塑日記」 作為標題開頭",
+     "text": "重塑日記\n\n我曾經被家人的訊息淹沒，但我開始看見自己也有劃下界線、照顧自己的力量。"},
+    {"match": "請以 「我的CBT日記」 作為標題開頭",
+     "text": "我的CBT日記\n\n今天媽媽傳來一連串訊息，我感到生氣（8分），覺得自己怎麼做都不夠好，只想逃開。"},
+    {"match": "運用敘事治療問句",
+     "text": "Counselor: 你能想到一個這種壓力本來想掌控你，但你沒有讓它得逞的時刻嗎？"},
+]
+DEFAULT_TEXT = "Counselor: 謝謝你願意分享。當時你心裡最強烈的感受是什麼呢？"
+
+ERROR_TYPES = {
+    400: "invalid_request_error",
+    429: "rate_limit_error",
+    500: "api_error",
+    529: "overloaded_error",
+}
+
+
+@dataclass
+class MockProfile:
+    """Behaviour of the mock server. All fields can be set from a JSON profile file."""
+
+    first_token_latency: float = 0.0  # seconds before the first byte / the whole response
+    latency_jitter: float = 0.0       # uniform ± seconds added to first_token_latency
+    tokens_per_second: float = 0.0    # output pacing; 0 means no pacing
+    chars_per_token: int = 2          # how reply text is chunked into "tokens"
+    error_rate: float = 0.0           # fraction of requests answered with error_status
+    error_status: int = 529
+    seed: int = 0
+    responses: list[dict] = field(default_factory=lambda: list(DEFAULT_RESPONSES))
+    default_text: str = DEFAULT_TEXT
+
+    @classmethod
+    def from_file(cls, path: str) -> "MockProfile":
+        with open(path, "r") as f:
+            return cls(**json.load(f))
+
+
+def request_text(body: dict) -> str:
+    """Flatten system prompt and message contents into one string for matching."""
+    parts = []
+    system = body.get("system") or ""
+    if isinstance(system, list):
+        system = "".join(block.get("text", "") for block in system)
+    parts.append(system)
+    for msg in body.get("messages", []):
+        content = msg.get("content", "")
+        if isinstance(content, list):
+            content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+
+class MockAnthropic:
+    """Turns a Messages API request body into a deterministic canned reply."""
+
+    def __init__(self, profile: MockProfile):
+        self.profile = profile
+        self.request_count = 0
+        self.error_count = 0
+
+    def rng(self, body: dict, attempt: str = "0") -> random.Random:
+        digest = hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode()).digest()
+        return random.Random(f"{self.profile.seed}:{digest.hex()}:{attempt}")
+
+    def reply_text(self, text: str) -> str:
+        for rule in self.profile.responses:
+            if rule["match"] in text:
+                return rule["text"]
+        return self.profile.default_text
+
+    def tokens(self, text: str) -> list[str]:
+        n = max(1, self.profile.chars_per_token)
+        return [text[i:i + n] for i in range(0, len(text), n)]
+
+    def latency(self, rng: random.Random) -> float:
+        p = self.profile
+        return max(0.0, p.first_token_latency + rng.uniform(-p.latency_jitter, p.latency_jitter))
+
+    def plan(self, body: dict, attempt: str = "0") -> dict:
+        """Decide error/latency/output for one request."""
+        self.request_count += 1
+        rng = self.rng(body, attempt)
+        if rng.random() < self.profile.error_rate:
+            self.error_count += 1
+            return {"error": self.profile.error_status, "latency": self.latency(rng)}
+
+        text = request_text(body)
+        tokens = self.tokens(self.reply_text(text))
+        max_tokens = body.get("max_tokens") or len(tokens)
+        stop_reason = "end_turn"
+        if len(tokens) > max_tokens:
+            tokens = tokens[:max_tokens]
+            stop_reason = "max_tokens"
+        return {
+            "error": None,
+            "latency": self.latency(rng),
+            "tokens": tokens,
+            "stop_reason": stop_reason,
+            "input_tokens": max(1, len(text) // max(1, self.profile.chars_per_token)),
+            "model": body.get("model", "mock"),
+        }
+
+    def token_delay(self) -> float:
+        tps = self.profile.tokens_per_second
+        return 1.0 / tps if tps > 0 else 0.0
+
+
+def error_body(status: int) -> dict:
+    return {"type": "error", "error": {"type": ERROR_TYPES.get(status, "api_error"),
+                                       "message": f"Injected mock error ({status})"}}
+
+
+def message_body(plan: dict, msg_id: str) -> dict:
+    return {
+        "id": msg_id,
+        "type": "message",
+        "role": "assistant",
+        "model": plan["model"],
+        "content": [{"type": "text", "text": "".join(plan["tokens"])}],
+        "stop_reason": plan["stop_reason"],
+        "stop_sequence": None,
+        "usage": {"input_tokens": plan["input_tokens"], "output_tokens": len(plan["tokens"])},
+    }
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_events(mock: MockAnthropic, plan: dict, msg_id: str):
+    start = message_body(plan, msg_id)
+    start["content"] = []
+    start["stop_reason"] = None
+    start["usage"]["output_tokens"] = 1
+    yield sse("message_start", {"type": "message_start", "message": start})
+    yield sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                      "content_block": {"type": "text", "text": ""}})
+    yield sse("ping", {"type": "ping"})
+    delay = mock.token_delay()
+    for token in plan["tokens"]:
+        if delay:
+            await asyncio.sleep(delay)
+        yield sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                          "delta": {"type": "text_delta", "text": token}})
+    yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+    yield sse("message_delta", {"type": "message_delta",
+                                "delta": {"stop_reason": plan["stop_reason"], "stop_sequence": None},
+                                "usage": {"input_tokens": plan["input_tokens"], "output_tokens": len(plan["tokens"])}})
+    yield sse("message_stop", {"type": "message_stop"})
+
+
+def create_app(profile: MockProfile | None = None) -> FastAPI:
+    mock = MockAnthropic(profile or MockProfile())
+    app = FastAPI(title="Mock Anthropic API")
+    app.state.mock = mock
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        plan = mock.plan(body, request.headers.get("x-stainless-retry-count", "0"))
+        if plan["latency"]:
+            await asyncio.sleep(plan["latency"])
+        if plan["error"]:
+            return JSONResponse(error_body(plan["error"]), status_code=plan["error"])
+
+        msg_id = f"msg_mock_{uuid.uuid4().hex[:24]}"
+        if body.get("stream"):
+            return StreamingResponse(stream_events(mock, plan, msg_id), media_type="text/event-stream")
+
+        delay = mock.token_delay()
+        if delay:
+            await asyncio.sleep(delay * len(plan["tokens"]))
+        return message_body(plan, msg_id)
+
+    @app.get("/mock/stats")
+    def stats():
+        return {"requests": mock.request_count, "errors": mock.error_count, "profile": asdict(mock.profile)}
+
+    return app
+
+
+def serve_in_thread(profile: MockProfile | None = None, host: str = "127.0.0.1", port: int = 0):
+    """Run the mock in a daemon thread. Returns (base_url, server); call server.should_exit = True to stop."""
+    import uvicorn
+
+    if not port:
+        with socket.socket() as s:
+            s.bind((host, 0))
+            port = s.getsockname()[1]
+    config = uvicorn.Config(create_app(profile), host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("mock Anthropic server did not start")
+        time.sleep(0.01)
+    return f"http://{host}:{port}", server
+
+
+_profile_path = os.getenv("MOCK_ANTHROPIC_PROFILE")
+app = create_app(MockProfile.from_file(_profile_path) if _profile_path else None)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the mock Anthropic Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--profile", help="JSON file with MockProfile fields")
+    parser.add_argument("--latency", type=float, help="First-token latency in seconds")
+    parser.add_argument("--tps", type=float, help="Output tokens per second")
+    parser.add_argument("--error-rate", type=float, help="Fraction of requests that fail")
+    args = parser.parse_args()
+
+    profile = MockProfile.from_file(args.profile) if args.profile else MockProfile()
+    if args.latency is not None:
+        profile.first_token_latency = args.latency
+    if args.tps is not None:
+        profile.tokens_per_second = args.tps
+    if args.error_rate is not None:
+        profile.error_rate = args.error_rate
+    uvicorn.run(create_app(profile), host=args.host, port=args.port)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""API throughput benchmark: N virtual users run the test_api.py journaling flow concurrently.
+
+Starts api/mock_anthropic.py and the API (uvicorn) as subprocesses, ramps users up,
+then reports requests/sec, p50/p95/p99 per endpoint and per command, error rate and
+server RSS. Results are written as JSON (with the git commit) so runs can be compared.
+
+    python benchmarks/bench_api.py --users 50 --ramp-up 10 --think-time 0.5
+    python benchmarks/bench_api.py --users 200 --llm-latency 1.0 --llm-tps 80
+    python benchmarks/bench_api.py --compare benchmarks/results/api-<older>.json
+    python benchmarks/bench_api.py --target http://127.0.0.1:8000 --server-pid 1234
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Same steps as run_api_session() in test_api.py
+SCRIPT = [
+    ("message", "Two days before Lunar New Year's Eve, Mom sent a barrage of messages, "
+                "starting with 'Are you coming home for New Year?' then quickly escalating to "
+                "'You never care about this family' and 'I've done so much for you and this is "
+                "how you repay me.' I didn't even have time to reply before the next message hit."),
+    ("message", "angry"),
+    ("message", "8"),
+    ("message", "want to run away"),
+    ("command", "reframe", {}),
+    ("command", "next", {}),
+    ("message", "i blocked her last time"),
+    ("message", "i understood that i was hurt"),
+    ("command", "summarize", {}),
+    ("command", "finalize", {"title": "Lunar New Year Reflections"}),
+    ("message", "2"),
+    ("message", "nothing bye"),
+    ("get",),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def rss_mb(pid: int) -> float | None:
+    """Resident set size of `pid` in MB (Linux /proc)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {proc.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def start_servers(args) -> tuple[str, list[subprocess.Popen], int]:
+    """Launch the mock LLM and the API; returns (api_url, processes, api_pid)."""
+    mock_port, api_port = free_port(), free_port()
+    mock_cmd = [sys.executable, os.path.join(ROOT, "api", "mock_anthropic.py"), "--port", str(mock_port),
+                "--latency", str(args.llm_latency), "--tps", str(args.llm_tps),
+                "--error-rate", str(args.llm_error_rate)]
+    if args.llm_profile:
+        mock_cmd += ["--profile", args.llm_profile]
+    mock = subprocess.Popen(mock_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    env = {k: v for k, v in os.environ.items() if not k.startswith("CAMI_CASSETTE")}
+    env.update(ANTHROPIC_BASE_URL=f"http://127.0.0.1:{mock_port}", ANTHROPIC_API_KEY="mock")
+    if args.llm_concurrency is not None:
+        env["CAMI_LLM_CONCURRENCY"] = str(args.llm_concurrency)
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", os.path.join(ROOT, "api"),
+         "--port", str(api_port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_ready(f"http://127.0.0.1:{mock_port}/mock/stats", mock)
+    api_url = f"http://127.0.0.1:{api_port}"
+    wait_ready(f"{api_url}/docs", api)
+    return api_url, [mock, api], api.pid
+
+
+class Recorder:
+    """Collects one sample per HTTP request."""
+
+    def __init__(self):
+        self.samples: list[dict] = []
+        self.rss: list[float] = []
+        self.metrics: dict | None = None
+
+    def add(self, endpoint: str, command: str | None, status: int, latency: float) -> None:
+        self.samples.append({"endpoint": endpoint, "command": command, "status": status, "latency": latency})
+
+
+async def timed(rec: Recorder, endpoint: str, command: str | None, request) -> httpx.Response | None:
+    start = time.perf_counter()
+    try:
+        r = await request
+        rec.add(endpoint, command, r.status_code, time.perf_counter() - start)
+        return r
+    except httpx.HTTPError:
+        rec.add(endpoint, command, 0, time.perf_counter() - start)
+        return None
+
+
+async def virtual_user(client: httpx.AsyncClient, rec: Recorder, delay: float, args, rng: random.Random):
+    await asyncio.sleep(delay)
+    for _ in range(args.sessions_per_user):
+        r = await timed(rec, "POST /session", None, client.post(
+            "/session", json={"valence": rng.uniform(-1, 1), "support_type": rng.uniform(-1, 1), "model": "sonnet"}))
+        if r is None or r.status_code != 200:
+            continue
+        session_id = r.json()["session_id"]
+        for step in SCRIPT:
+            if args.think_time:
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think_time)
+            if step[0] == "message":
+                r = await timed(rec, "POST /session/{id}/message", None, client.post(
+                    f"/session/{session_id}/message", json={"content": step[1]}))
+            elif step[0] == "command":
+                r = await timed(rec, "POST /session/{id}/command", step[1], client.post(
+                    f"/session/{session_id}/command", json={"command": step[1], "args": step[2]}))
+            else:
+                r = await timed(rec, "GET /session/{id}", None, client.get(f"/session/{session_id}"))
+            if r is None or r.status_code != 200:
+                break  # the rest of the flow depends on this step
+
+
+async def sample_rss(rec: Recorder, pid: int, stop: asyncio.Event):
+    while not stop.is_set():
+        value = rss_mb(pid)
+        if value is not None:
+            rec.rss.append(value)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(api_url: str, server_pid: int | None, args) -> tuple[Recorder, float]:
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=api_url, timeout=args.timeout, limits=limits) as client:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(rec, server_pid, stop)) if server_pid else None
+        start = time.perf_counter()
+        users = [
+            virtual_user(client, rec, args.ramp_up * i / max(1, args.users), args, random.Random(rng.random()))
+            for i in range(args.users)
+        ]
+        await asyncio.gather(*users)
+        duration = time.perf_counter() - start
+        r = await client.get("/metrics")
+        rec.metrics = r.json() if r.status_code == 200 else None
+        stop.set()
+        if sampler:
+            await sampler
+    return rec, duration
+
+
+def summarize_group(samples: list[dict], duration: float) -> dict:
+    latencies = [s["latency"] for s in samples]
+    errors = sum(1 for s in samples if s["status"] != 200)
+    return {
+        "count": len(samples),
+        "rps": round(len(samples) / duration, 2) if duration else 0.0,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def build_report(rec: Recorder, duration: float, args) -> dict:
+    by_endpoint: dict[str, list[dict]] = {}
+    by_command: dict[str, list[dict]] = {}
+    for s in rec.samples:
+        by_endpoint.setdefault(s["endpoint"], []).append(s)
+        if s["command"]:
+            by_command.setdefault(s["command"], []).append(s)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "duration_s": round(duration, 3),
+        "total": summarize_group(rec.samples, duration),
+        "endpoints": {k: summarize_group(v, duration) for k, v in sorted(by_endpoint.items())},
+        "commands": {k: summarize_group(v, duration) for k, v in sorted(by_command.items())},
+        "server_rss_mb": {
+            "start": round(rec.rss[0], 1) if rec.rss else None,
+            "peak": round(max(rec.rss), 1) if rec.rss else None,
+            "end": round(rec.rss[-1], 1) if rec.rss else None,
+        },
+        "llm_gate": (rec.metrics or {}).get("llm_gate"),
+    }
+
+
+def print_report(report: dict, baseline: dict | None = None) -> None:
+    def row(name, g, base=None):
+        delta = ""
+        if base:
+            delta = f"  (p95 {g['p95_ms'] - base['p95_ms']:+.1f}ms, rps {g['rps'] - base['rps']:+.2f})"
+        print(f"  {name:<32} n={g['count']:<6} rps={g['rps']:<8} err={g['error_rate']:<6} "
+              f"p50={g['p50_ms']:<8} p95={g['p95_ms']:<8} p99={g['p99_ms']}{delta}")
+
+    print(f"\n=== API benchmark @ {report['commit']} — {report['duration_s']}s ===")
+    row("TOTAL", report["total"], baseline and baseline["total"])
+    print("\n Per endpoint:")
+    for name, g in report["endpoints"].items():
+        row(name, g, baseline and baseline["endpoints"].get(name))
+    print("\n Per command:")
+    for name, g in report["commands"].items():
+        row(name, g, baseline and baseline["commands"].get(name))
+    rss = report["server_rss_mb"]
+    print(f"\n Server RSS (MB): start={rss['start']} peak={rss['peak']} end={rss['end']}")
+    gate = report.get("llm_gate")
+    if gate and gate["limit"] > 0:
+        print(f"\n Upstream queue wait by class (limit {gate['limit']}):")
+        for name, c in gate["classes"].items():
+            print(f"  {name:<12} calls={c['calls']:<6} p50={c['wait_p50'] * 1000:<8.1f} "
+                  f"p95={c['wait_p95'] * 1000:<8.1f} max={c['wait_max'] * 1000:.1f} ms")
+    if baseline:
+        print(f" Baseline: {baseline['commit']} @ {baseline['timestamp']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the journal API with concurrent virtual users")
+    parser.add_argument("--users", type=int, default=20, help="Number of virtual users")
+    parser.add_argument("--sessions-per-user", type=int, default=1, help="Scripted sessions each user runs")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Seconds over which users are started")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds between a user's requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Mock LLM first-token latency (s)")
+    parser.add_argument("--llm-tps", type=float, default=0.0, help="Mock LLM output tokens/sec (0 = instant)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Mock LLM injected error rate")
+    parser.add_argument("--llm-concurrency", type=int,
+                        help="Upstream LLM call limit for the API (CAMI_LLM_CONCURRENCY; 0 = unlimited)")
+    parser.add_argument("--llm-profile", help="MockProfile JSON file for the mock LLM")
+    parser.add_argument("--target", help="Benchmark an already running API instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="PID of --target for RSS sampling")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/results/api-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier results JSON to diff against")
+    args = parser.parse_args()
+
+    procs = []
+    try:
+        if args.target:
+            api_url, server_pid = args.target, args.server_pid
+        else:
+            api_url, procs, server_pid = start_servers(args)
+        rec, duration = asyncio.run(run_load(api_url, server_pid, args))
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+
+    report = build_report(rec, duration, args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"api-{report['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
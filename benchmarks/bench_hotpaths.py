@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""Microbenchmarks for the per-turn CPU work outside the LLM call.
+
+Times each hot path at realistic history lengths (10/100/1000 messages) and session
+counts (1k/100k), estimates how it scales (log-log slope; ~1.0 is linear) and flags
+super-linear growth. Every run is appended to benchmarks/results/hotpaths.jsonl and
+compared with the previous one, so regressions show up over time.
+
+    python benchmarks/bench_hotpaths.py
+    python benchmarks/bench_hotpaths.py --filter conversation --no-save
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from agents.agent_journal_pin import build_conversation_text, load_prompts  # noqa: E402
+from agents.journal_common import openai_2_langchain  # noqa: E402
+from agents.message_log import MessageLog  # noqa: E402
+import main as api  # noqa: E402
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "hotpaths.jsonl")
+HISTORY_SIZES = (10, 100, 1000)
+SESSION_COUNTS = (1_000, 100_000)
+SUPERLINEAR_SLOPE = 1.2
+
+
+def make_messages(n: int) -> list[dict]:
+    """A CBT-style history: system, greeting, then alternating user/assistant turns."""
+    messages = [
+        {"role": "system", "content": load_prompts()["SYSTEM_PROMPT"]},
+        {"role": "assistant", "content": "Counselor: 今天有什麼想法想整理一下嗎？"},
+    ]
+    for i in range(n - 2):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"我今天和媽媽吵架了，覺得很生氣，大概 {i % 10} 分。"})
+        else:
+            messages.append({"role": "assistant", "content": "Counselor: 謝謝你願意分享。當時你心裡最強烈的想法是什麼呢？"})
+    return messages
+
+
+def fill_sessions(n: int) -> None:
+    now = time.time()
+    api.sessions.clear()
+    api.sessions.update({f"{i:032x}": (None, now) for i in range(n)})
+
+
+def per_op(stmt, setup=None, repeat: int = 5) -> float:
+    """Best-of-`repeat` seconds per call."""
+    if setup:
+        setup()
+    timer = timeit.Timer(stmt)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def bench_history(fn, log: bool = False) -> dict:
+    """`log=True` runs on a MessageLog whose cached views are already warm (steady-state turn)."""
+    results = {}
+    for n in HISTORY_SIZES:
+        messages = MessageLog(make_messages(n)) if log else make_messages(n)
+        fn(messages)
+        results[n] = per_op(lambda: fn(messages))
+    return {"param": "messages", "results": results}
+
+
+def bench_sessions(fn) -> dict:
+    results = {}
+    for n in SESSION_COUNTS:
+        results[n] = per_op(fn, setup=lambda: fill_sessions(n))
+    api.sessions.clear()
+    return {"param": "sessions", "results": results}
+
+
+def session_info_view(messages) -> api.SessionResponse:
+    """The message walk and response model built by GET /session/{id}."""
+    if isinstance(messages, MessageLog):
+        view = list(messages.view("public", api.public_message))
+    else:
+        view = [item for item in (api.public_message(m["role"], m["content"]) for m in messages) if item]
+    return api.SessionResponse(session_id="0" * 32, messages=view, phase="cbt", commands=["reframe", "next"])
+
+
+def single(fn) -> dict:
+    return {"param": None, "results": {1: per_op(fn)}}
+
+
+def benchmarks() -> list[tuple[str, callable]]:
+    prompts = load_prompts()
+    reframe = prompts["REFRAME_PROMPT"]
+    some_session = f"{0:032x}"
+    return [
+        ("openai_2_langchain", lambda: bench_history(openai_2_langchain)),
+        ("build_conversation_text", lambda: bench_history(build_conversation_text)),
+        ("reframe_prompt_format", lambda: bench_history(lambda m: reframe.format(
+            init_journal=m[2]["content"] if len(m) > 2 else "", conversation=build_conversation_text(m)))),
+        ("session_info_view", lambda: bench_history(session_info_view)),
+        ("openai_2_langchain[log]", lambda: bench_history(openai_2_langchain, log=True)),
+        ("build_conversation_text[log]", lambda: bench_history(build_conversation_text, log=True)),
+        ("session_info_view[log]", lambda: bench_history(session_info_view, log=True)),
+        ("load_prompts", lambda: single(load_prompts)),
+        ("strip_counselor_prefix", lambda: single(
+            lambda: api.strip_counselor_prefix("Counselor: 今天有什麼想法想整理一下嗎？"))),
+        ("message_response_model", lambda: single(lambda: api.MessageResponse(
+            role="assistant", content="今天有什麼想法想整理一下嗎？", phase="cbt", commands=["reframe", "next"],
+            metadata={"input_tokens": 100, "output_tokens": 20, "elapsed_time": 1.0, "model": "sonnet"}))),
+        ("cleanup_sessions", lambda: bench_sessions(api.cleanup_sessions)),
+        ("get_session", lambda: bench_sessions(lambda: api.get_session(some_session))),
+    ]
+
+
+def slope(results: dict) -> float | None:
+    """Log-log growth exponent between the smallest and largest size."""
+    if len(results) < 2:
+        return None
+    lo, hi = min(results), max(results)
+    if results[lo] <= 0 or results[hi] <= 0:
+        return None
+    return math.log(results[hi] / results[lo]) / math.log(hi / lo)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_previous() -> dict | None:
+    if not os.path.exists(HISTORY_FILE):
+        return None
+    with open(HISTORY_FILE) as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for agent/API hot paths")
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--no-save", action="store_true", help="Don't append to the history file")
+    args = parser.parse_args()
+
+    previous = load_previous()
+    prev_by_name = {b["name"]: b for b in previous["benchmarks"]} if previous else {}
+    run = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "benchmarks": []}
+
+    print(f"{'benchmark':<30} {'size':>8} {'per call':>12} {'vs prev':>9}  growth")
+    for name, run_benchmark in benchmarks():
+        if args.filter and args.filter not in name:
+            continue
+        result = {"name": name, **run_benchmark()}
+        result["slope"] = slope(result["results"])
+        run["benchmarks"].append(result)
+        prev = prev_by_name.get(result["name"], {}).get("results", {})
+        for i, (size, seconds) in enumerate(result["results"].items()):
+            before = prev.get(str(size))
+            change = f"{(seconds / before - 1) * 100:+.0f}%" if before else ""
+            growth = ""
+            if i == len(result["results"]) - 1 and result["slope"] is not None:
+                flag = "  SUPER-LINEAR" if result["slope"] > SUPERLINEAR_SLOPE else ""
+                growth = f"n^{result['slope']:.2f}{flag}"
+            label = f"{size}" if result["param"] else "-"
+            print(f"{result['name'] if i == 0 else '':<30} {label:>8} {seconds * 1e6:>10.2f}us {change:>9}  {growth}")
+
+    if previous:
+        print(f"\nCompared with {previous['commit']} @ {previous['timestamp']}")
+    if not args.no_save:
+        os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
+        with open(HISTORY_FILE, "a") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"Appended to {HISTORY_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Per-session memory of JournalAgent at each phase of the test_api.py flow.
+
+Builds N agents, drives them through the scripted conversation with canned LLM
+replies (the mock server's, no network) and measures the tracemalloc growth per
+session once they reach cbt / narrative / finalize.
+
+    python benchmarks/bench_memory.py --sessions 2000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ANTHROPIC_API_KEY", "mock")
+
+from agents.agent_journal_pin import JournalAgent, LLMService  # noqa: E402
+from agents.journal_common import openai_2_langchain  # noqa: E402
+from api.mock_anthropic import MockAnthropic, MockProfile  # noqa: E402
+
+MOCK = MockAnthropic(MockProfile())
+
+CBT_TURNS = ["Two days before Lunar New Year's Eve, Mom sent a barrage of messages, starting with "
+             "'Are you coming home for New Year?' then quickly escalating to 'You never care about "
+             "this family'.", "angry", "8", "want to run away"]
+NARRATIVE_TURNS = ["i blocked her last time", "i understood that i was hurt"]
+FINALIZE_TURNS = ["2", "nothing bye"]
+
+
+def canned_call(self, messages: list[dict], max_tokens: int) -> dict:
+    openai_2_langchain(messages)  # what the real call builds per turn
+    text = "\n".join(str(msg["content"]) for msg in messages)
+    return {"response": MOCK.reply_text(text), "usage": {"input_tokens": 0, "output_tokens": 0}}
+
+
+def talk(agent: JournalAgent, turns: list[str]) -> None:
+    for turn in turns:
+        agent.receive(turn)
+        agent.reply()
+
+
+def build(phase: str, i: int) -> JournalAgent:
+    agent = JournalAgent(model="sonnet", valence=(i % 20) / 10 - 1, support_type=(i % 7) / 3.5 - 1)
+    talk(agent, CBT_TURNS)
+    if phase in ("narrative", "finalize"):
+        agent.command("next")
+        talk(agent, NARRATIVE_TURNS)
+    if phase == "finalize":
+        agent.command("summarize")
+        agent.command("finalize", title="Lunar New Year Reflections")
+        talk(agent, FINALIZE_TURNS)
+    return agent
+
+
+def measure(phase: str, n: int) -> float:
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    agents = [build(phase, i) for i in range(n)]
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del agents
+    return total / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-session JournalAgent memory")
+    parser.add_argument("--sessions", type=int, default=1000)
+    args = parser.parse_args()
+
+    LLMService._call = canned_call
+    build("finalize", 0)  # warm caches so they are not attributed to sessions
+    tracemalloc.start()
+    print(f"{'phase':<10} {'bytes/session':>14}")
+    for phase in ("cbt", "narrative", "finalize"):
+        print(f"{phase:<10} {measure(phase, args.sessions):>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
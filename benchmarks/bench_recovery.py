@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Crash recovery from the per-session event log (agents/session_log.py).
+
+Drives N sessions through the test_api.py flow with canned LLM replies, stopping each
+at a different phase. It then abandons the log without closing it (as a crash would)
+and times SessionLog.recover() on a fresh instance. Recovered states are checked
+against the originals. Also reports the per-event append cost with batched fsync vs
+fsync-per-event.
+
+    python benchmarks/bench_recovery.py --sessions 1000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ANTHROPIC_API_KEY", "mock")
+
+from agents.agent_journal_pin import JournalAgent, LLMService  # noqa: E402
+from agents.session_log import SessionLog  # noqa: E402
+from bench_memory import CBT_TURNS, FINALIZE_TURNS, NARRATIVE_TURNS, canned_call, talk  # noqa: E402
+
+
+def drive(agent: JournalAgent, i: int) -> None:
+    talk(agent, CBT_TURNS[:1 + i % len(CBT_TURNS)])
+    if i % 3 == 0:
+        return
+    agent.command("next")
+    talk(agent, NARRATIVE_TURNS)
+    if i % 3 == 1:
+        return
+    agent.command("summarize")
+    agent.command("finalize", title="Lunar New Year Reflections")
+    talk(agent, FINALIZE_TURNS)
+
+
+def run(n: int, fsync_interval: float) -> dict:
+    directory = tempfile.mkdtemp(prefix="cami-sessions-")
+    try:
+        log = SessionLog(directory, fsync_interval=fsync_interval)
+        agents = {}
+        start = time.perf_counter()
+        for i in range(n):
+            agent = JournalAgent(model="sonnet", valence=(i % 20) / 10 - 1, support_type=(i % 7) / 3.5 - 1)
+            log.attach(f"{i:032x}", agent)
+            drive(agent, i)
+            agents[f"{i:032x}"] = agent
+        log.flush()
+        drive_seconds = time.perf_counter() - start
+        events = log.stats["events"]
+
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+        fresh = SessionLog(directory, fsync_interval=0)
+        recovered = fresh.recover()
+        mismatched = sum(recovered[sid][0].to_state() != agent.to_state() for sid, agent in agents.items())
+        return {"events": events, "fsyncs": log.stats["fsyncs"], "drive_seconds": drive_seconds,
+                "bytes": size, "mismatched": mismatched, "recovery": fresh.recovery}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure event-log recovery time")
+    parser.add_argument("--sessions", type=int, default=1000)
+    args = parser.parse_args()
+
+    LLMService._call = canned_call
+    for label, interval in (("batched (50ms)", 0.05), ("per-event", 0.0)):
+        r = run(args.sessions, interval)
+        rec = r["recovery"]
+        print(f"{label:<15} {r['events']:>7} events  {r['fsyncs']:>7} fsyncs  "
+              f"{r['drive_seconds'] / max(1, r['events']) * 1e6:>8.1f}us/event (incl. agent work)  "
+              f"log {r['bytes'] / 1e6:.1f} MB")
+        print(f"{'':<15} recovered {rec['sessions']} sessions ({rec['events']} events replayed) in "
+              f"{rec['seconds']:.3f}s = {rec['seconds'] / max(1, rec['sessions']) * 1e3:.2f} ms/session, "
+              f"mismatched {r['mismatched']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Simulated contention on the upstream LLM gate (agents/scheduler.py), no network.
+
+Fairness: one chatty session keeps --chatty calls in flight, while --quiet sessions
+send one call at a time. It compares calls served per session with fair queuing and
+with plain FIFO (no key).
+
+Priority: interactive calls compete with a stream of one-shot calls. It reports each
+class's wait with the priority gate and with FIFO ordering (aging ~0).
+
+    python benchmarks/bench_scheduler.py --limit 2 --seconds 3
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from agents.scheduler import LLMGate  # noqa: E402
+
+
+def run_clients(gate: LLMGate, clients: list[tuple[str, str, int, float]], seconds: float) -> dict[str, int]:
+    """clients: (key, priority, calls in flight, call duration). Returns calls served per key."""
+    served = {key: 0 for key, *_ in clients}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def worker(key, priority, duration):
+        while time.monotonic() < stop:
+            with gate.slot(priority, key, 1000):
+                time.sleep(duration)
+            with lock:
+                served[key] += 1
+
+    threads = [threading.Thread(target=worker, args=(key, priority, duration))
+               for key, priority, in_flight, duration in clients for _ in range(in_flight)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return served
+
+
+class _Unkeyed(LLMGate):
+    def slot(self, priority="interactive", key=None, cost=1.0):
+        return super().slot(priority, None, cost)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fairness and priority of the upstream LLM gate")
+    parser.add_argument("--limit", type=int, default=2, help="Concurrent upstream calls")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--chatty", type=int, default=8, help="Calls the chatty session keeps in flight")
+    parser.add_argument("--quiet", type=int, default=2, help="Sessions sending one call at a time")
+    args = parser.parse_args()
+
+    clients = [("chatty", "interactive", args.chatty, 0.01)]
+    clients += [(f"quiet-{i}", "interactive", 1, 0.01) for i in range(args.quiet)]
+    print(f"Fairness (limit {args.limit}, {args.seconds}s): calls served per session")
+    for label, gate in (("fair", LLMGate(args.limit, aging=0)), ("fifo", _Unkeyed(args.limit, aging=0))):
+        served = run_clients(gate, clients, args.seconds)
+        print(f"  {label:<5} " + "  ".join(f"{k}={v}" for k, v in served.items()))
+
+    mix = [("user", "interactive", 6, 0.02), ("synthesis", "one_shot", 6, 0.06)]
+    print(f"\nPriority (limit {args.limit}): wait p50/p95 by class")
+    for label, aging in (("priority", 2.0), ("fifo", 1e-6)):
+        gate = _Unkeyed(args.limit, aging=aging)
+        run_clients(gate, mix, args.seconds)
+        classes = gate.stats()["classes"]
+        print(f"  {label:<9} " + "  ".join(
+            f"{name}={c['wait_p50'] * 1000:.0f}/{c['wait_p95'] * 1000:.0f}ms"
+            for name, c in classes.items() if c["calls"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Cold start of the API process: import time by package, and time to listening / ready.
+
+Import: runs `python -X importtime -c "import main"` in api/. It reports the wall time
+and each top-level package's share, and says whether the LLM libraries were imported.
+
+Boot: starts uvicorn and polls until the socket answers (/docs) and until /ready flips
+(LLM libraries imported, clients built, agent pool filled). No LLM calls are made; the
+base URL points at a closed local port.
+
+    python benchmarks/bench_startup.py --runs 3
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+API_DIR = os.path.join(ROOT, "api")
+LLM_LIBS = ("langchain_anthropic", "langchain_core", "anthropic")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def clean_env() -> dict:
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("CAMI_", "ANTHROPIC_"))}
+    env.update(ANTHROPIC_API_KEY="mock", ANTHROPIC_BASE_URL=f"http://127.0.0.1:{free_port()}")
+    return env
+
+
+def import_profile() -> tuple[float, Counter, set[str]]:
+    """(wall seconds, self microseconds per top-level package, LLM libraries imported)."""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=API_DIR, env=clean_env(),
+                         capture_output=True, text=True, check=True)
+    packages: Counter = Counter()
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us)
+    return float(out.stdout.strip().splitlines()[-1]), packages, {lib for lib in LLM_LIBS if lib in packages}
+
+
+def boot(timeout: float = 60) -> tuple[float, float]:
+    """Seconds from process start until the server answers, and until /ready is 200."""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", API_DIR,
+                             "--port", str(port), "--log-level", "warning"],
+                            env=clean_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listening = None
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                status = httpx.get(f"{url}/ready", timeout=1).status_code
+                listening = listening or time.perf_counter() - start
+                if status == 200:
+                    return listening, time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError("API did not become ready")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API import time and boot-to-ready time")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=12, help="Packages shown in the import breakdown")
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    wall = statistics.median(p[0] for p in profiles)
+    packages, llm_libs = profiles[-1][1], profiles[-1][2]
+    total = sum(packages.values())
+    print(f"import main: {wall * 1000:.0f} ms wall (median of {args.runs}); "
+          f"LLM libraries at import: {', '.join(sorted(llm_libs)) or 'none'}")
+    for name, us in packages.most_common(args.top):
+        print(f"  {name:<24} {us / 1000:8.1f} ms  {us / total:6.1%}")
+
+    boots = [boot() for _ in range(args.runs)]
+    print(f"\nboot: listening after {statistics.median(b[0] for b in boots) * 1000:.0f} ms, "
+          f"ready after {statistics.median(b[1] for b in boots) * 1000:.0f} ms (median of {args.runs})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Break down the slowest requests in a CAMI_TRACE_FILE (agents/tracing.py).
+
+Each trace is printed as a span tree with durations, queue waits, tokens and retries,
+plus where the request's time went that no child span accounts for (self time).
+
+    python benchmarks/trace_report.py traces.jsonl --slowest 5
+    python benchmarks/trace_report.py traces.jsonl --session 3f2a...
+"""
+
+import argparse
+import json
+from collections import defaultdict
+
+SHOWN_ATTRS = ("route", "command", "phase", "phase_after", "model", "priority", "kind", "status", "queue_wait",
+               "first_chunk", "input_tokens", "output_tokens", "max_tokens", "truncated", "retries", "event", "error",
+               "cancelled")
+
+
+def load(path: str) -> dict[str, list[dict]]:
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a torn last line
+            traces[record["trace_id"]].append(record)
+    return traces
+
+
+def print_tree(spans: list[dict]) -> None:
+    children = defaultdict(list)
+    for s in spans:
+        children[s["parent_id"]].append(s)
+
+    def show(s: dict, depth: int) -> None:
+        kids = sorted(children[s["span_id"]], key=lambda c: c["start"])
+        own = s["duration"] - sum(c["duration"] for c in kids)
+        attrs = " ".join(f"{k}={s['attrs'][k]}" for k in SHOWN_ATTRS if s["attrs"].get(k) is not None)
+        print(f"  {'  ' * depth}{s['name']:<{28 - 2 * depth}} {s['duration'] * 1000:9.1f} ms"
+              f"  (self {own * 1000:.1f})  {attrs}")
+        for c in kids:
+            show(c, depth + 1)
+
+    ids = {s["span_id"] for s in spans}
+    for root in sorted((s for s in spans if s["parent_id"] not in ids), key=lambda s: s["start"]):
+        show(root, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slowest traced requests as span trees")
+    parser.add_argument("path")
+    parser.add_argument("--slowest", type=int, default=5)
+    parser.add_argument("--session", help="Only traces touching this session id")
+    args = parser.parse_args()
+
+    traces = load(args.path)
+    if args.session:
+        traces = {t: spans for t, spans in traces.items()
+                  if any(s["attrs"].get("session_id") == args.session for s in spans)}
+    ranked = sorted(traces.values(), key=lambda spans: max(s["duration"] for s in spans), reverse=True)
+    print(f"{len(traces)} traces")
+    for spans in ranked[:args.slowest]:
+        print()
+        print_tree(spans)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import backoff
 import openai
 from openai import OpenAI
+from agents.cassette import record_openai
 import numpy as np
 import os
 import torch
@@ -12,7 +13,8 @@ from .client_context import action2prompt, state2prompt, topic2description, topi
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+# CAMI_CASSETTE / CAMI_CASSETTE_MODE record or replay every chat completion
+openai_client = record_openai(OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL))
 
 
 @backoff.on_exception(
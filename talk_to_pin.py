@@ -7,7 +7,7 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
-from agents.agent_journal_pin import JournalAgent
+from agents.agent_journal_pin import FUSED_NEXT, JournalAgent, ROLLING_SUMMARY
 from agents.journal_common import MODELS
 
 ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), "archived")
@@ -28,6 +28,15 @@ def print_metadata(agent, show_metadata):
         print(f"\n  [{m['model']}] phase: {agent.phase} | in: {m['input_tokens']} | out: {m['output_tokens']} | time: {m['elapsed_time']:.2f}s")
 
 
+def print_stream(stream):
+    """Print chunks as they arrive; returns the final text."""
+    for item in stream:
+        if isinstance(item, dict):
+            print()
+            return item["content"]
+        print(item, end="", flush=True)
+
+
 def get_input(prompt="\nYou: "):
     """Get user input, return None on quit commands."""
     user_input = input(prompt).strip()
@@ -56,21 +65,19 @@ def run_session(agent, show_metadata):
             if agent.phase == "cbt":
                 if cmd == "reframe": # hardcoded user input
                     print("\n--- Reframed Journal Entry ---\n")
-                    reframed = agent.reframe()
-                    print(reframed)
+                    print_stream(agent.command_stream("reframe"))
                     print_metadata(agent, show_metadata)
                     continue
 
                 if cmd == "next": # hardcoded user input
                     if not agent.reframed_journal:
                         print("\n--- Reframing first... ---\n")
-                        reframed = agent.reframe()
-                        print(reframed)
+                        print_stream(agent.command_stream("reframe"))
                         print_metadata(agent, show_metadata)
                     save_to_archive(agent.reframed_journal, "reframe")
                     print("\n--- Narrative Therapy Session ---\n")
-                    response = agent.start_narrative()
-                    print(f"\n{response}")
+                    print()
+                    print_stream(agent.command_stream("next"))
                     print_metadata(agent, show_metadata)
                     continue
 
@@ -78,8 +85,7 @@ def run_session(agent, show_metadata):
             elif agent.phase == "narrative":
                 if cmd == "summarize": # hardcoded user input
                     print("\n--- Reflection Summary ---\n")
-                    summary = agent.summarize()
-                    print(summary)
+                    print_stream(agent.command_stream("summarize"))
                     print_metadata(agent, show_metadata)
 
                     title = get_input("\nTitle: ")
@@ -88,8 +94,8 @@ def run_session(agent, show_metadata):
 
                     save_to_archive(agent.final_summary, "summarize")
                     print("\n--- Finalizing Journal ---\n")
-                    response = agent.finalize(title)
-                    print(f"\n{response}")
+                    print()
+                    print_stream(agent.command_stream("finalize", title=title))
                     print_metadata(agent, show_metadata)
                     continue
 
@@ -101,8 +107,8 @@ def run_session(agent, show_metadata):
 
             # --- Normal conversation (all phases) ---
             agent.receive(user_input)
-            response = agent.reply()
-            print(f"\n{response}")
+            print()
+            print_stream(agent.reply_stream())
             print_metadata(agent, show_metadata)
 
         except KeyboardInterrupt:
@@ -125,6 +131,10 @@ def main():
                         help="Emotion valence: -1 (bad) to 1 (good), default 0.0")
     parser.add_argument("--support-type", type=float, default=0.0,
                         help="Support type: -1 (compassion) to 1 (advice), default 0.0")
+    parser.add_argument("--rolling-summary", action="store_true",
+                        help="Keep a running CBT summary in the background so reframe sends less context")
+    parser.add_argument("--fused-next", action="store_true",
+                        help="Reframe and open the narrative session in a single LLM call on 'next'")
     parser.add_argument("--origin_story", type=str, default="story/example.txt",
                         help="Path to story file (default: story/example.txt)")
     args = parser.parse_args()
@@ -133,7 +143,9 @@ def main():
         print("Please specify --cbt, --narrative, or --finalize")
         return
 
-    agent = JournalAgent(model=args.model, valence=args.valence, support_type=args.support_type)
+    agent = JournalAgent(model=args.model, valence=args.valence, support_type=args.support_type,
+                         rolling_summary=args.rolling_summary or ROLLING_SUMMARY,
+                         fused_next=args.fused_next or FUSED_NEXT)
     print(f"Using model: {MODELS[args.model]}")
 
     if args.finalize:
@@ -158,8 +170,9 @@ def main():
             reframed_journal = f.read().strip()
         print(f"Loaded story from: {args.origin_story}")
         print("\n--- Narrative Therapy Session ---\n")
-        response = agent.start_narrative(reframed_journal=reframed_journal)
-        print(f"\n{response}")
+        agent.reframed_journal = reframed_journal
+        print()
+        print_stream(agent.command_stream("next"))
         print_metadata(agent, args.show_metadata)
 
     else:
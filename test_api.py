@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 """End-to-end API test: exercises the full CBT → narrative → finalize flow through HTTP endpoints.
 
-Requires ANTHROPIC_API_KEY. Takes ~30-60s with sonnet.
+With ANTHROPIC_API_KEY set it hits the real API (~30-60s with sonnet). Without it (or with
+CAMI_MOCK_LLM=1) it runs offline against api/mock_anthropic.py in a background thread.
 
     source .env && python test_api.py
     pytest test_api.py -s
+    CAMI_MOCK_LLM=1 pytest test_api.py
 """
 
+import json
 import os
 import sys
 
@@ -16,6 +19,13 @@ load_dotenv()
 # Ensure project root is on sys.path (same as api/main.py does)
 sys.path.insert(0, os.path.dirname(__file__))
 
+# Must happen before importing api.main, which loads .env (it never overrides what is set here)
+MOCK_LLM = bool(os.getenv("CAMI_MOCK_LLM") or not os.getenv("ANTHROPIC_API_KEY"))
+if MOCK_LLM:
+    from api.mock_anthropic import serve_in_thread
+    os.environ["ANTHROPIC_BASE_URL"], _mock_server = serve_in_thread()
+    os.environ.setdefault("ANTHROPIC_API_KEY", "mock")
+
 from fastapi.testclient import TestClient
 from api.main import app
 
@@ -135,5 +145,596 @@ def test_api_full_session():
     run_api_session()
 
 
+def stream_lines(path: str, body: dict) -> list[dict]:
+    r = client.post(path, json=body)
+    assert r.status_code == 200, f"stream failed ({r.status_code}): {r.text}"
+    return [json.loads(line) for line in r.text.splitlines() if line]
+
+
+def test_api_streaming():
+    """Streamed chunks add up to the final content, and the reply/phase change is committed."""
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+
+    lines = stream_lines(f"/session/{session_id}/message/stream", {"content": "我今天和媽媽吵架了，很生氣。"})
+    *chunks, done = lines
+    assert done["type"] == "done" and chunks
+    assert "".join(c["text"] for c in chunks) == done["content"]
+    assert len(client.get(f"/session/{session_id}").json()["messages"]) == 3
+
+    done = stream_lines(f"/session/{session_id}/command/stream", {"command": "next"})[-1]
+    assert done["phase"] == "narrative", f"expected narrative, got {done['phase']}"
+    assert client.post(f"/session/{session_id}/command/stream", json={"command": "next"}).status_code == 400
+
+
+def test_stream_error_mid_reply(monkeypatch):
+    """A reply that fails after streaming started ends with an error line and takes back the user turn."""
+    import api.main
+
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+
+    def failing(messages, priority, kind=None):
+        yield "Counselor: 我"
+        raise RuntimeError("upstream connection reset")
+
+    monkeypatch.setattr(api.main.sessions[session_id][0].llm, "stream", failing)
+    lines = stream_lines(f"/session/{session_id}/message/stream", {"content": "我今天和媽媽吵架了，很生氣。"})
+    assert lines[0] == {"type": "chunk", "text": "我"}
+    assert lines[-1]["type"] == "error" and lines[-1]["status"] == 500
+    monkeypatch.undo()
+
+    send_message(session_id, "我今天和媽媽吵架了，很生氣。")
+    roles = [m["role"] for m in client.get(f"/session/{session_id}").json()["messages"]]
+    assert roles == ["assistant", "user", "assistant"]
+
+
+def test_fused_next_matches_two_step():
+    """The single-call `next` leaves the agent in the same state as reframe + start_narrative."""
+    if not MOCK_LLM:
+        import pytest
+        pytest.skip("needs the deterministic mock LLM")
+    from agents.agent_journal_pin import JournalAgent
+
+    states = []
+    for fused in (False, True):
+        agent = JournalAgent(model="sonnet", fused_next=fused)
+        for text in ("我今天和媽媽吵架了，很生氣。", "8"):
+            agent.receive(text)
+            agent.reply()
+        agent.command("next")
+        state = agent.to_state()
+        assert state.pop("fused_next") is fused
+        states.append(state)
+    assert states[0] == states[1]
+    assert states[1]["phase"] == "narrative"
+
+
+def test_next_keeps_explicit_reframed_journal():
+    """`next` with a reframed_journal starts the narrative from it instead of reframing the transcript,
+    with or without the fused single-call `next`."""
+    from agents.agent_journal_pin import JournalAgent
+
+    for fused in (False, True):
+        agent = JournalAgent(model="sonnet", fused_next=fused)
+        for text in ("我今天和媽媽吵架了，很生氣。", "8"):
+            agent.receive(text)
+            agent.reply()
+        events = []
+        agent.on_event = lambda kind, data: events.append(kind)
+        agent.command("next", reframed_journal="我和媽媽的一次爭吵。")
+        assert agent.phase == "narrative" and agent.reframed_journal == "我和媽媽的一次爭吵。"
+        assert events == ["phase"]
+
+
+def test_cassette_key_renders_prompts():
+    """Cassette keys tell apart narrative requests whose system prompts differ only in their params."""
+    from agents.agent_journal_pin import JournalAgent
+    from agents.cassette import request_key
+    from agents.message_log import MessageLog
+
+    agent = JournalAgent(model="sonnet")
+    keys = {request_key(agent.llm._cassette_request(MessageLog([
+        {"role": "system", "content": agent._system_prompt("narrative", reframed_journal=journal)},
+        {"role": "user", "content": "讓我們更深入地探索這個故事。"}]))) for journal in ("日記一", "日記二")}
+    assert len(keys) == 2
+
+
+def test_cassette_record_replay(tmp_path):
+    """Calls recorded against the mock replay identically with the server stopped; new requests miss."""
+    import pytest
+    import socket
+    import time
+    from urllib.parse import urlsplit
+    from api.mock_anthropic import serve_in_thread
+    from agents.agent_journal_pin import LLMService
+    from agents.cassette import Cassette, CassetteMiss
+    from agents.journal_common import create_llm
+
+    path = str(tmp_path / "calls.jsonl.gz")
+    first = [{"role": "system", "content": "你是一位朋友。"}, {"role": "user", "content": "我今天很生氣。"}]
+    second = [*first, {"role": "assistant", "content": "發生了什麼事？"}, {"role": "user", "content": "8"}]
+    base_url, server = serve_in_thread()
+    llm = LLMService(create_llm("sonnet", base_url), "sonnet", Cassette(path, "record"))
+    recorded = [llm.invoke(first), "".join(llm.stream(second))]
+    llm.cassette.save()
+    server.should_exit = True
+    address = urlsplit(base_url)
+    while True:  # until the port refuses connections
+        try:
+            socket.create_connection((address.hostname, address.port), timeout=1).close()
+        except OSError:
+            break
+        time.sleep(0.01)
+
+    llm = LLMService(create_llm("sonnet", base_url), "sonnet", Cassette(path, "replay"))
+    assert [llm.invoke(first), "".join(llm.stream(second))] == recorded
+    assert llm.last_metadata["input_tokens"] > 0
+    with pytest.raises(CassetteMiss):
+        llm.invoke([*second, {"role": "assistant", "content": "嗯。"}, {"role": "user", "content": "沒有錄到"}])
+
+
+def test_message_log_views_and_transcript():
+    """Views convert each message once; the transcript and its digest follow appends and pops."""
+    from agents.journal_common import openai_2_langchain
+    from agents.message_log import MessageLog, Transcript
+
+    log = MessageLog([{"role": "system", "content": "系統"}, {"role": "assistant", "content": "嗨"}])
+    converted = []
+
+    def shout(role, content):
+        converted.append(content)
+        return None if role == "system" else f"{role}:{content}"
+
+    assert log.view("shout", shout) == ["assistant:嗨"]
+    log.append({"role": "user", "content": "我很生氣"})
+    assert log.view("shout", shout) == ["assistant:嗨", "user:我很生氣"]
+    assert converted == ["系統", "嗨", "我很生氣"]  # nothing converted twice
+
+    transcript = log.transcript()
+    before = transcript.digest
+    log.append({"role": "assistant", "content": "發生了什麼事？"})
+    assert transcript.text == "You: 我很生氣\n\nAgent: 發生了什麼事？" and transcript.digest != before
+    rebuilt = Transcript()
+    for msg in log:
+        rebuilt.add(msg["role"], msg["content"])
+    assert rebuilt.digest == transcript.digest
+
+    assert log.pop()["content"] == "發生了什麼事？"
+    assert log.view("shout", shout) == ["assistant:嗨", "user:我很生氣"] and log.transcript().digest == before
+    assert [type(m).__name__ for m in openai_2_langchain(log)] == ["SystemMessage", "AIMessage", "HumanMessage"]
+    assert "langchain" not in log._views  # converted per call, not kept on the log
+
+
+def test_abandoned_next_leaves_no_events():
+    """Closing a streamed `next` mid-way rolls back the reframe and logs nothing for it."""
+    from agents.agent_journal_pin import JournalAgent
+
+    agent = JournalAgent(model="sonnet")
+    agent.receive("我今天和媽媽吵架了，很生氣。")
+    agent.reply()
+    events = []
+    agent.on_event = lambda kind, data: events.append(kind)
+    stream = agent.command_stream("next")
+    assert isinstance(next(stream), str)  # the narrative opening has started; the reframe is done
+    stream.close()
+    assert events == [] and agent.reframed_journal is None and agent.phase == "cbt"
+
+    for item in agent.command_stream("next"):
+        pass
+    assert events == ["reframe", "phase"]
+
+
+def test_rolling_summary_reframe_and_recovery(tmp_path):
+    """The rolling CBT summary feeds the reframe, and its event is logged even if that `next` is abandoned."""
+    import time
+    from agents.agent_journal_pin import JournalAgent
+    from agents.session_log import SessionLog
+
+    log = SessionLog(str(tmp_path), fsync_interval=0)
+    agent = JournalAgent(model="sonnet", rolling_summary=True, fused_next=False)
+    log.attach("s1", agent)
+    agent.receive("我今天和媽媽吵架了，很生氣。")
+    agent.reply()
+    agent._summary_future.result()
+
+    summarize, reframe_from_summary = agent._summary_phase.execute, agent._reframe_from_summary_phase.request
+    requests = []
+
+    def summarize_during_command(**kwargs):
+        while agent._held_events is None:  # finish only once `next` is waiting for this update
+            time.sleep(0.001)
+        return summarize(**kwargs)
+
+    agent._summary_phase.execute = summarize_during_command
+    agent._reframe_from_summary_phase.request = lambda **kwargs: requests.append(kwargs) or reframe_from_summary(**kwargs)
+    agent.receive("8")
+    agent.reply()
+    stream = agent.command_stream("next")
+    assert isinstance(next(stream), str)
+    stream.close()
+    assert agent.phase == "cbt" and agent.cbt_summary_stats["updates"] == 2
+    assert requests and requests[0]["summary"] == json.dumps(agent.cbt_summary, ensure_ascii=False)
+
+    log.close()
+    recovered, _ = SessionLog(str(tmp_path), fsync_interval=0).recover()["s1"]
+    assert recovered.to_state() == agent.to_state()
+
+
+def test_session_log_recovery(tmp_path):
+    """Recovery replays the log, drops a torn last line, and gives the same state again after compaction."""
+    from agents.agent_journal_pin import JournalAgent
+    from agents.session_log import SessionLog
+
+    log = SessionLog(str(tmp_path), fsync_interval=0)
+    agent = JournalAgent(model="sonnet")
+    log.attach("s1", agent)
+    for text in ("我今天和媽媽吵架了，很生氣。", "8"):
+        agent.receive(text)
+        agent.reply()
+    expected = agent.to_state()
+    agent.receive("還有一件事")
+    log.close()
+    with open(log.path("s1"), "rb+") as f:  # the crash cut the last event off mid-character
+        f.truncate(f.seek(0, os.SEEK_END) - 5)
+
+    log = SessionLog(str(tmp_path), fsync_interval=0, compact_every=2)
+    agent, _ = log.recover()["s1"]
+    assert log.recovery == {**log.recovery, "sessions": 1, "events": 4, "torn_lines": 1}
+    assert agent.to_state() == expected
+    agent.receive("8")
+    agent.reply()  # the second event since recovery compacts the file to one snapshot
+    assert log.stats["compactions"] == 1
+    with open(log.path("s1"), encoding="utf-8") as f:
+        assert [json.loads(line)["type"] for line in f] == ["snapshot"]
+    log.close()
+
+    recovered, _ = SessionLog(str(tmp_path), fsync_interval=0).recover()["s1"]
+    assert recovered.to_state() == agent.to_state()
+
+
+def test_token_quota():
+    """Usage is billed to the session's user, and a spent daily quota answers 429 before the call."""
+    from api.main import ledger
+
+    user_id = f"quota-test-{os.getpid()}"
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0, "user_id": user_id}).json()["session_id"]
+    reply = send_message(session_id, "我今天和媽媽吵架了，很生氣。")
+    usage = client.get(f"/session/{session_id}/usage").json()
+    assert usage["session"]["calls"] == 1
+    assert usage["today"]["tokens"] == reply["metadata"]["input_tokens"] + reply["metadata"]["output_tokens"] > 0
+
+    quota, ledger.daily_quota = ledger.daily_quota, usage["today"]["tokens"]
+    try:
+        r = client.post(f"/session/{session_id}/message", json={"content": "8"})
+        assert r.status_code == 429 and int(r.headers["retry-after"]) > 0, r.text
+        assert len(client.get(f"/session/{session_id}").json()["messages"]) == 3  # the turn was not stored
+        assert client.post(f"/session/{session_id}/command", json={"command": "next"}).status_code == 429
+        ledger.daily_quota += 1  # room left, but not for the estimated request
+        assert client.post(f"/session/{session_id}/message", json={"content": "8"}).status_code == 429
+    finally:
+        ledger.daily_quota = quota
+    send_message(session_id, "8")
+    roles = [m["role"] for m in client.get(f"/session/{session_id}").json()["messages"]]
+    assert all(a != b for a, b in zip(roles, roles[1:])), roles
+
+
+def test_ledger_flush_keeps_rows_on_error(tmp_path):
+    """Rows that fail to write stay pending and go out with the next flush."""
+    import pytest
+    import sqlite3
+    from agents.ledger import SCHEMA, TokenLedger
+
+    ledger = TokenLedger(str(tmp_path / "ledger.db"), flush_interval=3600)
+    ledger.record("s1", None, "sonnet", 10, 5)
+    ledger._db.execute("DROP TABLE usage")
+    with pytest.raises(sqlite3.Error):
+        ledger.flush()
+    assert ledger.summary()["pending_rows"] == 1
+    ledger._db.executescript(SCHEMA)
+    ledger.close()
+    assert ledger._db.execute("SELECT COUNT(*) FROM usage").fetchone()[0] == 1
+
+
+def test_trace_spans():
+    """A streamed `next` is traced as http → agent.command → reframe / start_narrative → llm calls."""
+    from agents import tracing
+
+    class Collect:
+        def __init__(self):
+            self.spans = []
+
+        def export(self, record):
+            self.spans.append(record)
+
+        def close(self):
+            pass
+
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+    send_message(session_id, "我今天和媽媽吵架了，很生氣。")
+    spans = Collect()
+    tracing.set_exporter(spans)
+    try:
+        stream_lines(f"/session/{session_id}/command/stream", {"command": "next"})
+    finally:
+        tracing.set_exporter(None)
+
+    by_id = {s["span_id"]: s for s in spans.spans}
+    parent = {s["name"]: by_id.get(s["parent_id"], {}).get("name") for s in spans.spans}
+    assert parent["http"] is None and parent["agent.command"] == "http"
+    assert len({s["trace_id"] for s in spans.spans}) == 1
+    command = next(s for s in spans.spans if s["name"] == "agent.command")
+    assert command["attrs"]["command"] == "next" and command["attrs"]["phase_after"] == "narrative"
+    assert command["attrs"]["session_id"] == session_id
+    llm = [s for s in spans.spans if s["name"].startswith("llm.")]
+    assert llm and all(parent_of in ("agent.reframe", "agent.start_narrative", "agent.fused_next")
+                       for parent_of in (by_id[s["parent_id"]]["name"] for s in llm))
+    assert all("queue_wait" in s["attrs"] and s["attrs"]["input_tokens"] > 0 for s in llm)
+
+
+def test_request_profiling(monkeypatch):
+    """X-Profile with the admin token profiles that one request; the result is fetched by id."""
+    import api.main
+
+    monkeypatch.setattr(api.main, "ADMIN_TOKEN", "test-admin-token")
+    admin = {"X-Admin-Token": "test-admin-token"}
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+    r = client.post(f"/session/{session_id}/message", json={"content": "我今天和媽媽吵架了，很生氣。"},
+                    headers={**admin, "X-Profile": "1"})
+    assert r.status_code == 200 and "x-profile-id" in r.headers
+    r2 = client.post(f"/session/{session_id}/message", json={"content": "8"})
+    assert r2.status_code == 200 and "x-profile-id" not in r2.headers  # not without the header
+
+    profile = client.get(f"/admin/profiles/{r.headers['x-profile-id']}", headers=admin).json()
+    assert profile["path"] == f"/session/{session_id}/message" and profile["samples"] > 0
+    assert isinstance(profile["allocations"], list)
+    folded = client.get(f"/admin/profiles/{profile['id']}/folded", headers=admin).text
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+    assert client.get(f"/admin/profiles/{profile['id']}").status_code == 401
+
+
+def test_memory_introspection(monkeypatch):
+    """Per-session memory grows with the conversation and shows up in the aggregate."""
+    import api.main
+
+    monkeypatch.setattr(api.main, "ADMIN_TOKEN", "test-admin-token")
+    admin = {"X-Admin-Token": "test-admin-token"}
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+    before = client.get(f"/admin/memory/{session_id}", headers=admin).json()
+    send_message(session_id, "我今天和媽媽吵架了，很生氣。")
+    after = client.get(f"/admin/memory/{session_id}", headers=admin).json()
+    assert after["messages"]["cbt"] == before["messages"]["cbt"] + 2 == 3
+    assert after["text_bytes"] > before["text_bytes"] and after["deep_bytes"] > before["deep_bytes"]
+
+    report = client.get("/admin/memory", params={"top": 3}, headers=admin).json()
+    assert report["sessions"] >= 1 and len(report["largest"]) <= 3
+    assert report["deep_bytes"] >= after["deep_bytes"]
+
+    from agents.agent_journal_pin import cbt_system_prompt
+    from agents.memory_stats import deep_size
+    assert deep_size(cbt_system_prompt(-0.5, 0.0)) == 0  # shared by every session in the bucket
+    assert client.get("/admin/memory/no-such-session", headers=admin).status_code == 404
+
+
+def test_ready_after_warmup(monkeypatch):
+    """/ready answers 503 until the startup warmup has loaded the LLM libraries, then 200."""
+    import time
+    import api.main
+
+    monkeypatch.setattr(api.main, "draining", False)  # leaving the app's lifespan shuts it down
+    if not api.main.ready.is_set():
+        assert client.get("/ready").status_code == 503  # `client` never ran the app's startup
+    with TestClient(app) as started:
+        deadline = time.time() + 30
+        while (r := started.get("/ready")).status_code == 503 and time.time() < deadline:
+            time.sleep(0.05)
+        assert r.status_code == 200 and r.json()["warmup_seconds"] is not None
+        assert "langchain_anthropic" in sys.modules
+
+
+def test_agent_pool_survives_build_errors(monkeypatch):
+    """A failing build drops its slot instead of killing the pool thread and hanging wait_filled()."""
+    from agents.agent_pool import AgentPool
+
+    pool = AgentPool(models=("sonnet",), size=1)
+    monkeypatch.setattr(pool, "_build", lambda *args: 1 / 0)
+    pool.start()
+    assert pool.wait_filled(timeout=10)
+    assert pool.stats()["failures"] == len(pool._points) and pool.stats()["ready"] == 0
+
+
+def test_shutdown_parks_sessions(monkeypatch, tmp_path):
+    """Shutdown parks live sessions; after a restart each is restored on its first request."""
+    import api.main
+    from agents.session_handoff import HandoffStore, export_session
+
+    monkeypatch.setattr(api.main, "handoff_store", HandoffStore(str(tmp_path)))
+    monkeypatch.setattr(api.main, "draining", False)
+    monkeypatch.setattr(api.main, "sessions", {})  # only this test's session is live
+    with TestClient(app) as started:
+        session_id = started.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+        reply = send_message(session_id, "我今天和媽媽吵架了，很生氣。")["content"]
+    assert session_id not in api.main.sessions and len(api.main.handoff_store) == 1
+    assert client.post("/session", json={"valence": 0, "support_type": 0}).status_code == 503
+
+    # A fresh worker: nothing loaded at startup, the session comes back when it is asked for
+    monkeypatch.setattr(api.main, "draining", False)
+    monkeypatch.setattr(api.main, "moved", {})
+    messages = client.get(f"/session/{session_id}").json()["messages"]
+    assert [m["role"] for m in messages] == ["assistant", "user", "assistant"] and messages[-1]["content"] == reply
+    assert len(api.main.handoff_store) == 0
+
+    # A session forced out mid-turn is parked without its unanswered user message
+    agent = api.main.sessions[session_id][0]
+    agent.receive("其實我只是希望她能聽我說。")
+    state = export_session(session_id, agent, 0.0, busy=True)["state"]
+    assert [m["role"] for m in state["conversations"]["cbt"]][-2:] == ["user", "assistant"]
+
+
+def test_bulk_endpoints(monkeypatch):
+    """Bulk create + bulk messages: a line per item, messages to one session applied in order."""
+    import api.main
+
+    monkeypatch.setattr(api.main, "ADMIN_TOKEN", "test-admin-token")
+    admin = {"X-Admin-Token": "test-admin-token"}
+    r = client.post("/admin/sessions/bulk", headers=admin,
+                    json={"sessions": [{"valence": -0.5, "support_type": 0.0}] * 3})
+    created = [json.loads(line) for line in r.text.splitlines()]
+    assert [c["index"] for c in created] == [0, 1, 2] and all(c["status"] == 200 for c in created)
+
+    turns = ["我今天和媽媽吵架了，很生氣。", "8"]
+    messages = [{"session_id": c["session_id"], "content": t} for t in turns for c in created]
+    messages.append({"session_id": "0" * 32, "content": "hi"})
+    r = client.post("/admin/messages/bulk", headers=admin, json={"messages": messages, "concurrency": 3})
+    results = {line["index"]: line for line in map(json.loads, r.text.splitlines())}
+    assert sorted(results) == list(range(len(messages)))
+    assert results[len(messages) - 1]["status"] == 404
+    assert all(results[i]["status"] == 200 and results[i]["content"] for i in range(len(messages) - 1))
+    for c in created:
+        roles = [m["role"] for m in client.get(f"/session/{c['session_id']}").json()["messages"]]
+        assert roles == ["assistant", "user", "assistant", "user", "assistant"]
+    assert client.post("/admin/messages/bulk", json={"messages": messages}).status_code == 401
+
+
+def test_deferred_summarize(monkeypatch):
+    """A deferred summarize is submitted in a batch and committed to the session when it ends."""
+    import time
+    import api.main
+    from agents.batch import DeferredQueue, LocalBatches
+
+    monkeypatch.setattr(api.main, "deferred", DeferredQueue(LocalBatches(), window=0.05, poll_interval=0.05))
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+    send_message(session_id, "我今天和媽媽吵架了，很生氣。")
+    assert client.post(f"/session/{session_id}/deferred", json={"command": "summarize"}).status_code == 400
+    send_command(session_id, "next")
+    send_message(session_id, "其實我只是希望她能聽我說。")
+
+    r = client.post(f"/session/{session_id}/deferred", json={"command": "summarize"})
+    assert r.status_code == 202 and r.json()["status"] == "queued", r.text
+    for _ in range(200):
+        job = client.get(f"/session/{session_id}/deferred").json()[0]
+        if job["finished"]:
+            break
+        time.sleep(0.05)
+    assert job["status"] == "applied" and job["content"], job
+    assert send_command(session_id, "finalize", {"title": "和媽媽"})["phase"] == "finalize"
+    assert api.main.deferred.stats()["batches_submitted"] == 1
+
+
+def test_deferred_result_reaches_parked_session(monkeypatch, tmp_path):
+    """While draining, a deferred result for a parked session is written into its envelope."""
+    import api.main
+    from agents.session_handoff import HandoffStore, export_session, import_session
+
+    store = HandoffStore(str(tmp_path))
+    monkeypatch.setattr(api.main, "handoff_store", store)
+    monkeypatch.setattr(api.main, "moved", {})
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+    send_message(session_id, "我今天和媽媽吵架了，很生氣。")
+    send_command(session_id, "next")
+    agent, last_access = api.main.sessions[session_id]
+    call = agent.deferred_request("summarize")
+    store.put(export_session(session_id, agent, last_access))
+    api.main.forget_session(session_id)
+    api.main.moved[session_id] = None
+    monkeypatch.setattr(api.main, "draining", True)
+
+    result = api.main.DeferredResult(session_id=session_id, command="summarize", text="摘要", digest=call["digest"])
+    assert api.main.apply_deferred_result(result) == "applied"
+    assert import_session(store.claim(session_id))[0].final_summary == "摘要"
+    assert api.main.apply_deferred_result(result) == "undelivered"
+
+
+def queue_on_gate(gate, granted: list, name: str, priority: str, key: str | None = None):
+    """Start a thread that waits for a slot on `gate`; returns once it is queued."""
+    import threading
+    import time
+
+    def run():
+        with gate.slot(priority, key):
+            granted.append(name)
+
+    queued = len(gate._waiting)
+    thread = threading.Thread(target=run)
+    thread.start()
+    while len(gate._waiting) == queued:
+        time.sleep(0.001)
+    return thread
+
+
+def test_llm_gate_priorities():
+    """A freed slot goes to interactive work first, but background work that waited long enough ages past it."""
+    import time
+    from agents.scheduler import LLMGate, percentile
+
+    for aging, expected in ((0, ["interactive", "background"]), (0.05, ["background", "interactive"])):
+        gate, granted = LLMGate(limit=1, aging=aging), []
+        with gate.slot("interactive"):
+            threads = [queue_on_gate(gate, granted, "background", "background")]
+            time.sleep(0.25)  # five aging steps: past interactive when aging is on
+            threads.append(queue_on_gate(gate, granted, "interactive", "interactive"))
+        for thread in threads:
+            thread.join()
+        assert granted == expected, (aging, granted)
+    assert percentile(list(range(1, 101)), 0.99) == 99 and percentile([1, 2, 3, 4], 0.5) == 2
+
+
+def test_llm_gate_fair_queuing():
+    """A key with many queued calls doesn't starve one with a single call in the same class."""
+    from agents.scheduler import LLMGate
+
+    gate, granted = LLMGate(limit=1, aging=0), []
+    with gate.slot("interactive"):
+        threads = [queue_on_gate(gate, granted, f"busy-{i}", "interactive", "busy") for i in range(5)]
+        threads.append(queue_on_gate(gate, granted, "quiet", "interactive", "quiet"))
+    for thread in threads:
+        thread.join()
+    assert granted == ["busy-0", "quiet", "busy-1", "busy-2", "busy-3", "busy-4"]
+
+
+def test_output_budgets():
+    """Budgets follow observed output once learned; a truncation is reported and lifts the budget."""
+    from agents.output_budget import OutputBudgets
+
+    budgets = OutputBudgets(adaptive=True, margin=1.5, ceiling=1024, min_samples=10)
+    for tokens in range(100, 400, 30):
+        assert budgets.max_tokens("summarize") == 1024
+        budgets.record("summarize", tokens, budgets.max_tokens("summarize"), truncated=False)
+    assert budgets.max_tokens("summarize") == round(370 * 1.5)
+    budgets.record("summarize", 555, 555, truncated=True, queue_key="s1")
+    assert budgets.max_tokens("summarize") == 1024
+    assert budgets.stats()["recent_truncations"][0]["session_id"] == "s1"
+    assert budgets.max_tokens("cbt") == 1024 and budgets.max_tokens(None) == 1024
+    assert OutputBudgets(fixed={"cbt": 300}).max_tokens("cbt") == 300
+
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+    meta = send_message(session_id, "我今天和媽媽吵架了，很生氣。")["metadata"]
+    assert meta["truncated"] is False and meta["max_tokens"] > 0
+    assert client.get("/metrics").json()["output_budgets"]["kinds"]["cbt"]["calls"] >= 1
+
+
+def test_token_estimator():
+    """Estimates are calibrated per model from input_tokens and cached per message on a MessageLog."""
+    from agents.message_log import MessageLog
+    from agents.token_estimate import TokenEstimator, raw_tokens
+
+    messages = [{"role": "user", "content": "我今天和媽媽吵架了，很生氣。"},
+                {"role": "assistant", "content": "Counselor: why?"}]
+    log = MessageLog(messages)
+    assert raw_tokens(log) == raw_tokens(messages) > 0
+    log.append({"role": "user", "content": "因為她不聽我說。"})
+    assert raw_tokens(log) == raw_tokens(list(log)) and log._views["token_estimate"][0] == 3
+
+    estimator = TokenEstimator(alpha=0.5)
+    raw = raw_tokens(log)
+    for _ in range(10):
+        estimator.calibrate("sonnet", raw, round(raw * 1.3))
+    assert abs(estimator.estimate(log, "sonnet") - raw * 1.3) <= 1
+    assert estimator.estimate(log, "opus") == round(raw)
+    assert estimator.stats()["sonnet"]["calls"] == 10
+
+    session_id = client.post("/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+    send_message(session_id, "我今天和媽媽吵架了，很生氣。")
+    assert client.get("/metrics").json()["token_estimator"]["sonnet"]["factor"] > 0
+
+
 if __name__ == "__main__":
     run_api_session()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Multi-process session migration test: drain one API worker into another, then park.
+
+Starts api/mock_anthropic.py and three uvicorn workers (A, B, C) sharing an admin token
+and a handoff directory. A session created on A survives A draining into B (requests to
+A get a 307 to B), and B draining into the handoff store (C adopts it on first request).
+
+    python test_migration.py
+    pytest test_migration.py
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_workers(handoff_dir: str):
+    mock_port = free_port()
+    mock = subprocess.Popen([sys.executable, os.path.join(ROOT, "api", "mock_anthropic.py"), "--port", str(mock_port),
+                             "--latency", "0", "--tps", "0"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    procs, urls = [mock], [f"http://127.0.0.1:{free_port()}" for _ in range(3)]
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("CAMI_", "ANTHROPIC_"))}
+    env.update(ANTHROPIC_BASE_URL=f"http://127.0.0.1:{mock_port}", ANTHROPIC_API_KEY="mock",
+               CAMI_AGENT_POOL_SIZE="0", CAMI_ADMIN_TOKEN=ADMIN["X-Admin-Token"], CAMI_HANDOFF_DIR=handoff_dir)
+    for i, url in enumerate(urls):
+        peers = urls[1] if i == 0 else ""  # A hands off to B; B and C have no peers
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", os.path.join(ROOT, "api"),
+             "--port", url.rsplit(":", 1)[1], "--log-level", "warning"],
+            env={**env, "CAMI_PEERS": peers}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+    wait_ready(f"http://127.0.0.1:{mock_port}/mock/stats", mock)
+    for url, proc in zip(urls, procs[1:]):
+        wait_ready(f"{url}/ready", proc)
+    return urls, procs
+
+
+def run_migration():
+    with tempfile.TemporaryDirectory() as handoff_dir:
+        (a, b, c), procs = start_workers(handoff_dir)
+        try:
+            client = httpx.Client(timeout=30)
+            session_id = client.post(f"{a}/session", json={"valence": -0.5, "support_type": 0.0}).json()["session_id"]
+            r = client.post(f"{a}/session/{session_id}/message", json={"content": "我今天和媽媽吵架了，很生氣。"})
+            assert r.status_code == 200, r.text
+
+            assert client.post(f"{a}/admin/drain", json={}).status_code == 401, "drain must require the admin token"
+            drained = client.post(f"{a}/admin/drain", json={}, headers=ADMIN).json()
+            assert drained["to_peers"] == {b: 1} and drained["remaining"] == 0, drained
+
+            r = client.post(f"{a}/session/{session_id}/message", json={"content": "8"})
+            assert r.status_code == 307 and r.headers["location"] == f"{b}/session/{session_id}/message"
+            r = client.post(r.headers["location"], json={"content": "8"})
+            assert r.status_code == 200, r.text
+            assert client.post(f"{a}/session", json={"valence": 0, "support_type": 0}).status_code == 307
+
+            drained = client.post(f"{b}/admin/drain", json={}, headers=ADMIN).json()
+            assert drained["parked"] == 1, drained
+            assert client.get(f"{b}/session/{session_id}").status_code == 503
+
+            state = client.get(f"{c}/session/{session_id}").json()
+            assert [m["role"] for m in state["messages"]] == ["assistant", "user", "assistant", "user", "assistant"]
+            r = client.post(f"{c}/session/{session_id}/command", json={"command": "next"})
+            assert r.status_code == 200 and r.json()["phase"] == "narrative", r.text
+            print("=== MIGRATION PASSED ===")
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.wait(timeout=10)
+
+
+def test_migration():
+    run_migration()
+
+
+if __name__ == "__main__":
+    run_migration()